@@ -0,0 +1,208 @@
+# battery_cache.py
+
+import os
+import threading
+import time
+from datetime import datetime
+
+from mysql_db import get_db_connection
+
+
+class BatteryStatusCache:
+    """
+    Seneste batteriniveau pr. (patient_id, sensor_id) i hukommelsen.
+    Bruges til at undertrykke uændrede rapporter: en rapport gemmes kun i
+    patient_battery_status, hvis niveauet har flyttet sig mindst `hysteresis`
+    procentpoint siden sidst gemte værdi, eller hvis der er gået `heartbeat_s`
+    sekunder (så tabellen stadig viser, at sensoren lever).
+    Cachen er pr. proces: ved et miss indlæses seneste gemte niveau fra
+    patient_battery_status, før der sammenlignes eller svares. For indlæste niveauer
+    regnes heartbeat fra indlæsningen, og reported_at er ukendt (None).
+    lookup() genindlæser sensorer og patienter, der er mere end `reload_s` sekunder
+    gamle, så niveauer gemt af andre processer også ses her.
+    """
+
+    def __init__(self, hysteresis=2, heartbeat_s=900, reload_s=30):
+        self.hysteresis = hysteresis
+        self.heartbeat_s = heartbeat_s
+        self.reload_s = reload_s
+        self._entries = {}
+        # id → time.monotonic() for seneste indlæsning
+        self._loaded_sensors = {}
+        self._loaded_patients = {}
+        self._lock = threading.Lock()
+
+    def report(self, patient_id, sensor_id, battery_level):
+        """
+        Registrerer en rapport og returnerer True, hvis den skal gemmes i databasen.
+        Kalderen skal efterfølgende kalde mark_persisted(), når INSERT er committet.
+        """
+        key = _key(patient_id, sensor_id)
+        with self._lock:
+            missing = key not in self._entries
+        if missing:
+            self._load_key(patient_id, sensor_id)
+
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = _entry(patient_id, sensor_id, None, None, None)
+            entry["battery_level"] = battery_level
+            entry["reported_at"] = now
+
+            if entry["persisted_level"] is None:
+                return True
+            if abs(float(battery_level) - float(entry["persisted_level"])) >= self.hysteresis:
+                return True
+            return now - entry["persisted_at"] >= self.heartbeat_s
+
+    def mark_persisted(self, patient_id, sensor_id, battery_level):
+        with self._lock:
+            entry = self._entries.get(_key(patient_id, sensor_id))
+            if entry is not None:
+                entry["persisted_level"] = battery_level
+                entry["persisted_at"] = time.time()
+
+    def lookup(self, sensor_ids=(), patient_ids=()):
+        """
+        Returnerer seneste kendte niveau for de ønskede sensorer og/eller patienter.
+        Sensorer og patienter, der ikke er slået op i databasen inden for `reload_s`
+        sekunder, indlæses først.
+        """
+        sensor_ids = {str(s) for s in sensor_ids}
+        patient_ids = {str(p) for p in patient_ids}
+        with self._lock:
+            sensors_to_load = self._stale(sensor_ids, self._loaded_sensors)
+            patients_to_load = self._stale(patient_ids, self._loaded_patients)
+        if sensors_to_load or patients_to_load:
+            self._load(sensors_to_load, patients_to_load)
+
+        with self._lock:
+            entries = [
+                dict(e) for e in self._entries.values()
+                if str(e["sensor_id"]) in sensor_ids or str(e["patient_id"]) in patient_ids
+            ]
+        return [
+            {
+                "patient_id":    e["patient_id"],
+                "sensor_id":     e["sensor_id"],
+                "battery_level": e["battery_level"],
+                "reported_at":   (datetime.utcfromtimestamp(e["reported_at"]).isoformat()
+                                  if e["reported_at"] is not None else None),
+            }
+            for e in entries
+        ]
+
+    # ── Indlæsning fra patient_battery_status ─────────────────────
+
+    def _stale(self, ids, loaded):
+        cutoff = time.monotonic() - self.reload_s
+        return {i for i in ids if loaded.get(i, cutoff) <= cutoff}
+
+    def _load_key(self, patient_id, sensor_id):
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("""
+                SELECT patient_id, sensor_id, battery_level
+                FROM patient_battery_status
+                WHERE patient_id = %s
+                  AND sensor_id <=> %s
+                ORDER BY id DESC
+                LIMIT 1
+            """, (patient_id, sensor_id))
+            rows = cursor.fetchall()
+        finally:
+            cursor.close()
+            conn.close()
+        self._remember(rows)
+
+    def _load(self, sensor_ids, patient_ids):
+        started = time.time()
+        loaded_at = time.monotonic()
+        rows = []
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            for sensor_id in sorted(sensor_ids):
+                cursor.execute("""
+                    SELECT patient_id, sensor_id, battery_level
+                    FROM patient_battery_status
+                    WHERE sensor_id = %s
+                    ORDER BY id DESC
+                    LIMIT 1
+                """, (sensor_id,))
+                rows.extend(cursor.fetchall())
+            for patient_id in sorted(patient_ids):
+                # Seneste række pr. sensor hos patienten
+                cursor.execute("""
+                    SELECT b.patient_id, b.sensor_id, b.battery_level
+                    FROM patient_battery_status AS b
+                    JOIN (
+                        SELECT MAX(id) AS id
+                        FROM patient_battery_status
+                        WHERE patient_id = %s
+                        GROUP BY sensor_id
+                    ) AS latest
+                      ON latest.id = b.id
+                """, (patient_id,))
+                rows.extend(cursor.fetchall())
+        finally:
+            cursor.close()
+            conn.close()
+        self._remember(rows, refreshed_since=started)
+        with self._lock:
+            self._loaded_sensors.update(dict.fromkeys(sensor_ids, loaded_at))
+            self._loaded_patients.update(dict.fromkeys(patient_ids, loaded_at))
+
+    def _remember(self, rows, refreshed_since=None):
+        """
+        Lægger gemte niveauer i cachen. Med `refreshed_since` (en genindlæsning)
+        overskrives kendte niveauer også – dog aldrig rapporter modtaget i denne
+        proces efter, at forespørgslen startede.
+        """
+        now = time.time()
+        with self._lock:
+            for patient_id, sensor_id, battery_level in rows:
+                key = _key(patient_id, sensor_id)
+                entry = self._entries.get(key)
+                if entry is None:
+                    self._entries[key] = _entry(patient_id, sensor_id, battery_level, battery_level, now)
+                    continue
+                if refreshed_since is None:
+                    continue
+                if entry["persisted_level"] != battery_level and (
+                    entry["persisted_at"] is None or entry["persisted_at"] < refreshed_since
+                ):
+                    # En anden proces har gemt et nyere niveau
+                    entry["persisted_level"] = battery_level
+                    entry["persisted_at"] = now
+                if entry["battery_level"] != battery_level and (
+                    entry["reported_at"] is None or entry["reported_at"] < refreshed_since
+                ):
+                    entry["battery_level"] = battery_level
+                    entry["reported_at"] = None
+
+
+def _key(patient_id, sensor_id):
+    # Klienten sender id'er som tal eller strenge; databasen returnerer dem typet
+    return str(patient_id), None if sensor_id is None else str(sensor_id)
+
+
+def _entry(patient_id, sensor_id, battery_level, persisted_level, persisted_at):
+    return {
+        "patient_id": patient_id,
+        "sensor_id": sensor_id,
+        "battery_level": battery_level,
+        "reported_at": None,
+        "persisted_level": persisted_level,
+        "persisted_at": persisted_at,
+    }
+
+
+battery_cache = BatteryStatusCache(
+    hysteresis=float(os.environ.get("BATTERY_HYSTERESIS", 2)),
+    heartbeat_s=float(os.environ.get("BATTERY_HEARTBEAT_S", 900)),
+    reload_s=float(os.environ.get("BATTERY_RELOAD_S", 30)),
+)
@@ -0,0 +1,240 @@
+# circadian_metrics.py
+#
+# Døgnrytme‐relaterede lysmål for en patient over en periode, beregnet
+# vektoriseret med NumPy på én indlæsning af serien fra patient_light_sensor_data:
+#   - tid over tærskel (illuminance og melanopisk EDI), i alt og pr. døgn
+#   - mean light timing (MLiT) over tærsklen, Reid et al. 2014
+#   - interdaily stability (IS) og intradaily variability (IV) på timemiddelværdier
+#     af log10(lux + 1), Witting et al. 1990
+#   - melanopisk dosis (mEDI·timer) pr. tidsvindue på døgnet
+# Alle døgn‐ og klokkeslætsberegninger sker i lokal tid (Europe/Copenhagen).
+
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, time, timedelta
+
+import numpy as np
+import pytz
+
+from mysql_db import get_db_connection
+from light_metrics import LOCAL_TZ, local_seconds
+from light_validators import light_validators
+from light_pages import STREAM_CHUNK_ROWS
+
+DEFAULT_LUX_THRESHOLD = 1000.0
+DEFAULT_EDI_THRESHOLD = 250.0
+# En måling repræsenterer tiden til næste måling, dog højst så længe
+MAX_SAMPLE_SPAN_S = 600
+# Tidsvinduer for melanopisk dosis: (navn, fra time, til time) i lokal tid
+DOSE_WINDOWS = (
+    ("morning",   6, 12),
+    ("afternoon", 12, 18),
+    ("evening",   18, 23),
+    ("night",     23, 6),
+)
+
+
+def _load_series(conn, patient_id, start_dt, end_dt, chunk_size=STREAM_CHUNK_ROWS):
+    """Læser (captured_at, melanopic_edi, illuminance) for perioden direkte ind i arrays."""
+    cursor = conn.cursor()
+    ts, edi, lux = [], [], []
+    try:
+        cursor.execute("""
+            SELECT captured_at, melanopic_edi, illuminance
+            FROM patient_light_sensor_data
+            WHERE patient_id   = %s
+              AND captured_at >= %s
+              AND captured_at <  %s
+            ORDER BY captured_at ASC
+        """, (patient_id, start_dt, end_dt))
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            for captured_at, e, l in rows:
+                ts.append(captured_at)
+                edi.append(np.nan if e is None else float(e))
+                lux.append(np.nan if l is None else float(l))
+    finally:
+        cursor.close()
+    return np.array(ts, dtype="datetime64[s]"), np.array(edi, dtype=float), np.array(lux, dtype=float)
+
+
+def _sample_spans(utc_seconds, end_seconds):
+    """Sekunder hver måling repræsenterer: tid til næste måling, højst MAX_SAMPLE_SPAN_S."""
+    spans = np.diff(utc_seconds, append=end_seconds).astype(float)
+    return np.clip(spans, 0, MAX_SAMPLE_SPAN_S)
+
+
+def _interdaily_stability(hour_index, values):
+    """IS og IV på timemiddelværdier; timer uden målinger indgår ikke."""
+    hours, inverse = np.unique(hour_index, return_inverse=True)
+    if len(hours) < 48:
+        return None, None
+    hourly = np.bincount(inverse, weights=values) / np.bincount(inverse)
+    mean = hourly.mean()
+    variance = np.sum((hourly - mean) ** 2)
+    if variance == 0:
+        return None, None
+    n = len(hourly)
+
+    clock_hour = hours % 24
+    profile_sum = np.bincount(clock_hour, weights=hourly, minlength=24)
+    profile_count = np.bincount(clock_hour, minlength=24)
+    present = profile_count > 0
+    profile = profile_sum[present] / profile_count[present]
+    # Witting: n·Σ(x̄h − x̄)² / (p·Σ(xi − x̄)²). Med lige mange dage pr. klokkeslæt er det
+    # variansen mellem klokkeslæt over den samlede varians; mangler der timer, vægtes
+    # hvert klokkeslæt med sit antal timer.
+    interdaily = np.sum(profile_count[present] * (profile - mean) ** 2) / variance
+
+    consecutive = np.diff(hours) == 1
+    diffs = np.diff(hourly)[consecutive]
+    intradaily = n * np.sum(diffs ** 2) / ((n - 1) * variance) if len(diffs) else None
+    return round(float(interdaily), 4), (round(float(intradaily), 4) if intradaily is not None else None)
+
+
+def compute_circadian_metrics(ts, edi, lux, end_dt, lux_threshold=DEFAULT_LUX_THRESHOLD,
+                              edi_threshold=DEFAULT_EDI_THRESHOLD):
+    """
+    Beregner alle mål på én serie (arrays fra _load_series). Returnerer et JSON‐venligt dict.
+    """
+    if len(ts) == 0:
+        return {"samples": 0}
+
+    utc = ts.astype(np.int64)
+    local = local_seconds(ts)
+    spans = _sample_spans(utc, np.datetime64(end_dt, "s").astype(np.int64))
+    local_day = local // 86400
+    clock = (local % 86400) / 3600.0
+    days, day_index = np.unique(local_day, return_inverse=True)
+
+    with np.errstate(invalid="ignore"):
+        above_lux = lux >= lux_threshold
+        above_edi = edi >= edi_threshold
+
+    # Tid over tærskel, i alt og pr. døgn (minutter)
+    tat_lux_day = np.bincount(day_index, weights=spans * above_lux, minlength=len(days)) / 60.0
+    tat_edi_day = np.bincount(day_index, weights=spans * above_edi, minlength=len(days)) / 60.0
+
+    # MLiT: gennemsnitligt lokalt klokkeslæt for tid over tærsklen, pr. døgn og samlet
+    weight = spans * above_lux
+    weight_day = np.bincount(day_index, weights=weight, minlength=len(days))
+    clock_day = np.bincount(day_index, weights=weight * clock, minlength=len(days))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mlit_day = np.where(weight_day > 0, clock_day / weight_day, np.nan)
+    mlit = float(np.nanmean(mlit_day)) if np.any(weight_day > 0) else None
+
+    # IS/IV på timemiddelværdier af log10(lux + 1)
+    valid = ~np.isnan(lux)
+    interdaily, intradaily = _interdaily_stability(local[valid] // 3600, np.log10(lux[valid] + 1.0))
+
+    # Melanopisk dosis (mEDI·timer) pr. tidsvindue
+    edi_hours = np.nan_to_num(edi) * spans / 3600.0
+    dose = {}
+    for name, start_hour, end_hour in DOSE_WINDOWS:
+        if start_hour < end_hour:
+            in_window = (clock >= start_hour) & (clock < end_hour)
+        else:
+            in_window = (clock >= start_hour) | (clock < end_hour)
+        dose[name] = round(float(edi_hours[in_window].sum()), 2)
+    dose_day = np.bincount(day_index, weights=edi_hours, minlength=len(days))
+
+    def round_or_none(x, digits=2):
+        return None if x is None or np.isnan(x) else round(float(x), digits)
+
+    per_day = [{
+        "date": str(np.datetime64(int(day), "D")),
+        "minutes_above_lux_threshold": round(float(tat_lux_day[i]), 1),
+        "minutes_above_edi_threshold": round(float(tat_edi_day[i]), 1),
+        "mean_light_timing": round_or_none(mlit_day[i]),
+        "melanopic_dose": round(float(dose_day[i]), 2),
+    } for i, day in enumerate(days)]
+
+    return {
+        "samples": int(len(ts)),
+        "days": int(len(days)),
+        "lux_threshold": lux_threshold,
+        "edi_threshold": edi_threshold,
+        "minutes_above_lux_threshold": round(float(tat_lux_day.sum()), 1),
+        "minutes_above_edi_threshold": round(float(tat_edi_day.sum()), 1),
+        "mean_light_timing": round_or_none(mlit),
+        "interdaily_stability": interdaily,
+        "intradaily_variability": intradaily,
+        "melanopic_dose": round(float(dose_day.sum()), 2),
+        "melanopic_dose_by_window": dose,
+        "per_day": per_day,
+    }
+
+
+def local_day_range(first_day, last_day):
+    """Naive UTC‐grænser for de lokale døgn first_day..last_day (begge inklusive)."""
+    start = LOCAL_TZ.localize(datetime.combine(first_day, time()))
+    end = LOCAL_TZ.localize(datetime.combine(last_day + timedelta(days=1), time()))
+    return (start.astimezone(pytz.utc).replace(tzinfo=None),
+            end.astimezone(pytz.utc).replace(tzinfo=None))
+
+
+class CircadianMetricsMemo:
+    """
+    Husker beregnede mål pr. (patient, periode, tærskler). Nøglen indeholder
+    periodens ETag fra light_validators, så sene målinger giver en ny nøgle,
+    og forældede resultater glider ud som de mindst brugte.
+    """
+
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0}
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, entries=len(self._entries))
+
+
+circadian_memo = CircadianMetricsMemo(
+    max_entries=int(os.environ.get("CIRCADIAN_MEMO_ENTRIES", 512)),
+)
+
+
+def circadian_metrics(patient_id, first_day, last_day, lux_threshold=DEFAULT_LUX_THRESHOLD,
+                      edi_threshold=DEFAULT_EDI_THRESHOLD):
+    """
+    Mål for patientens lokale døgn first_day..last_day. Serien indlæses kun,
+    hvis resultatet ikke allerede er beregnet for periodens nuværende data.
+    """
+    start_dt, end_dt = local_day_range(first_day, last_day)
+    etag, _ = light_validators.validator("circadian", patient_id, start_dt, end_dt)
+    key = (patient_id, start_dt, end_dt, lux_threshold, edi_threshold, etag)
+    result = circadian_memo.get(key)
+    if result is not None:
+        return result
+
+    conn = get_db_connection()
+    try:
+        ts, edi, lux = _load_series(conn, patient_id, start_dt, end_dt)
+    finally:
+        conn.close()
+    result = compute_circadian_metrics(ts, edi, lux, end_dt, lux_threshold, edi_threshold)
+    result.update({"patient_id": patient_id, "from": first_day.isoformat(), "to": last_day.isoformat()})
+    circadian_memo.put(key, result)
+    return result
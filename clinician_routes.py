@@ -3,10 +3,20 @@
 from flask import Blueprint, request, jsonify, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
 from mysql_db import get_db_connection
+from sensor_sessions import active_sessions_for_clinician
+from sensor_liveness import offline_sensors_for_clinician, OFFLINE_AFTER_MIN
+from light_rollups import fetch_cohort_rollups
+from light_export import light_exports, export_job_json, parse_export_params, ExportError
+from light_formats import FormatUnavailable
+from datetime import datetime, timedelta, timezone
 
 # Blueprint‐definition
 clinician_bp = Blueprint("clinician_bp", __name__)
 
+# Eksportpuljen og dens vedligeholdelse (genoptagelse, oprydning) startes, når appen
+# registrerer blueprintet – ikke først ved næste eksportbestilling.
+clinician_bp.record_once(lambda state: light_exports.start())
+
 @clinician_bp.route("/patients", methods=["GET"])
 @jwt_required()
 def get_clinician_patients():
@@ -128,3 +138,218 @@ def get_patient_detail_for_clinician(patient_id):
         current_app.logger.error(f"get_patient_detail_for_clinician fejl: {e}", exc_info=True)
         return jsonify({"error": "Serverfejl ved hentning af patient‐detaljer"}), 500
 
+
+@clinician_bp.route("/active-sensors", methods=["GET"])
+@jwt_required()
+def get_active_sensors():
+    """
+    GET /api/clinician/active-sensors
+    Returnerer de af klinikerens patienter, der har en aktiv sensor‐session lige nu.
+    """
+    try:
+        current = get_jwt_identity()
+        if isinstance(current, str):
+            clinician_id = current
+            role = get_jwt().get("role", None)
+        else:
+            clinician_id = current.get("id")
+            role = current.get("role")
+
+        if role != "clinician" or not clinician_id:
+            return jsonify({"error": "Ikke autoriseret"}), 403
+
+        conn = get_db_connection()
+        cursor = conn.cursor(dictionary=True)
+        try:
+            rows = active_sessions_for_clinician(cursor, clinician_id)
+        finally:
+            cursor.close()
+            conn.close()
+
+        result = [
+            {
+                "patient_id": row["patient_id"],
+                "sensor_id":  row["sensor_id"],
+                "log_id":     row["log_id"],
+                "started_at": row["started_at"].isoformat(),
+            }
+            for row in rows
+        ]
+        return jsonify(result), 200
+
+    except Exception as e:
+        current_app.logger.error(f"get_active_sensors fejl: {e}", exc_info=True)
+        return jsonify({"error": "Serverfejl ved hentning af aktive sensorer"}), 500
+
+
+@clinician_bp.route("/offline-sensors", methods=["GET"])
+@jwt_required()
+def get_offline_sensors():
+    """
+    GET /api/clinician/offline-sensors?silent_minutes=<n>
+    Returnerer sensorer med en åben session hos klinikerens patienter, som ikke har
+    sendt data i mindst `silent_minutes` minutter (standard SENSOR_OFFLINE_AFTER_MIN).
+    Slås op i patient_sensor_liveness – ingen scanning af lysdata.
+    """
+    try:
+        current = get_jwt_identity()
+        if isinstance(current, str):
+            clinician_id = current
+            role = get_jwt().get("role", None)
+        else:
+            clinician_id = current.get("id")
+            role = current.get("role")
+
+        if role != "clinician" or not clinician_id:
+            return jsonify({"error": "Ikke autoriseret"}), 403
+
+        try:
+            silent_minutes = int(request.args.get("silent_minutes", OFFLINE_AFTER_MIN))
+        except ValueError:
+            return jsonify({"error": "silent_minutes skal være et heltal"}), 400
+        if silent_minutes < 1:
+            return jsonify({"error": "silent_minutes skal være mindst 1"}), 400
+
+        conn = get_db_connection()
+        cursor = conn.cursor(dictionary=True)
+        rows = offline_sensors_for_clinician(cursor, clinician_id, silent_minutes)
+        conn.close()
+
+        result = [
+            {
+                "patient_id":       row["patient_id"],
+                "sensor_id":        row["sensor_id"],
+                "log_id":           row["log_id"],
+                "started_at":       row["started_at"].isoformat(),
+                "last_seen_at":     row["last_seen_at"].isoformat() if row["last_seen_at"] else None,
+                "last_received_at": row["last_received_at"].isoformat() if row["last_received_at"] else None,
+                "silent_minutes":   int(row["silent_minutes"]),
+                # Ingen data overhovedet, siden sessionen blev startet
+                "no_data_in_session": (
+                    row["last_received_at"] is None or row["last_received_at"] < row["started_at"]
+                ),
+            }
+            for row in rows
+        ]
+        return jsonify(result), 200
+
+    except Exception as e:
+        current_app.logger.error(f"get_offline_sensors fejl: {e}", exc_info=True)
+        return jsonify({"error": "Serverfejl ved hentning af tavse sensorer"}), 500
+
+
+@clinician_bp.route("/light-summary", methods=["GET"])
+@jwt_required()
+def get_cohort_light_summary():
+    """
+    GET /api/clinician/light-summary?from=<ISO8601>&to=<ISO8601>
+    Lyseksponering for alle klinikerens patienter i ét kald (standard: i dag, UTC).
+    Beregnes med én grupperet forespørgsel over patient_light_rollups i stedet for
+    ét /lightdata/daily‐kald pr. patient.
+    """
+    try:
+        current = get_jwt_identity()
+        if isinstance(current, str):
+            clinician_id = current
+            role = get_jwt().get("role", None)
+        else:
+            clinician_id = current.get("id")
+            role = current.get("role")
+
+        if role != "clinician" or not clinician_id:
+            return jsonify({"error": "Ikke autoriseret"}), 403
+
+        from_param = request.args.get("from")
+        to_param   = request.args.get("to")
+        if from_param and to_param:
+            try:
+                from_dt = datetime.fromisoformat(from_param.replace("Z", "+00:00"))
+                to_dt   = datetime.fromisoformat(to_param.replace("Z", "+00:00"))
+            except ValueError:
+                return jsonify({"error": 'Parametrene "from" og "to" skal være i ISO8601-format'}), 400
+            if from_dt.tzinfo is not None:
+                from_dt = from_dt.astimezone(timezone.utc).replace(tzinfo=None)
+            if to_dt.tzinfo is not None:
+                to_dt = to_dt.astimezone(timezone.utc).replace(tzinfo=None)
+            if to_dt <= from_dt:
+                return jsonify({"error": '"to" skal ligge efter "from"'}), 400
+        else:
+            today = datetime.utcnow().date()
+            from_dt = datetime(today.year, today.month, today.day)
+            to_dt   = from_dt + timedelta(days=1)
+
+        conn = get_db_connection()
+        cursor = conn.cursor(dictionary=True)
+        start_dt, end_dt, rows = fetch_cohort_rollups(cursor, clinician_id, from_dt, to_dt)
+        conn.close()
+
+        def num(value):
+            return round(float(value), 2) if value is not None else None
+
+        patients = []
+        for row in rows:
+            total = int(row["total_measurements"])
+            patients.append({
+                "patient_id":            row["patient_id"],
+                "first_name":            row["first_name"],
+                "last_name":             row["last_name"],
+                "total_measurements":    total,
+                "count_high_light":      int(row["count_high_light"]),
+                "count_low_light":       int(row["count_low_light"]),
+                "action_required_count": int(row["action_required_count"]),
+                "mean_melanopic_edi":    num(row["mean_melanopic_edi"]),
+                "max_melanopic_edi":     num(row["max_melanopic_edi"]),
+                "mean_illuminance":      num(row["mean_illuminance"]),
+                "mean_exposure_score":   num(row["mean_exposure_score"]),
+                "high_light_share":      round(int(row["count_high_light"]) / total, 4) if total else None,
+                "last_bucket":           row["last_bucket"].isoformat() if row["last_bucket"] else None,
+            })
+
+        return jsonify({
+            "from":     start_dt.isoformat(),
+            "to":       end_dt.isoformat(),
+            "patients": patients,
+        }), 200
+
+    except Exception as e:
+        current_app.logger.error(f"get_cohort_light_summary fejl: {e}", exc_info=True)
+        return jsonify({"error": "Serverfejl ved hentning af lysoversigt"}), 500
+
+
+@clinician_bp.route("/light-exports", methods=["POST"])
+@jwt_required()
+def create_cohort_light_export():
+    """
+    POST /api/clinician/light-exports
+    Body: {"from": <ISO8601>, "to": <ISO8601>, "format": "csv"|"parquet", "gzip": true|false}
+    Opretter et eksportjob med lyshistorikken for alle klinikerens patienter (én fil,
+    kolonnen patient_id skelner dem) og svarer 202 med det samme. Fremdrift og download:
+    GET /api/patients/lightdata/exports/<job_id>[/download].
+    """
+    try:
+        current = get_jwt_identity()
+        if isinstance(current, str):
+            clinician_id = current
+            role = get_jwt().get("role", None)
+        else:
+            clinician_id = current.get("id")
+            role = current.get("role")
+
+        if role != "clinician" or not clinician_id:
+            return jsonify({"error": "Ikke autoriseret"}), 403
+
+        try:
+            from_dt, to_dt, fmt, gzipped = parse_export_params(request.get_json(silent=True) or {})
+            job = light_exports.submit(clinician_id, "cohort", clinician_id, from_dt, to_dt, fmt, gzipped)
+        except ExportError as e:
+            return jsonify({"error": str(e)}), 400
+        except FormatUnavailable as e:
+            return jsonify({"error": str(e)}), 501
+
+        response = jsonify(export_job_json(job))
+        response.headers["Location"] = f"/api/patients/lightdata/exports/{job['job_id']}"
+        return response, 202
+
+    except Exception as e:
+        current_app.logger.error(f"create_cohort_light_export fejl: {e}", exc_info=True)
+        return jsonify({"error": "Serverfejl ved oprettelse af kohorteeksport"}), 500
@@ -10,6 +10,9 @@ from models.light_data import LightData
 from models import Customer
 from models.chronotype import Chronotype
 from werkzeug.security import generate_password_hash
+from singleflight_cache import customer_light_cache
+from mysql_db import get_db_connection
+from datetime import datetime
 import logging
 from flask import current_app
 
@@ -171,6 +174,84 @@ def delete_customer(customer_id):
     current_app.logger.info("  -> delete+archive succeeded for id=%d", customer_id)
     return jsonify({"success": True, "message": "Bruger slettet og anonymiseret"}), 200
 
+
+# ── Fælles kunde‐lysdata (P3) ──────────────────────────────────────
+# Aggregaterne er ens for alle kunder, så de beregnes højst én gang pr.
+# CUSTOMER_LIGHT_CACHE_TTL_S og fornyes i baggrunden (se singleflight_cache.py).
+# Forespørgslerne går direkte via get_db_connection som i de øvrige lysdata‐routes,
+# så baggrundsfornyelsen ikke kræver en app‐context.
+
+CUSTOMER_LIGHT_PATIENT = "P3"
+
+# Loadernes SQL som modul‐konstanter, så query_plans.py kan importere og EXPLAIN'e dem
+CUSTOMER_DAILY_SQL = """
+    SELECT HOUR(captured_at), AVG(melanopic_edi), AVG(lux_level), AVG(exposure_score),
+           SUM(action_required)
+    FROM patient_light_sensor_data
+    WHERE patient_id = %s
+    GROUP BY HOUR(captured_at)
+    ORDER BY HOUR(captured_at)
+"""
+
+CUSTOMER_WEEKLY_SQL = """
+    SELECT DAYOFWEEK(captured_at) - 1, AVG(melanopic_edi), AVG(lux_level), AVG(exposure_score),
+           SUM(action_required)
+    FROM patient_light_sensor_data
+    WHERE patient_id = %s
+    GROUP BY DAYOFWEEK(captured_at) - 1
+    ORDER BY DAYOFWEEK(captured_at) - 1
+"""
+
+# Halvåbent interval på captured_at i stedet for YEAR()/MONTH(), så indekset kan bruges
+CUSTOMER_MONTHLY_SQL = """
+    SELECT DAY(captured_at), AVG(melanopic_edi), AVG(lux_level), AVG(exposure_score),
+           SUM(action_required)
+    FROM patient_light_sensor_data
+    WHERE patient_id = %s
+      AND captured_at >= %s
+      AND captured_at <  %s
+    GROUP BY DAY(captured_at)
+    ORDER BY DAY(captured_at)
+"""
+
+def _aggregate_row(row):
+    _, avg_edi, avg_lux, avg_exposure, actions = row
+    return {
+        "average_melanopic_edi": float(avg_edi or 0.0),
+        "average_lux": float(avg_lux or 0.0),
+        "average_exposure_score": float(avg_exposure or 0.0),
+        "action_required_count": int(actions or 0),
+    }
+
+
+def _fetch_customer_rows(sql, params):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def _load_customer_daily():
+    rows = _fetch_customer_rows(CUSTOMER_DAILY_SQL, (CUSTOMER_LIGHT_PATIENT,))
+    return [{"hour": row[0], **_aggregate_row(row)} for row in rows]
+
+
+def _load_customer_weekly():
+    rows = _fetch_customer_rows(CUSTOMER_WEEKLY_SQL, (CUSTOMER_LIGHT_PATIENT,))
+    return [{"weekday_index": row[0], **_aggregate_row(row)} for row in rows]
+
+
+def _load_customer_monthly(year, month):
+    start = datetime(year, month, 1)
+    end = datetime(year + month // 12, month % 12 + 1, 1)
+    rows = _fetch_customer_rows(CUSTOMER_MONTHLY_SQL, (CUSTOMER_LIGHT_PATIENT, start, end))
+    return [{"day": row[0], **_aggregate_row(row)} for row in rows]
+
+
 @customer_bp.route('/lightdata/daily', methods=['GET'])
 @jwt_required()
 def get_customer_daily_lightdata():
@@ -189,21 +270,11 @@ def get_customer_daily_lightdata():
             "message": "Ugyldig token eller tomt identity."
         }), 401
 
-    # 2) Hent aggregeret dagsdata for P3 (hardkodet patient_id= 'P3')
-    #    Vi antager, at P3’s patient_id i tabellen er strengen 'P3'.
+    # 2) Hent aggregeret dagsdata for P3 (hardkodet patient_id= 'P3').
+    #    Resultatet er ens for alle kunder og deles via customer_light_cache.
     try:
-        rows = (
-            db.session.query(
-                func.hour(LightSensorData.captured_at).label('hour_utc'),
-                func.avg(LightSensorData.melanopic_edi).label('avg_edi'),
-                func.avg(LightSensorData.lux_level).label('avg_lux'),
-                func.avg(LightSensorData.exposure_score).label('avg_exposure'),
-                func.sum(LightSensorData.action_required).label('actions')
-            )
-            .filter(LightSensorData.patient_id == 'P3')
-            .group_by(func.hour(LightSensorData.captured_at))
-            .order_by(func.hour(LightSensorData.captured_at))
-            .all()
+        daily_list = customer_light_cache.get(
+            "daily", _load_customer_daily
         )
     except Exception as e:
         return jsonify({
@@ -211,16 +282,6 @@ def get_customer_daily_lightdata():
             "message": f"Fejl ved hentning af dagsdata: {str(e)}"
         }), 500
 
-    daily_list = []
-    for row in rows:
-        daily_list.append({
-            "hour": row.hour_utc,
-            "average_melanopic_edi": float(row.avg_edi or 0.0),
-            "average_lux": float(row.avg_lux or 0.0),
-            "average_exposure_score": float(row.avg_exposure or 0.0),
-            "action_required_count": int(row.actions or 0),
-        })
-
     return jsonify({
         "success": True,
         "data": daily_list
@@ -244,18 +305,8 @@ def get_customer_weekly_lightdata():
         }), 401
 
     try:
-        rows = (
-            db.session.query(
-                (func.dayofweek(LightSensorData.captured_at) - 1).label('weekday'),
-                func.avg(LightSensorData.melanopic_edi).label('avg_edi'),
-                func.avg(LightSensorData.lux_level).label('avg_lux'),
-                func.avg(LightSensorData.exposure_score).label('avg_exposure'),
-                func.sum(LightSensorData.action_required).label('actions')
-            )
-            .filter(LightSensorData.patient_id == 'P3')
-            .group_by((func.dayofweek(LightSensorData.captured_at) - 1))
-            .order_by((func.dayofweek(LightSensorData.captured_at) - 1))
-            .all()
+        weekly_list = customer_light_cache.get(
+            "weekly", _load_customer_weekly
         )
     except Exception as e:
         return jsonify({
@@ -263,16 +314,6 @@ def get_customer_weekly_lightdata():
             "message": f"Fejl ved hentning af ugentlige data: {str(e)}"
         }), 500
 
-    weekly_list = []
-    for row in rows:
-        weekly_list.append({
-            "weekday_index": row.weekday,
-            "average_melanopic_edi": float(row.avg_edi or 0.0),
-            "average_lux": float(row.avg_lux or 0.0),
-            "average_exposure_score": float(row.avg_exposure or 0.0),
-            "action_required_count": int(row.actions or 0),
-        })
-
     return jsonify({
         "success": True,
         "data": weekly_list
@@ -301,20 +342,9 @@ def get_customer_monthly_lightdata():
     month = now_utc.month
 
     try:
-        rows = (
-            db.session.query(
-                func.day(LightSensorData.captured_at).label('day'),
-                func.avg(LightSensorData.melanopic_edi).label('avg_edi'),
-                func.avg(LightSensorData.lux_level).label('avg_lux'),
-                func.avg(LightSensorData.exposure_score).label('avg_exposure'),
-                func.sum(LightSensorData.action_required).label('actions')
-            )
-            .filter(LightSensorData.patient_id == 'P3')
-            .filter(func.year(LightSensorData.captured_at) == year)
-            .filter(func.month(LightSensorData.captured_at) == month)
-            .group_by(func.day(LightSensorData.captured_at))
-            .order_by(func.day(LightSensorData.captured_at))
-            .all()
+        monthly_list = customer_light_cache.get(
+            ("monthly", year, month),
+            lambda: _load_customer_monthly(year, month),
         )
     except Exception as e:
         return jsonify({
@@ -322,16 +352,6 @@ def get_customer_monthly_lightdata():
             "message": f"Fejl ved hentning af månedlige data: {str(e)}"
         }), 500
 
-    monthly_list = []
-    for row in rows:
-        monthly_list.append({
-            "day": row.day,
-            "average_melanopic_edi": float(row.avg_edi or 0.0),
-            "average_lux": float(row.avg_lux or 0.0),
-            "average_exposure_score": float(row.avg_exposure or 0.0),
-            "action_required_count": int(row.actions or 0),
-        })
-
     return jsonify({
         "success": True,
         "data": monthly_list
@@ -0,0 +1,139 @@
+# device_registry.py
+
+import os
+import threading
+import time
+
+from mysql_db import get_db_connection
+
+
+class DeviceRegistry:
+    """
+    Proces‐global cache over patient_sensors: device_serial ↔ sensor_id ↔ patient_id.
+    Varmes op med ét SELECT (når sensor_bp registreres, ellers ved første opslag) og
+    holdes ajour, når register_sensor_use opretter nye sensorer. Et opslag, der ikke
+    findes i cachen, slås op i databasen og tilføjes – så sensorer oprettet af andre
+    workers også findes. Ukendte serienumre huskes i `negative_ttl_s` sekunder, så
+    gentagne opslag på dem ikke giver en databaserunde hver gang.
+    """
+
+    def __init__(self, negative_ttl_s=30):
+        self.negative_ttl_s = negative_ttl_s
+        self._by_serial = {}
+        self._by_sensor = {}
+        self._by_patient = {}
+        # device_serial → time.monotonic(), hvor "findes ikke" udløber
+        self._unknown_serials = {}
+        self._warm = False
+        self._lock = threading.Lock()
+
+    def warm(self):
+        """Indlæser hele patient_sensors i ét opslag."""
+        conn = get_db_connection()
+        cursor = conn.cursor(dictionary=True)
+        try:
+            cursor.execute("SELECT id, patient_id, device_serial FROM patient_sensors ORDER BY id")
+            rows = cursor.fetchall()
+        finally:
+            cursor.close()
+            conn.close()
+
+        with self._lock:
+            self._by_serial.clear()
+            self._by_sensor.clear()
+            self._by_patient.clear()
+            self._unknown_serials.clear()
+            for row in rows:
+                self._add(row["id"], row["patient_id"], row["device_serial"])
+            self._warm = True
+        return len(rows)
+
+    def add(self, sensor_id, patient_id, device_serial):
+        with self._lock:
+            self._add(sensor_id, patient_id, device_serial)
+
+    def invalidate(self):
+        """Tømmer cachen; næste opslag varmer den op igen."""
+        with self._lock:
+            self._warm = False
+            self._unknown_serials.clear()
+
+    def sensor_for_serial(self, device_serial):
+        """Returnerer sensor_id for et device_serial, eller None."""
+        return self.sensors_for_serials([device_serial]).get(device_serial)
+
+    def sensors_for_serials(self, device_serials):
+        """Bulk‐opslag: {device_serial: sensor_id} for de serienumre, der findes."""
+        self._ensure_warm()
+        now = time.monotonic()
+        with self._lock:
+            found = {s: self._by_serial[s] for s in device_serials if s in self._by_serial}
+            missing = [
+                s for s in device_serials
+                if s not in found and self._unknown_serials.get(s, 0) <= now
+            ]
+        if missing:
+            loaded = self._load("device_serial", missing)
+            found.update(loaded)
+            with self._lock:
+                expires = time.monotonic() + self.negative_ttl_s
+                for s in missing:
+                    if s not in loaded:
+                        self._unknown_serials[s] = expires
+        return found
+
+    def sensor_for_patient(self, patient_id):
+        """Returnerer (første) sensor_id registreret til patienten, eller None."""
+        self._ensure_warm()
+        with self._lock:
+            sensor_id = self._by_patient.get(str(patient_id))
+        if sensor_id is None:
+            sensor_id = self._load("patient_id", [patient_id]).get(str(patient_id))
+        return sensor_id
+
+    def patient_for_sensor(self, sensor_id):
+        self._ensure_warm()
+        with self._lock:
+            entry = self._by_sensor.get(sensor_id)
+        return entry[0] if entry else None
+
+    # ── Interne hjælpere ──────────────────────────────────────────
+
+    def _ensure_warm(self):
+        if not self._warm:
+            self.warm()
+
+    def _add(self, sensor_id, patient_id, device_serial):
+        self._by_sensor[sensor_id] = (patient_id, device_serial)
+        if device_serial is not None:
+            self._by_serial[device_serial] = sensor_id
+            self._unknown_serials.pop(device_serial, None)
+        # register_sensor_use genbruger patientens første sensor
+        self._by_patient.setdefault(str(patient_id), sensor_id)
+
+    def _load(self, column, values):
+        conn = get_db_connection()
+        cursor = conn.cursor(dictionary=True)
+        try:
+            placeholders = ", ".join(["%s"] * len(values))
+            cursor.execute(
+                f"SELECT id, patient_id, device_serial FROM patient_sensors "
+                f"WHERE {column} IN ({placeholders}) ORDER BY id",
+                tuple(values),
+            )
+            rows = cursor.fetchall()
+        finally:
+            cursor.close()
+            conn.close()
+
+        found = {}
+        with self._lock:
+            for row in rows:
+                self._add(row["id"], row["patient_id"], row["device_serial"])
+                found.setdefault(str(row[column]), row["id"])
+        return found
+
+
+device_registry = DeviceRegistry(
+    negative_ttl_s=float(os.environ.get("DEVICE_REGISTRY_NEGATIVE_TTL_S", 30)),
+)
@@ -0,0 +1,230 @@
+# error_fingerprints.py
+
+import atexit
+import hashlib
+import os
+import re
+import threading
+import time
+from datetime import datetime
+
+from mysql_db import get_db_connection
+from error_log_replay import is_replayable
+
+# Variable dele af en fejlbesked, der erstattes før fingerprinting, så
+# "sensor 12 failed at 2025-06-02T10:00:01" og "sensor 7 failed at …" bliver ens.
+_NORMALIZERS = (
+    (re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}", re.I), "<uuid>"),
+    (re.compile(r"\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}(:\d{2}(\.\d+)?)?(Z|[+-]\d{2}:?\d{2})?"), "<ts>"),
+    (re.compile(r"0x[0-9a-f]+", re.I), "<hex>"),
+    (re.compile(r"\d+(\.\d+)?"), "<n>"),
+    (re.compile(r"\s+"), " "),
+)
+
+
+def normalize_message(message):
+    message = (message or "").strip()
+    for pattern, replacement in _NORMALIZERS:
+        message = pattern.sub(replacement, message)
+    return message[:500]
+
+
+def fingerprint(endpoint, message):
+    """Returnerer (fingerprint, normaliseret besked) for (endpoint, fejlbesked)."""
+    normalized = normalize_message(message)
+    digest = hashlib.sha1(f"{endpoint}\n{normalized}".encode("utf-8")).hexdigest()[:16]
+    return digest, normalized
+
+
+def store_error_logs(entries):
+    """
+    Skriver (endpoint, payload_json, error_message)‐poster direkte i error_logs og
+    committer, før der returneres. Kaster ved DB‐fejl, så kalderen kan beholde dem.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.executemany("""
+            INSERT INTO error_logs (endpoint, payload, error_message, fingerprint)
+            VALUES (%s, %s, %s, %s)
+        """, [
+            (endpoint, payload_json, message, fingerprint(endpoint, message)[0])
+            for endpoint, payload_json, message in entries
+        ])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+
+
+class ErrorFingerprintAggregator:
+    """
+    Tæller fejllogs pr. fingerprint i hukommelsen og skriver dem samlet hvert
+    `flush_interval` sekund: én opdatering pr. fingerprint og minut i stedet for én
+    INSERT pr. hændelse. Højst `samples_per_window` payloads pr. fingerprint pr. minut
+    gemmes som eksempler i error_logs; bufferen er begrænset til `max_pending_samples`,
+    og er den fuld, kasseres de ældste eksempler (talt i stats "dropped_samples").
+    Payloads til endpoints, som error_log_replay kan genafspille (mislykkede
+    lysdata‐uploads), er patientdata: de skrives synkront til error_logs med
+    store_error_logs(), før record() returnerer, og ligger aldrig kun i hukommelsen.
+    """
+
+    def __init__(self, flush_interval=5.0, samples_per_window=5, max_pending_samples=5000):
+        self.flush_interval = flush_interval
+        self.samples_per_window = samples_per_window
+        self.max_pending_samples = max_pending_samples
+
+        self._fingerprints = {}   # fingerprint → {endpoint, message, first_seen, last_seen}
+        self._counts = {}         # (fingerprint, window_start) → antal
+        self._sampled = {}        # (fingerprint, window_start) → antal gemte eksempler
+        self._samples = []        # (endpoint, payload_json, error_message, fingerprint)
+        self._dropped = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+
+    def record(self, endpoint, payload_json, error_message):
+        """
+        Registrerer én fejlhændelse. Returnerer (fingerprint, om payload blev gemt).
+        Genafspillelige payloads er committet i error_logs, når der returneres; kaster,
+        hvis det ikke lykkes (så klienten beholder payloadet og prøver igen).
+        """
+        fp, normalized = fingerprint(endpoint, error_message)
+        replayable = is_replayable(endpoint)
+        if replayable:
+            store_error_logs([(endpoint, payload_json, error_message)])
+        now = datetime.utcnow().replace(microsecond=0)
+        window = now.replace(second=0)
+        key = (fp, window)
+
+        self._ensure_started()
+        with self._lock:
+            meta = self._fingerprints.get(fp)
+            if meta is None:
+                self._fingerprints[fp] = {
+                    "endpoint": endpoint, "message": normalized, "first_seen": now, "last_seen": now,
+                }
+            else:
+                meta["last_seen"] = now
+            self._counts[key] = self._counts.get(key, 0) + 1
+
+            if replayable:
+                return fp, True
+            sampled = self._sampled.get(key, 0)
+            keep = sampled < self.samples_per_window
+            if keep:
+                self._sampled[key] = sampled + 1
+                self._samples.append((endpoint, payload_json, error_message, fp))
+                self._trim_samples()
+        return fp, keep
+
+    def dropped_samples(self):
+        with self._lock:
+            return self._dropped
+
+    def pending_counts(self, since):
+        """Ikke‐flushede tællinger pr. fingerprint siden `since` (til summary‐endpointet)."""
+        with self._lock:
+            result = {}
+            for (fp, window), count in self._counts.items():
+                if window >= since:
+                    result[fp] = result.get(fp, 0) + count
+            meta = {fp: dict(self._fingerprints[fp]) for fp in result}
+        return result, meta
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                fingerprints, self._fingerprints = self._fingerprints, {}
+                counts, self._counts = self._counts, {}
+                samples, self._samples = self._samples, []
+                # Eksempel‐kvoten gælder pr. minut – ældre vinduer kan glemmes
+                current = datetime.utcnow().replace(second=0, microsecond=0)
+                self._sampled = {k: v for k, v in self._sampled.items() if k[1] >= current}
+            if not counts:
+                return 0
+
+            totals = {}
+            for (fp, _), count in counts.items():
+                totals[fp] = totals.get(fp, 0) + count
+
+            conn = get_db_connection()
+            cursor = conn.cursor()
+            try:
+                cursor.executemany("""
+                    INSERT INTO error_log_fingerprints
+                        (fingerprint, endpoint, message, total_count, first_seen, last_seen)
+                    VALUES (%s, %s, %s, %s, %s, %s)
+                    ON DUPLICATE KEY UPDATE
+                        total_count = total_count + VALUES(total_count),
+                        last_seen   = GREATEST(last_seen, VALUES(last_seen))
+                """, [
+                    (fp, m["endpoint"], m["message"], totals[fp], m["first_seen"], m["last_seen"])
+                    for fp, m in fingerprints.items()
+                ])
+                cursor.executemany("""
+                    INSERT INTO error_log_counts (fingerprint, window_start, count)
+                    VALUES (%s, %s, %s)
+                    ON DUPLICATE KEY UPDATE count = count + VALUES(count)
+                """, [(fp, window, count) for (fp, window), count in counts.items()])
+                if samples:
+                    cursor.executemany("""
+                        INSERT INTO error_logs (endpoint, payload, error_message, fingerprint)
+                        VALUES (%s, %s, %s, %s)
+                    """, samples)
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                print(f"[{__name__}] Fejl ved flush af fejllog‐tællere: {e}")
+                self._restore(fingerprints, counts, samples)
+                return 0
+            finally:
+                cursor.close()
+                conn.close()
+            return sum(totals.values())
+
+    # ── Interne hjælpere ──────────────────────────────────────────
+
+    def _restore(self, fingerprints, counts, samples):
+        with self._lock:
+            for fp, meta in fingerprints.items():
+                current = self._fingerprints.get(fp)
+                if current is None:
+                    self._fingerprints[fp] = meta
+                else:
+                    current["first_seen"] = min(current["first_seen"], meta["first_seen"])
+            for key, count in counts.items():
+                self._counts[key] = self._counts.get(key, 0) + count
+            self._samples[:0] = samples
+            self._trim_samples()
+
+    def _trim_samples(self):
+        # Kaldes med self._lock: de ældste eksempler kasseres først
+        excess = len(self._samples) - self.max_pending_samples
+        if excess > 0:
+            del self._samples[:excess]
+            self._dropped += excess
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="error-log-flusher", daemon=True)
+            self._thread.start()
+            atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+
+error_aggregator = ErrorFingerprintAggregator(
+    flush_interval=float(os.environ.get("ERROR_LOG_FLUSH_INTERVAL", 5.0)),
+    samples_per_window=int(os.environ.get("ERROR_LOG_SAMPLES_PER_MINUTE", 5)),
+)
@@ -0,0 +1,261 @@
+# error_log_replay.py
+#
+# Genafspiller mislykkede synkroniseringer, som klienten har gemt i error_logs.
+#
+#   python error_log_replay.py --concurrency 4 --rate 2000 --batch-size 500
+#   python error_log_replay.py --dry-run --max-rows 1000
+
+import argparse
+import json
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from mysql_db import get_db_connection
+from light_ingest import parse_light_sample, store_light_rows
+from light_metrics import CalibrationMissing
+
+
+def _light_rows_from_payload(payload):
+    """Et payload er enten ét datapunkt eller en batch‐krop ({"samples": […]} eller en liste)."""
+    if isinstance(payload, list):
+        return [parse_light_sample(sample) for sample in payload]
+    if isinstance(payload, dict) and isinstance(payload.get("samples"), list):
+        return [parse_light_sample(sample, payload) for sample in payload["samples"]]
+    return [parse_light_sample(payload)]
+
+
+# Endpoint (som klienten skrev det i error_logs) → funktion, der omsætter et payload
+# til række‐tupler for light_ingest. Endpoints uden handler røres ikke.
+REPLAY_HANDLERS = {
+    "/api/sensor/patient-light-data":       _light_rows_from_payload,
+    "/api/sensor/patient-light-data/batch": _light_rows_from_payload,
+}
+
+
+def _normalize_endpoint(endpoint):
+    endpoint = (endpoint or "").split("?", 1)[0].rstrip("/")
+    if "://" in endpoint:
+        endpoint = "/" + endpoint.split("://", 1)[1].split("/", 1)[-1]
+    return endpoint
+
+
+def is_replayable(endpoint):
+    """True, hvis payloads fra `endpoint` kan genafspilles (og derfor aldrig må kasseres)."""
+    return _normalize_endpoint(endpoint) in REPLAY_HANDLERS
+
+
+class ErrorLogReplayer:
+    """
+    Streamer error_logs i id‐rækkefølge (keyset, `batch_size` rækker ad gangen), grupperer
+    payloads pr. endpoint og anvender hver gruppe samlet gennem den normale, idempotente
+    ingest‐sti. Grupperne behandles af `concurrency` tråde, og `rate` begrænser antal
+    error_logs‐rækker pr. sekund. Behandlede rækker markeres med replayed_at/replay_status.
+    Fejler en gruppes indsættelse, prøves rækkerne én ad gangen; en række, der stadig
+    fejler, markeres 'failed' med fejlen i replay_error, og resten fortsætter.
+    Rækker, der afvises med CalibrationMissing, efterlades umarkerede ("pending") og
+    tages med igen, når serveren har fået en kalibrering.
+    """
+
+    def __init__(self, batch_size=500, concurrency=4, rate=None, endpoints=None, dry_run=False):
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.rate = rate
+        self.endpoints = {_normalize_endpoint(e) for e in endpoints} if endpoints else None
+        self.dry_run = dry_run
+
+    def run(self, max_rows=None):
+        summary = defaultdict(int)
+        last_id = 0
+        started = time.monotonic()
+        pending = deque()
+
+        def collect(future):
+            for key, value in future.result().items():
+                summary[key] += value
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            while max_rows is None or summary["scanned"] < max_rows:
+                limit = self.batch_size
+                if max_rows is not None:
+                    limit = min(limit, max_rows - summary["scanned"])
+                page = self._fetch_page(last_id, limit)
+                if not page:
+                    break
+                last_id = page[-1]["id"]
+                summary["scanned"] += len(page)
+
+                groups = defaultdict(list)
+                for row in page:
+                    endpoint = _normalize_endpoint(row["endpoint"])
+                    if endpoint not in REPLAY_HANDLERS or (
+                        self.endpoints is not None and endpoint not in self.endpoints
+                    ):
+                        summary["skipped"] += 1
+                        continue
+                    groups[endpoint].append(row)
+
+                # Næste side hentes, mens grupperne anvendes; højst `concurrency` i luften ad gangen
+                for endpoint, log_rows in groups.items():
+                    pending.append(pool.submit(self._apply_group, endpoint, log_rows))
+                while len(pending) >= self.concurrency:
+                    collect(pending.popleft())
+
+                self._throttle(summary["scanned"], started)
+
+            while pending:
+                collect(pending.popleft())
+
+        summary["last_id"] = last_id
+        summary["elapsed_s"] = round(time.monotonic() - started, 3)
+        return dict(summary)
+
+    # ── Interne hjælpere ──────────────────────────────────────────
+
+    def _fetch_page(self, last_id, limit):
+        conn = get_db_connection()
+        cursor = conn.cursor(dictionary=True)
+        try:
+            cursor.execute("""
+                SELECT id, endpoint, payload
+                FROM error_logs
+                WHERE replayed_at IS NULL
+                  AND id > %s
+                ORDER BY id ASC
+                LIMIT %s
+            """, (last_id, limit))
+            return cursor.fetchall()
+        finally:
+            cursor.close()
+            conn.close()
+
+    def _apply_group(self, endpoint, log_rows):
+        handler = REPLAY_HANDLERS[endpoint]
+        parsed = []
+        invalid_ids = []
+        pending = 0
+        for log_row in log_rows:
+            try:
+                parsed.append((log_row["id"], handler(json.loads(log_row["payload"]))))
+            except CalibrationMissing:
+                pending += 1
+            except (KeyError, ValueError, TypeError):
+                invalid_ids.append(log_row["id"])
+
+        result = {
+            "replayed": len(parsed),
+            "invalid": len(invalid_ids),
+            "pending": pending,
+            "samples": sum(len(rows) for _, rows in parsed),
+        }
+        if self.dry_run:
+            return result
+
+        try:
+            stored = self._store(parsed, invalid_ids)
+        except Exception as e:
+            print(f"[{__name__}] Gruppe for {endpoint} fejlede ({e}) – prøver række for række")
+            stored = {"new": 0, "duplicates": 0, "failed": 0}
+            try:
+                self._store([], invalid_ids)
+            except Exception as mark_error:
+                # Rækkerne forbliver ubehandlede og tages med i næste kørsel
+                print(f"[{__name__}] FEJL ved markering af ugyldige error_logs: {mark_error}")
+            for log_id, rows in parsed:
+                try:
+                    one = self._store([(log_id, rows)], [])
+                except Exception as row_error:
+                    self._mark_failed(log_id, row_error)
+                    stored["failed"] += 1
+                    continue
+                stored["new"] += one["new"]
+                stored["duplicates"] += one["duplicates"]
+            result["replayed"] -= stored["failed"]
+            result["failed"] = stored["failed"]
+
+        result["new"] = stored["new"]
+        result["duplicates"] = stored["duplicates"]
+        return result
+
+    def _store(self, parsed, invalid_ids):
+        """Markerer og indsætter i én transaktion; ruller tilbage og kaster ved fejl."""
+        rows = [row for _, log_rows in parsed for row in log_rows]
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor()
+            try:
+                self._mark(cursor, [log_id for log_id, _ in parsed], "replayed")
+                self._mark(cursor, invalid_ids, "invalid")
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                cursor.close()
+            if rows:
+                return store_light_rows(conn, rows)
+            conn.commit()
+            return {"new": 0, "duplicates": 0}
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _mark_failed(log_id, error):
+        print(f"[{__name__}] error_logs {log_id} kunne ikke genafspilles: {error}")
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("""
+                UPDATE error_logs
+                SET replayed_at = NOW(), replay_status = 'failed', replay_error = %s
+                WHERE id = %s
+            """, (str(error)[:2000], log_id))
+            conn.commit()
+        except Exception as e:
+            # Rækken forbliver ubehandlet og tages med i næste kørsel
+            conn.rollback()
+            print(f"[{__name__}] FEJL ved markering af error_logs {log_id}: {e}")
+        finally:
+            cursor.close()
+            conn.close()
+
+    @staticmethod
+    def _mark(cursor, ids, status):
+        if not ids:
+            return
+        placeholders = ", ".join(["%s"] * len(ids))
+        cursor.execute(
+            f"UPDATE error_logs SET replayed_at = NOW(), replay_status = %s "
+            f"WHERE id IN ({placeholders})",
+            (status, *ids),
+        )
+
+    def _throttle(self, scanned, started):
+        if not self.rate:
+            return
+        ahead = scanned / self.rate - (time.monotonic() - started)
+        if ahead > 0:
+            time.sleep(ahead)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Genafspil payloads fra error_logs")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--rate", type=float, default=None, help="maks. error_logs‐rækker pr. sekund")
+    parser.add_argument("--endpoint", action="append", help="begræns til dette endpoint (kan gentages)")
+    parser.add_argument("--max-rows", type=int, default=None)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    replayer = ErrorLogReplayer(
+        batch_size=args.batch_size,
+        concurrency=args.concurrency,
+        rate=args.rate,
+        endpoints=args.endpoint,
+        dry_run=args.dry_run,
+    )
+    print(json.dumps(replayer.run(max_rows=args.max_rows), indent=2))
+
+
+if __name__ == "__main__":
+    main()
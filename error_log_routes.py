@@ -1,48 +1,171 @@
 from flask import Blueprint, request, jsonify
+from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
 from mysql_db import get_db_connection
+from error_log_replay import ErrorLogReplayer
+from error_fingerprints import error_aggregator
+from datetime import datetime, timedelta
 import json
 sensor_bp = Blueprint("sensor_bp", __name__)
 
+# Roller, der må se fejloversigten og starte genafspilning (skriver i alle patienters data)
+_STAFF_ROLES = ("clinician", "admin")
+
+
+def _is_staff():
+    current = get_jwt_identity()
+    if isinstance(current, str):
+        user_id = current
+        role = get_jwt().get("role", None)
+    else:
+        user_id = current.get("id")
+        role = current.get("role")
+    return bool(user_id) and role in _STAFF_ROLES
+
 # … eksisterende ruter som /patient-battery-status og /patient-light-data …
 
 @sensor_bp.route("/error-logs", methods=["POST"])
 def log_error():
     """
     POST /api/error-logs
-    Modtager en JSON med information om en mislykket synkronisering eller anden fejl,
-    og gemmer den i tabellen 'error_logs'.
+    Modtager en JSON med information om en mislykket synkronisering eller anden fejl.
     Eksempel på payload fra klienten:
       {
         "endpoint": "/api/sensor/patient-light-data",
         "payload": { … den JSON, der blev forsøgt sendt … },
         "error_message": "400 – {\"error\":\"name 'sensor_id' is not defined\",\"success\":false}"
       }
+    Fejlen fingerprintes på (endpoint, normaliseret error_message) og tælles i hukommelsen;
+    tællerne skrives samlet til error_log_fingerprints/error_log_counts af en baggrundstråd.
+    Kun et begrænset antal eksempel‐payloads pr. fingerprint pr. minut gemmes i error_logs,
+    så en fejlstorm fra mange telefoner ikke fordobler skrivebelastningen. Mislykkede
+    lysdata‐uploads (endpoints i error_log_replay.REPLAY_HANDLERS) skrives altid og
+    synkront til error_logs, før der svares 200 – fejler det, svares 500, og klienten
+    beholder payloadet.
     """
-    data = request.get_json()
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    data = request.get_json(silent=True) or {}
     try:
         endpoint = data.get("endpoint", "")            # F.eks. "/api/sensor/patient-light-data"
         payload_json = json.dumps(data.get("payload", {}))  # Gemmer selve JSON‐objektet som streng
         error_msg = data.get("error_message", "")
 
-        cursor.execute(
-            """
-            INSERT INTO error_logs (endpoint, payload, error_message)
-            VALUES (%s, %s, %s)
-            """,
-            (endpoint, payload_json, error_msg),
-        )
-        conn.commit()
-
-        print(f"[{__name__}] Fejllog gemt: endpoint='{endpoint}', error_message='{error_msg[:50]}…'")
-        return jsonify({"success": True}), 200
+        fp, sampled = error_aggregator.record(endpoint, payload_json, error_msg)
+        return jsonify({"success": True, "fingerprint": fp, "sampled": sampled}), 200
 
     except Exception as e:
-        # Hvis selve indsættelsen i error_logs fejler, returner 500 eller 400
         print(f"[{__name__}] FEJL i log_error: {e}")
         return jsonify({"success": False, "error": str(e)}), 500
 
+
+@sensor_bp.route("/error-logs/summary", methods=["GET"])
+@jwt_required()
+def error_log_summary():
+    """
+    GET /api/error-logs/summary?hours=24&limit=20
+    Returnerer de hyppigste fejl‐fingerprints i tidsvinduet (inkl. endnu ikke flushede tællinger).
+    Kun klinikere og administratorer.
+    """
+    if not _is_staff():
+        return jsonify({"error": "Ikke autoriseret"}), 403
+
+    try:
+        hours = float(request.args.get("hours", 24))
+        limit = min(int(request.args.get("limit", 20)), 200)
+    except ValueError:
+        return jsonify({"error": "hours og limit skal være tal"}), 400
+
+    since = datetime.utcnow().replace(second=0, microsecond=0) - timedelta(hours=hours)
+
+    conn = get_db_connection()
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute("""
+            SELECT f.fingerprint,
+                   f.endpoint,
+                   f.message,
+                   f.first_seen,
+                   f.last_seen,
+                   SUM(c.count) AS window_count
+            FROM error_log_counts AS c
+            JOIN error_log_fingerprints AS f
+              ON f.fingerprint = c.fingerprint
+            WHERE c.window_start >= %s
+            GROUP BY f.fingerprint, f.endpoint, f.message, f.first_seen, f.last_seen
+            ORDER BY window_count DESC
+            LIMIT %s
+        """, (since, limit))
+        rows = {row["fingerprint"]: row for row in cursor.fetchall()}
+    except Exception as e:
+        print(f"[{__name__}] FEJL i error_log_summary: {e}")
+        return jsonify({"error": str(e)}), 500
     finally:
         cursor.close()
         conn.close()
+
+    # Læg tællinger, der endnu kun findes i hukommelsen, oveni
+    pending, meta = error_aggregator.pending_counts(since)
+    for fp, count in pending.items():
+        if fp in rows:
+            rows[fp]["window_count"] = int(rows[fp]["window_count"]) + count
+            rows[fp]["last_seen"] = max(rows[fp]["last_seen"], meta[fp]["last_seen"])
+        else:
+            rows[fp] = {"fingerprint": fp, "window_count": count, **meta[fp]}
+
+    result = sorted(rows.values(), key=lambda r: int(r["window_count"]), reverse=True)[:limit]
+    response = jsonify([
+        {
+            "fingerprint": r["fingerprint"],
+            "endpoint":    r["endpoint"],
+            "message":     r["message"],
+            "count":       int(r["window_count"]),
+            "first_seen":  r["first_seen"].isoformat(),
+            "last_seen":   r["last_seen"].isoformat(),
+        }
+        for r in result
+    ])
+    # Eksempel‐payloads kasseret i denne proces, fordi bufferen var fuld
+    response.headers["X-Dropped-Samples"] = str(error_aggregator.dropped_samples())
+    return response, 200
+
+
+@sensor_bp.route("/error-logs/replay", methods=["POST"])
+@jwt_required()
+def replay_error_logs():
+    """
+    POST /api/error-logs/replay
+    Genafspiller ubehandlede error_logs gennem den normale ingest‐sti (med dedup) og
+    markerer rækkerne som genafspillet. Valgfri JSON‐krop:
+      {
+        "endpoints": ["/api/sensor/patient-light-data"],
+        "max_rows": 5000,        # standard 5000, så et kald ikke binder workeren for længe
+        "batch_size": 500,
+        "concurrency": 4,
+        "rate": 2000,            # maks. error_logs‐rækker pr. sekund
+        "dry_run": false
+      }
+    Større backlogs køres med CLI'en: python error_log_replay.py
+    Kun klinikere og administratorer.
+    """
+    if not _is_staff():
+        return jsonify({"success": False, "error": "Ikke autoriseret"}), 403
+
+    data = request.get_json(silent=True) or {}
+    try:
+        replayer = ErrorLogReplayer(
+            batch_size=int(data.get("batch_size", 500)),
+            concurrency=int(data.get("concurrency", 4)),
+            rate=float(data["rate"]) if data.get("rate") else None,
+            endpoints=data.get("endpoints"),
+            dry_run=bool(data.get("dry_run", False)),
+        )
+        max_rows = int(data.get("max_rows", 5000))
+    except (TypeError, ValueError) as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+
+    try:
+        summary = replayer.run(max_rows=max_rows)
+        print(f"[{__name__}] Genafspilning af error_logs: {summary}")
+        return jsonify({"success": True, **summary}), 200
+
+    except Exception as e:
+        print(f"[{__name__}] FEJL i replay_error_logs: {e}")
+        return jsonify({"success": False, "error": str(e)}), 500
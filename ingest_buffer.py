@@ -0,0 +1,391 @@
+# ingest_buffer.py
+
+import atexit
+import fcntl
+import json
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from mysql.connector import errors as mysql_errors
+
+from mysql_db import get_db_connection
+from light_ingest import LIGHT_COLUMNS, insert_light_rows, rows_committed
+from error_fingerprints import store_error_logs
+
+_CAPTURED_AT = LIGHT_COLUMNS.index("captured_at")
+_RAW_CHANNELS = LIGHT_COLUMNS.index("raw_channels")
+
+# Rækker, der ikke kan skrives, gemmes i error_logs under batch‐endpointet, så
+# error_log_replay.py kan genafspille dem gennem den normale ingest‐sti.
+DEAD_LETTER_ENDPOINT = "/api/sensor/patient-light-data/batch"
+
+# Deadlock (1213) og lock wait timeout (1205) er forbigående ligesom OperationalError
+_TRANSIENT_ERRNOS = (1205, 1213)
+
+
+def _is_transient(error):
+    return (isinstance(error, mysql_errors.OperationalError)
+            or getattr(error, "errno", None) in _TRANSIENT_ERRNOS)
+
+
+class LightIngestBuffer:
+    """
+    Write‐behind kø for patient_light_sensor_data.
+    Datapunkter kvitteres, så snart de er lagt i køen (og evt. skrevet til spool‐filen),
+    og en baggrundstråd skriver dem til databasen i gruppe‐commits, når køen når
+    `flush_size` rækker, eller når den ældste række har ventet `flush_interval` sekunder.
+    Køen er begrænset til `max_rows` – er den fuld, afvises nye datapunkter.
+    Kun forbigående DB‐fejl (OperationalError, deadlock, lock wait timeout) giver
+    genforsøg, højst `max_attempts` gange i træk; øvrige fejl og rækker, der har
+    opbrugt forsøgene, flyttes til error_logs (se _dead_letter), så de ikke blokerer køen.
+
+    Spool‐filerne er pr. proces (`spool_path`.<pid>…), og processen holder en eksklusiv
+    flock på `spool_path`.<pid>.lock, så længe den lever. Ved opstart overtages kun
+    filer fra processer, hvis lås kan tages – dvs. som er døde.
+    """
+
+    def __init__(self, max_rows=50000, flush_size=2000, flush_interval=1.0, spool_path=None,
+                 max_attempts=10):
+        self.max_rows = max_rows
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.spool_path = spool_path
+        self.max_attempts = max_attempts
+
+        self._rows = deque()
+        self._oldest = None
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._stopping = False
+        self._spool = None
+        self._spool_lock = None
+        self._pid = None
+        self._dead = []           # dead letters, der ikke er i error_logs endnu (uden spool)
+        self._attempts = 0        # fejlede flush‐forsøg i træk for rækkerne forrest i køen
+
+        self._stats = {
+            "enqueued": 0,
+            "rejected_full": 0,
+            "flushed_rows": 0,
+            "duplicates": 0,
+            "flushes": 0,
+            "flush_failures": 0,
+            "dead_lettered": 0,
+            "last_flush_ms": None,
+            "max_flush_ms": 0.0,
+            "total_flush_ms": 0.0,
+        }
+
+    # ── Offentligt API ────────────────────────────────────────────
+
+    def enqueue(self, rows):
+        """
+        Lægger række‐tupler (LIGHT_COLUMNS‐rækkefølge) i køen.
+        Returnerer False uden at gemme noget, hvis der ikke er plads til dem alle.
+        """
+        if not rows:
+            return True
+        self._ensure_started()
+        with self._cond:
+            if len(self._rows) + len(rows) > self.max_rows:
+                self._stats["rejected_full"] += len(rows)
+                return False
+            self._spool_write(rows)
+            if not self._rows:
+                self._oldest = time.monotonic()
+            self._rows.extend(rows)
+            self._stats["enqueued"] += len(rows)
+            if len(self._rows) >= self.flush_size:
+                self._cond.notify()
+        return True
+
+    def flush(self):
+        """Skriver alt, der ligger i køen, til databasen. Returnerer antal skrevne rækker."""
+        with self._flush_lock:
+            with self._cond:
+                rows = list(self._rows)
+                self._rows.clear()
+                self._oldest = None
+                inflight = self._spool_rotate()
+            if not rows:
+                self._spool_discard(inflight)
+                return 0
+
+            started = time.perf_counter()
+            committed = 0
+            duplicates = 0
+            try:
+                conn = get_db_connection()
+                cursor = conn.cursor()
+                try:
+                    while committed < len(rows):
+                        chunk = rows[committed:committed + self.flush_size]
+                        new = insert_light_rows(cursor, chunk)
+                        conn.commit()
+                        if new:
+                            rows_committed(chunk)
+                        committed += len(chunk)
+                        duplicates += len(chunk) - new
+                finally:
+                    cursor.close()
+                    conn.close()
+            except Exception as e:
+                print(f"[{__name__}] Fejl ved flush af {len(rows) - committed} lysdata‐rækker: {e}")
+                self._attempts += 1
+                with self._cond:
+                    self._stats["flush_failures"] += 1
+                    self._stats["flushed_rows"] += committed
+                    self._stats["duplicates"] += duplicates
+                remaining = rows[committed:]
+                if _is_transient(e) and self._attempts < self.max_attempts:
+                    self._requeue(remaining, inflight)
+                    return committed
+                # Permanent fejl (eller opbrugte forsøg): den fejlende chunk flyttes til
+                # error_logs, resten lægges tilbage i køen
+                failed, remaining = remaining[:self.flush_size], remaining[self.flush_size:]
+                self._dead_letter(failed, e)
+                self._attempts = 0
+                self._requeue(remaining, inflight)
+                return committed
+
+            self._attempts = 0
+            elapsed_ms = (time.perf_counter() - started) * 1000.0
+            self._spool_discard(inflight)
+            self._drain_dead_letters()
+            with self._cond:
+                self._stats["flushes"] += 1
+                self._stats["flushed_rows"] += len(rows)
+                self._stats["duplicates"] += duplicates
+                self._stats["last_flush_ms"] = round(elapsed_ms, 2)
+                self._stats["max_flush_ms"] = round(max(self._stats["max_flush_ms"], elapsed_ms), 2)
+                self._stats["total_flush_ms"] += elapsed_ms
+            return len(rows)
+
+    def stats(self):
+        """Kødybde og flush‐latens til overvågning."""
+        with self._cond:
+            stats = dict(self._stats)
+            stats["queue_depth"] = len(self._rows)
+            stats["max_rows"] = self.max_rows
+            stats["oldest_age_s"] = (
+                round(time.monotonic() - self._oldest, 3) if self._oldest is not None else None
+            )
+        flushes = stats["flushes"]
+        stats["avg_flush_ms"] = round(stats.pop("total_flush_ms") / flushes, 2) if flushes else None
+        return stats
+
+    def shutdown(self):
+        """Stopper baggrundstråden og tømmer køen til databasen."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_interval * 5)
+        self.flush()
+
+    # ── Baggrundstråd ─────────────────────────────────────────────
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._pid = os.getpid()
+            self._recover_spool()
+            self._thread = threading.Thread(
+                target=self._run, name="light-ingest-flusher", daemon=True
+            )
+            self._thread.start()
+            atexit.register(self.shutdown)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopping and not self._due():
+                    self._cond.wait(timeout=self._wait_time())
+                if self._stopping:
+                    return
+                failures = self._stats["flush_failures"]
+            self.flush()
+            with self._cond:
+                # Ved DB‐fejl venter vi et interval, før vi prøver igen
+                if self._stats["flush_failures"] != failures and not self._stopping:
+                    self._cond.wait(timeout=self.flush_interval)
+
+    def _due(self):
+        if not self._rows:
+            return False
+        if len(self._rows) >= self.flush_size:
+            return True
+        return time.monotonic() - self._oldest >= self.flush_interval
+
+    def _wait_time(self):
+        if self._oldest is None:
+            return self.flush_interval
+        return max(0.0, self.flush_interval - (time.monotonic() - self._oldest))
+
+    def _requeue(self, rows, inflight):
+        # Rækker, der fejlede, lægges forrest i køen igen, så rækkefølgen bevares
+        with self._cond:
+            self._spool_write(rows)
+            self._rows.extendleft(reversed(rows))
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+        self._spool_discard(inflight)
+
+    def _dead_letter(self, rows, error):
+        """
+        Gemmer rækkerne som et error_logs‐payload. Payloadet skrives først til en
+        dead‐letter‐fil ved siden af spoolen og slettes først, når error_logs har
+        committet det – så kvitterede rækker aldrig kun ligger i hukommelsen.
+        """
+        samples = []
+        for row in rows:
+            sample = {name: value for name, value in zip(LIGHT_COLUMNS, row) if value is not None}
+            sample["timestamp"] = sample.pop("captured_at").isoformat()
+            sample.pop("metrics_version", None)
+            if row[_RAW_CHANNELS] is not None:
+                sample["channels"] = sample.pop("raw_channels")
+            samples.append(sample)
+        entry = [DEAD_LETTER_ENDPOINT, json.dumps({"samples": samples}), f"ingest‐kø: {error}"]
+        if self.spool_path:
+            with open(self._own_path(f"{time.time_ns()}.dead"), "w", encoding="utf-8") as fh:
+                fh.write(json.dumps(entry) + "\n")
+                fh.flush()
+                os.fsync(fh.fileno())
+        else:
+            self._dead.append(entry)
+        with self._cond:
+            self._stats["dead_lettered"] += len(rows)
+        print(f"[{__name__}] {len(rows)} lysdata‐rækker flyttet til dead letters: {error}")
+        self._drain_dead_letters()
+
+    def _drain_dead_letters(self):
+        """Skriver ventende dead letters til error_logs. Fejler det, prøves igen ved næste flush."""
+        paths = sorted(self._own_files(".dead")) if self.spool_path else []
+        if not paths and not self._dead:
+            return
+        try:
+            if self._dead:
+                store_error_logs(self._dead)
+                self._dead = []
+            for path in paths:
+                with open(path, encoding="utf-8") as fh:
+                    store_error_logs([json.loads(line) for line in fh if line.strip()])
+                os.remove(path)
+        except Exception as e:
+            print(f"[{__name__}] Dead letters kunne ikke skrives til error_logs endnu: {e}")
+
+    # ── Spool‐filer (holdbarhed ved genstart) ────────────────────
+
+    def _own_path(self, suffix=None):
+        base = f"{self.spool_path}.{self._pid}"
+        return f"{base}.{suffix}" if suffix else base
+
+    def _own_files(self, ending):
+        directory = os.path.dirname(os.path.abspath(self.spool_path))
+        prefix = os.path.basename(self._own_path()) + "."
+        return [
+            os.path.join(directory, name) for name in os.listdir(directory)
+            if name.startswith(prefix) and name.endswith(ending)
+        ]
+
+    def _spool_write(self, rows):
+        if not self.spool_path:
+            return
+        if self._spool is None:
+            self._spool = open(self._own_path(), "a", encoding="utf-8")
+        for row in rows:
+            row = list(row)
+            row[_CAPTURED_AT] = row[_CAPTURED_AT].isoformat()
+            self._spool.write(json.dumps(row) + "\n")
+        self._spool.flush()
+        os.fsync(self._spool.fileno())
+
+    def _spool_rotate(self):
+        if not self.spool_path or self._spool is None:
+            return None
+        self._spool.close()
+        self._spool = None
+        inflight = self._own_path(f"{time.time_ns()}.inflight")
+        os.replace(self._own_path(), inflight)
+        return inflight
+
+    def _spool_discard(self, inflight):
+        if inflight:
+            os.remove(inflight)
+
+    def _recover_spool(self):
+        """
+        Tager processens egen lås og indlæser rækker (og dead letters) fra spool‐filer,
+        hvis ejer ikke lever længere – inkl. en tidligere proces med samme pid.
+        """
+        if not self.spool_path:
+            return
+        self._spool_lock = open(self._own_path("lock"), "a")
+        fcntl.flock(self._spool_lock, fcntl.LOCK_EX)
+
+        directory = os.path.dirname(os.path.abspath(self.spool_path))
+        prefix = os.path.basename(self.spool_path) + "."
+        owners = {}
+        for name in os.listdir(directory):
+            if name.startswith(prefix):
+                owner = name[len(prefix):].split(".", 1)[0]
+                if owner.isdigit():
+                    owners.setdefault(int(owner), []).append(os.path.join(directory, name))
+
+        recovered = []
+        for owner, paths in sorted(owners.items()):
+            lock_path = f"{self.spool_path}.{owner}.lock"
+            if owner == self._pid:
+                recovered.extend(self._recover_files(paths, lock_path))
+                continue
+            with open(lock_path, "a") as lock:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue        # ejeren lever
+                recovered.extend(self._recover_files(paths, lock_path))
+                os.remove(lock_path)
+
+        if recovered:
+            self._spool_write(recovered)
+            self._rows.extend(recovered)
+            self._oldest = time.monotonic()
+            print(f"[{__name__}] Genindlæste {len(recovered)} lysdata‐rækker fra spool")
+        self._drain_dead_letters()
+
+    def _recover_files(self, paths, lock_path):
+        rows = []
+        for path in sorted(paths):
+            if path == lock_path or not os.path.exists(path):
+                continue
+            if path.endswith(".dead"):
+                # Dead letters overtages uændret og skrives af _drain_dead_letters()
+                os.replace(path, self._own_path(f"{time.time_ns()}.dead"))
+                continue
+            with open(path, encoding="utf-8") as fh:
+                for line in fh:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    row = json.loads(line)
+                    row[_CAPTURED_AT] = datetime.fromisoformat(row[_CAPTURED_AT])
+                    rows.append(tuple(row))
+            os.remove(path)
+        return rows
+
+light_buffer = LightIngestBuffer(
+    max_rows=int(os.environ.get("LIGHT_INGEST_MAX_ROWS", 50000)),
+    flush_size=int(os.environ.get("LIGHT_INGEST_FLUSH_SIZE", 2000)),
+    flush_interval=float(os.environ.get("LIGHT_INGEST_FLUSH_INTERVAL", 1.0)),
+    # Kvitterede datapunkter spooles til disk som standard (én fil pr. proces med
+    # LIGHT_INGEST_SPOOL som præfiks); LIGHT_INGEST_SPOOL="" slår det fra
+    spool_path=os.environ.get("LIGHT_INGEST_SPOOL", "light_ingest.spool"),
+    max_attempts=int(os.environ.get("LIGHT_INGEST_MAX_ATTEMPTS", 10)),
+)
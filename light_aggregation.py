@@ -0,0 +1,255 @@
+# light_aggregation.py
+#
+# Generisk bucket‐aggregering af en patients lysdata: vilkårligt interval,
+# bucket‐størrelse, metrikker og tærskler i ét gennemløb. Døgn og uger følger
+# lokal tid i Europe/Copenhagen (inkl. sommertid). Lange intervaller med
+# bucket >= 1h læses fra patient_light_rollups i stedet for rå data.
+
+from datetime import datetime, time, timedelta
+
+import numpy as np
+import pytz
+
+from light_metrics import LOCAL_TZ
+from light_rollups import HIGH_LIGHT_LUX
+
+BUCKETS = {
+    "5m":  timedelta(minutes=5),
+    "15m": timedelta(minutes=15),
+    "1h":  timedelta(hours=1),
+    "1d":  timedelta(days=1),
+    "1w":  timedelta(weeks=1),
+}
+
+# Metrik → (kolonne i rå data, præfiks i patient_light_rollups)
+METRICS = {
+    "melanopic_edi":  ("melanopic_edi", "edi"),
+    "illuminance":    ("illuminance", "lux"),
+    "exposure_score": ("exposure_score", "score"),
+}
+
+# Over denne længde bruges rollups, hvis forespørgslen kan besvares derfra
+ROLLUP_MIN_RANGE = timedelta(days=2)
+MAX_RAW_RANGE = timedelta(days=93)
+MAX_BUCKETS = 5000
+# Rå målinger hentes og aggregeres i sider af denne størrelse
+RAW_FETCH_ROWS = 10000
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+class AggregationError(ValueError):
+    pass
+
+
+def _to_utc(local_naive):
+    return LOCAL_TZ.localize(local_naive).astimezone(pytz.utc).replace(tzinfo=None)
+
+
+def _to_local(utc_naive):
+    return pytz.utc.localize(utc_naive).astimezone(LOCAL_TZ)
+
+
+def bucket_boundaries(from_dt, to_dt, bucket):
+    """
+    Returnerer bucket‐grænser (naive UTC) der dækker [from_dt, to_dt).
+    Under ét døgn er buckets faste længder (dansk UTC‐offset er hele timer, så de
+    flugter med lokal tid); døgn og uger starter ved lokal midnat/mandag.
+    """
+    step = BUCKETS[bucket]
+    if step < timedelta(days=1):
+        seconds = int(step.total_seconds())
+        start = int((from_dt - _EPOCH).total_seconds()) // seconds * seconds
+        end = -(-int((to_dt - _EPOCH).total_seconds()) // seconds) * seconds
+        return [_EPOCH + timedelta(seconds=s) for s in range(start, end + 1, seconds)]
+
+    day = _to_local(from_dt).date()
+    if bucket == "1w":
+        day -= timedelta(days=day.weekday())
+    boundaries = [_to_utc(datetime.combine(day, time()))]
+    while boundaries[-1] < to_dt:
+        day += step
+        boundaries.append(_to_utc(datetime.combine(day, time())))
+    return boundaries
+
+
+def _parse_thresholds(thresholds):
+    parsed = []
+    for spec in thresholds:
+        metric, _, value = spec.partition(":")
+        if metric not in METRICS:
+            raise AggregationError(f"Ukendt metrik i tærskel: {metric}")
+        try:
+            parsed.append((metric, float(value)))
+        except ValueError:
+            raise AggregationError(f"Ugyldig tærskel: {spec}")
+    return parsed
+
+
+def _can_use_rollups(from_dt, to_dt, bucket, thresholds):
+    if BUCKETS[bucket] < timedelta(hours=1) or to_dt - from_dt < ROLLUP_MIN_RANGE:
+        return False
+    # Rollups kender kun illuminance >= HIGH_LIGHT_LUX
+    return all(t == ("illuminance", float(HIGH_LIGHT_LUX)) for t in thresholds)
+
+
+def _aggregate_raw(cursor, patient_id, start, end, edges, n, metrics, thresholds):
+    """
+    Aggregerer rå målinger i [start, end) løbende i sider på RAW_FETCH_ROWS rækker,
+    så hukommelsesforbruget afhænger af antal buckets og ikke af antal målinger.
+    Returnerer (counts, actions, stats, above) som aggregate_light_data() bruger dem.
+    """
+    columns = sorted({METRICS[m][0] for m in metrics} | {METRICS[m][0] for m, _ in thresholds})
+    position = {column: i for i, column in enumerate(columns, start=2)}
+    cursor.execute(f"""
+        SELECT captured_at, action_required{"".join(", " + c for c in columns)}
+        FROM patient_light_sensor_data
+        WHERE patient_id   = %s
+          AND captured_at >= %s
+          AND captured_at <  %s
+    """, (patient_id, start, end))
+
+    counts = np.zeros(n)
+    actions = np.zeros(n)
+    stats = {m: (np.zeros(n), np.zeros(n), np.full(n, np.nan), np.full(n, np.nan)) for m in metrics}
+    above = {f"{metric}>={value:g}": np.zeros(n) for metric, value in thresholds}
+
+    while True:
+        rows = cursor.fetchmany(RAW_FETCH_ROWS)
+        if not rows:
+            break
+        ts = np.array([row[0] for row in rows], dtype="datetime64[us]")
+        idx = np.searchsorted(edges, ts, side="right") - 1
+        counts += np.bincount(idx, minlength=n)
+        actions += np.bincount(idx, weights=[bool(row[1]) for row in rows], minlength=n)
+        data = {
+            column: np.array([np.nan if row[i] is None else float(row[i]) for row in rows], dtype=float)
+            for column, i in position.items()
+        }
+        for metric in metrics:
+            values = data[METRICS[metric][0]]
+            valid = ~np.isnan(values)
+            c, total, lo, hi = stats[metric]
+            c += np.bincount(idx[valid], minlength=n)
+            total += np.bincount(idx[valid], weights=values[valid], minlength=n)
+            page_lo, page_hi = _group_min_max(idx, values, n)
+            np.fmin(lo, page_lo, out=lo)
+            np.fmax(hi, page_hi, out=hi)
+        for metric, value in thresholds:
+            values = data[METRICS[metric][0]]
+            with np.errstate(invalid="ignore"):
+                hit = values >= value
+            above[f"{metric}>={value:g}"] += np.bincount(idx[hit], minlength=n)
+
+    return counts, actions, stats, above
+
+
+def _fetch_rollups(cursor, patient_id, start, end):
+    cursor.execute("""
+        SELECT bucket_start, total_measurements, count_high_light, action_required_count,
+               edi_count, edi_sum, edi_min, edi_max,
+               lux_count, lux_sum, lux_min, lux_max,
+               score_count, score_sum, score_min, score_max
+        FROM patient_light_rollups
+        WHERE patient_id   = %s
+          AND bucket       = 'hour'
+          AND bucket_start >= %s
+          AND bucket_start <  %s
+    """, (patient_id, start, end))
+    rows = cursor.fetchall()
+    ts = np.array([row[0] for row in rows], dtype="datetime64[us]")
+    cols = np.array([[np.nan if v is None else float(v) for v in row[1:]] for row in rows],
+                    dtype=float).reshape(len(rows), 15)
+    return ts, cols
+
+
+def _group_min_max(idx, values, n):
+    lo = np.full(n, np.inf)
+    hi = np.full(n, -np.inf)
+    valid = ~np.isnan(values)
+    np.minimum.at(lo, idx[valid], values[valid])
+    np.maximum.at(hi, idx[valid], values[valid])
+    lo[np.isinf(lo)] = np.nan
+    hi[np.isinf(hi)] = np.nan
+    return lo, hi
+
+
+def aggregate_light_data(cursor, patient_id, from_dt, to_dt, bucket, metrics, thresholds=()):
+    """
+    Aggregerer patientens lysdata i buckets over [from_dt, to_dt) (naive UTC).
+    `metrics` er navne fra METRICS; `thresholds` er strenge som "illuminance:1000".
+    Bruger en ikke‐dictionary cursor. Returnerer et JSON‐venligt dict.
+    """
+    if bucket not in BUCKETS:
+        raise AggregationError(f"bucket skal være en af {', '.join(BUCKETS)}")
+    unknown = [m for m in metrics if m not in METRICS]
+    if unknown:
+        raise AggregationError(f"Ukendte metrikker: {', '.join(unknown)}")
+    if to_dt <= from_dt:
+        raise AggregationError('"to" skal ligge efter "from"')
+    thresholds = _parse_thresholds(thresholds)
+
+    boundaries = bucket_boundaries(from_dt, to_dt, bucket)
+    if len(boundaries) - 1 > MAX_BUCKETS:
+        raise AggregationError("For mange buckets – vælg en større bucket eller et kortere interval")
+    start, end = boundaries[0], boundaries[-1]
+    n = len(boundaries) - 1
+    edges = np.array(boundaries, dtype="datetime64[us]")
+
+    use_rollups = _can_use_rollups(start, end, bucket, thresholds)
+    if not use_rollups and end - start > MAX_RAW_RANGE:
+        raise AggregationError("Intervallet er for langt til rå data med de valgte tærskler")
+
+    stats = {}
+    above = {}
+    if use_rollups:
+        ts, cols = _fetch_rollups(cursor, patient_id, start, end)
+        idx = np.searchsorted(edges, ts, side="right") - 1
+        counts = np.bincount(idx, weights=cols[:, 0], minlength=n)
+        actions = np.bincount(idx, weights=cols[:, 2], minlength=n)
+        for metric in metrics:
+            base = {"edi": 3, "lux": 7, "score": 11}[METRICS[metric][1]]
+            c = np.bincount(idx, weights=cols[:, base], minlength=n)
+            s = np.bincount(idx, weights=np.nan_to_num(cols[:, base + 1]), minlength=n)
+            lo, _ = _group_min_max(idx, cols[:, base + 2], n)
+            _, hi = _group_min_max(idx, cols[:, base + 3], n)
+            stats[metric] = (c, s, lo, hi)
+        for metric, value in thresholds:
+            above[f"{metric}>={value:g}"] = np.bincount(idx, weights=cols[:, 1], minlength=n)
+    else:
+        counts, actions, stats, above = _aggregate_raw(
+            cursor, patient_id, start, end, edges, n, metrics, thresholds
+        )
+
+    def num(x):
+        return None if np.isnan(x) else round(float(x), 4)
+
+    buckets = []
+    for i in range(n):
+        entry = {
+            "start": _to_local(boundaries[i]).isoformat(),
+            "end":   _to_local(boundaries[i + 1]).isoformat(),
+            "count": int(counts[i]),
+            "action_required_count": int(actions[i]),
+        }
+        for metric, (c, s, lo, hi) in stats.items():
+            entry[metric] = {
+                "mean": round(float(s[i] / c[i]), 4) if c[i] else None,
+                "min":  num(lo[i]),
+                "max":  num(hi[i]),
+                "sum":  round(float(s[i]), 4),
+                "count": int(c[i]),
+            }
+        if above:
+            entry["above"] = {name: int(values[i]) for name, values in above.items()}
+        buckets.append(entry)
+
+    return {
+        "patient_id": patient_id,
+        "bucket": bucket,
+        "timezone": LOCAL_TZ.zone,
+        "source": "rollup" if use_rollups else "raw",
+        "from": _to_local(start).isoformat(),
+        "to": _to_local(end).isoformat(),
+        "buckets": buckets,
+    }
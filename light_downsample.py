@@ -0,0 +1,134 @@
+# light_downsample.py
+#
+# Server‐side nedsampling af en patients lyskurve til grafer: i stedet for at
+# sende alle rå målinger, som telefonen alligevel smider væk, udvælges højst
+# `max_points` målinger, der bevarer kurvens form.
+#   lttb    Largest‐Triangle‐Three‐Buckets (Steinarsson 2013)
+#   minmax  mindste og største værdi pr. bucket – bevarer alle spidser
+
+import numpy as np
+
+from light_pages import STREAM_CHUNK_ROWS, light_page_query
+
+METHODS = ("lttb", "minmax")
+Y_METRICS = ("melanopic_edi", "illuminance", "exposure_score")
+MIN_POINTS = 3
+MAX_POINTS = 5000
+# Øvre grænse for antal rå målinger, der læses til én nedsampling; et større
+# interval afvises med SourceTooLarge i stedet for at blive afkortet i stilhed
+MAX_SOURCE_ROWS = 2_000_000
+
+
+class SourceTooLarge(ValueError):
+    pass
+
+
+def lttb_indices(x, y, max_points):
+    """
+    Indeks for de punkter, LTTB beholder. Første og sidste punkt beholdes altid;
+    de øvrige fordeles i max_points - 2 buckets, hvor punktet med størst trekant
+    mod forrige valgte punkt og næste buckets gennemsnit vælges. Løkken går kun
+    over buckets – arealerne i hver bucket beregnes vektoriseret.
+    """
+    n = len(x)
+    if max_points >= n:
+        return np.arange(n)
+
+    edges = np.linspace(1, n - 1, max_points - 1).astype(np.int64)
+    sizes = np.diff(edges)
+    mean_x = np.add.reduceat(x[1:n - 1], edges[:-1] - 1) / sizes
+    mean_y = np.add.reduceat(y[1:n - 1], edges[:-1] - 1) / sizes
+
+    selected = np.empty(max_points, dtype=np.int64)
+    selected[0] = a = 0
+    for i in range(max_points - 2):
+        lo, hi = edges[i], edges[i + 1]
+        if i + 1 < max_points - 2:
+            cx, cy = mean_x[i + 1], mean_y[i + 1]
+        else:
+            cx, cy = x[-1], y[-1]
+        area = np.abs((x[a] - cx) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (cy - y[a]))
+        a = lo + int(np.argmax(area))
+        selected[i + 1] = a
+    selected[-1] = n - 1
+    return selected
+
+
+def minmax_indices(x, y, max_points):
+    """Indeks for min og max af y i hver af max_points // 2 lige store buckets (i tidsorden)."""
+    n = len(x)
+    if max_points >= n:
+        return np.arange(n)
+
+    buckets = max(max_points // 2, 1)
+    bucket_id = np.arange(n) * buckets // n
+    order = np.lexsort((y, bucket_id))
+    starts = np.searchsorted(bucket_id[order], np.arange(buckets), side="left")
+    ends = np.searchsorted(bucket_id[order], np.arange(buckets), side="right")
+    return np.unique(np.concatenate([order[starts], order[ends - 1]]))
+
+
+def fetch_downsampled(conn, patient_id, from_dt, to_dt, max_points, y_metric="melanopic_edi",
+                      method="lttb", chunk_size=STREAM_CHUNK_ROWS):
+    """
+    Læser intervallets målinger med fetchmany direkte ind i kolonner og returnerer
+    (antal målinger med værdi for `y_metric`, liste af JSON‐venlige dicts) med højst
+    max_points elementer. Målinger uden værdi for `y_metric` kan ikke tegnes og springes
+    over – de tælles heller ikke med. Kaster SourceTooLarge, hvis intervallet har flere
+    end MAX_SOURCE_ROWS rå målinger. Lukker forbindelsen.
+    """
+    # Én række ekstra, så et afkortet resultat kan genkendes
+    sql, params = light_page_query(patient_id, from_dt, to_dt, limit=MAX_SOURCE_ROWS + 1)
+    y_index = {"melanopic_edi": 2, "illuminance": 3, "exposure_score": 5}[y_metric]
+
+    captured_at, edi, illuminance, light_type, score, action = [], [], [], [], [], []
+    scanned = 0
+    cursor = conn.cursor()
+    try:
+        cursor.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            scanned += len(rows)
+            if scanned > MAX_SOURCE_ROWS:
+                raise SourceTooLarge(
+                    f"Intervallet har mere end {MAX_SOURCE_ROWS} målinger – vælg et kortere interval"
+                )
+            for row in rows:
+                if row[y_index] is None:
+                    continue
+                captured_at.append(row[1])
+                edi.append(row[2])
+                illuminance.append(row[3])
+                light_type.append(row[4])
+                score.append(row[5])
+                action.append(row[6])
+    finally:
+        cursor.close()
+        conn.close()
+
+    total = len(captured_at)
+    if total == 0:
+        return 0, []
+
+    def floats(values):
+        return np.array([np.nan if v is None else float(v) for v in values], dtype=float)
+
+    columns = {"melanopic_edi": floats(edi), "illuminance": floats(illuminance), "exposure_score": floats(score)}
+    x = np.array(captured_at, dtype="datetime64[ms]").astype(np.int64).astype(float)
+    pick = lttb_indices if method == "lttb" else minmax_indices
+    indices = pick(x, columns[y_metric], max_points)
+
+    def num(values, i):
+        return None if np.isnan(values[i]) else float(values[i])
+
+    result = [{
+        "captured_at":     captured_at[i].isoformat(),
+        "melanopic_edi":   num(columns["melanopic_edi"], i),
+        "illuminance":     num(columns["illuminance"], i),
+        "light_type":      light_type[i],
+        "exposure_score":  num(columns["exposure_score"], i),
+        "action_required": bool(action[i]) if action[i] is not None else False,
+    } for i in indices.tolist()]
+    return total, result
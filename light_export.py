@@ -0,0 +1,436 @@
+# light_export.py
+#
+# Asynkron eksport af en patients (eller en klinikers hele kohortes) lyshistorik
+# til CSV eller Parquet, evt. gzip‐komprimeret. Requesten opretter kun jobbet i
+# light_export_jobs (se sql/009_light_export_jobs.sql) og svarer med det samme;
+# en pulje af baggrundstråde læser data med keyset‐sider fra light_pages og
+# skriver dem side for side til en fil, så hverken request‐workers eller
+# hukommelsen bindes af lange historikker. Klienten poller jobbet og henter filen,
+# når status er 'done'.
+#
+# Filerne ligger i LIGHT_EXPORT_DIR, som skal være fælles for alle processer, der
+# kan besvare download. Færdige filer slettes efter LIGHT_EXPORT_RETENTION_H timer.
+
+import csv
+import gzip
+import io
+import os
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+
+from mysql_db import get_db_connection
+from light_pages import LIGHT_PAGE_COLUMNS, MAX_PAGE_SIZE, light_page_query
+from light_formats import FIELDS, PARQUET_CONTENT_TYPE, FormatUnavailable, pa
+
+EXPORT_FORMATS = ("csv", "parquet")
+EXPORT_COLUMNS = ("patient_id",) + FIELDS
+
+
+class ExportError(ValueError):
+    pass
+
+
+def _parse_datetime(raw, name):
+    try:
+        value = datetime.fromisoformat(str(raw).replace("Z", "+00:00"))
+    except ValueError:
+        raise ExportError(f'"{name}" skal være i ISO8601-format')
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def parse_export_params(data):
+    """
+    Udpakker {"from", "to", "format", "gzip"} fra requestens JSON (alle valgfrie).
+    Returnerer (from_dt, to_dt, format, gzip); kaster ExportError ved ugyldige værdier.
+    """
+    if not isinstance(data, dict):
+        raise ExportError("Forventer et JSON‐objekt")
+    from_dt = _parse_datetime(data["from"], "from") if data.get("from") else None
+    to_dt = _parse_datetime(data["to"], "to") if data.get("to") else None
+    fmt = data.get("format", "csv")
+    gzipped = data.get("gzip", False)
+    if not isinstance(gzipped, bool):
+        raise ExportError('"gzip" skal være true eller false')
+    return from_dt, to_dt, fmt, gzipped
+
+
+class _CsvSink:
+    def __init__(self, path, gzipped):
+        raw = gzip.open(path, "wb") if gzipped else open(path, "wb")
+        self._file = io.TextIOWrapper(raw, encoding="utf-8", newline="")
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(EXPORT_COLUMNS)
+
+    def write(self, patient_id, rows):
+        self._writer.writerows(
+            (patient_id, captured_at.isoformat(), edi, lux, light_type, score, int(bool(action)))
+            for _, captured_at, edi, lux, light_type, score, action in rows
+        )
+
+    def close(self):
+        self._file.close()
+
+
+class _ParquetSink:
+    def __init__(self, path, gzipped):
+        self._schema = pa.schema([
+            ("patient_id",      pa.string()),
+            ("captured_at",     pa.timestamp("ms", tz="UTC")),
+            ("melanopic_edi",   pa.float64()),
+            ("illuminance",     pa.float64()),
+            ("light_type",      pa.string()),
+            ("exposure_score",  pa.float64()),
+            ("action_required", pa.bool_()),
+        ])
+        # Parquet komprimerer pr. kolonne; gzip=1 vælger gzip‐codec i stedet for zstd
+        self._writer = pa.parquet.ParquetWriter(path, self._schema,
+                                                compression="gzip" if gzipped else "zstd")
+
+    def write(self, patient_id, rows):
+        _, captured_at, edi, lux, light_type, score, action = zip(*rows)
+
+        def floats(values):
+            return [float(v) if v is not None else None for v in values]
+
+        columns = (
+            [str(patient_id)] * len(rows), list(captured_at), floats(edi), floats(lux),
+            list(light_type), floats(score), [bool(v) for v in action],
+        )
+        self._writer.write_batch(pa.record_batch(
+            [pa.array(values, type=field.type) for values, field in zip(columns, self._schema)],
+            schema=self._schema,
+        ))
+
+    def close(self):
+        self._writer.close()
+
+
+def _file_name(job):
+    extension = job["format"] + (".gz" if job["format"] == "csv" and job["gzip"] else "")
+    return f"lightdata-{job['scope']}-{job['subject_id']}-{job['job_id'][:8]}.{extension}"
+
+
+def content_type(job):
+    if job["format"] == "parquet":
+        return PARQUET_CONTENT_TYPE
+    return "application/gzip" if job["gzip"] else "text/csv"
+
+
+def export_job_json(job):
+    """Jobbets status til polling‐svar."""
+    total = job["rows_total"]
+    return {
+        "job_id":       job["job_id"],
+        "scope":        job["scope"],
+        "subject_id":   job["subject_id"],
+        "from":         job["from_dt"].isoformat() if job["from_dt"] else None,
+        "to":           job["to_dt"].isoformat() if job["to_dt"] else None,
+        "format":       job["format"],
+        "gzip":         bool(job["gzip"]),
+        "status":       job["status"],
+        "rows_written": int(job["rows_written"]),
+        "rows_total":   int(total) if total is not None else None,
+        # Skønnet total kan være lidt for lav, hvis der indsættes data undervejs
+        "progress":     (1.0 if job["status"] == "done"
+                         else round(min(job["rows_written"] / total, 0.99), 4) if total else None),
+        "size_bytes":   int(job["size_bytes"]) if job["size_bytes"] is not None else None,
+        "error":        job["error"],
+        "created_at":   job["created_at"].isoformat(),
+        "finished_at":  job["finished_at"].isoformat() if job["finished_at"] else None,
+    }
+
+
+class LightExportJobs:
+    """
+    Pulje af `workers` baggrundstråde, der kører eksportjob fra light_export_jobs.
+    Et job tages med en betinget UPDATE (queued → running), så det kun køres én gang,
+    også hvis flere processer deler tabellen. start() (kaldes, når blueprintet
+    registreres) starter puljen og en vedligeholdelsestråd, der hvert
+    `maintenance_interval` sekund genoptager job i kø, starter kørende job uden
+    heartbeat i `stale_after` sekunder (processen døde) forfra og sletter udløbne filer.
+    """
+
+    def __init__(self, workers=2, export_dir=None, page_rows=MAX_PAGE_SIZE,
+                 retention_hours=24, stale_after=600, maintenance_interval=300):
+        self.workers = workers
+        self.export_dir = export_dir or os.path.join(tempfile.gettempdir(), "light-exports")
+        self.page_rows = page_rows
+        self.retention_hours = retention_hours
+        self.stale_after = stale_after
+        self.maintenance_interval = maintenance_interval
+        self._executor = None
+        self._maintainer = None
+        self._pending = set()     # job_id'er lagt i puljen, som endnu ikke er startet
+        self._lock = threading.Lock()
+        self._stats = {"submitted": 0, "completed": 0, "failed": 0, "rows_written": 0}
+
+    # ── Offentligt API ────────────────────────────────────────────
+
+    def submit(self, requested_by, scope, subject_id, from_dt=None, to_dt=None,
+               fmt="csv", gzipped=False):
+        """
+        Opretter et job og lægger det i puljen. Returnerer jobbets række (som get()).
+        Kaster ExportError ved ugyldige parametre og FormatUnavailable, hvis Parquet
+        ønskes uden pyarrow.
+        """
+        if fmt not in EXPORT_FORMATS:
+            raise ExportError(f'"format" skal være en af {", ".join(EXPORT_FORMATS)}')
+        if fmt == "parquet" and pa is None:
+            raise FormatUnavailable("pyarrow er ikke installeret på serveren")
+        if from_dt is not None and to_dt is not None and to_dt <= from_dt:
+            raise ExportError('"to" skal ligge efter "from"')
+
+        job_id = uuid.uuid4().hex
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("""
+                INSERT INTO light_export_jobs (
+                    job_id, requested_by, scope, subject_id, from_dt, to_dt, format, gzip
+                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+            """, (job_id, str(requested_by), scope, str(subject_id), from_dt, to_dt, fmt, int(gzipped)))
+            conn.commit()
+        finally:
+            cursor.close()
+            conn.close()
+
+        self.start()
+        self._enqueue(job_id)
+        with self._lock:
+            self._stats["submitted"] += 1
+        print(f"[{__name__}] Eksportjob {job_id} oprettet: {scope} {subject_id}, {fmt}, gzip={gzipped}")
+        return self.get(job_id)
+
+    def get(self, job_id):
+        """Jobbets række fra light_export_jobs, eller None."""
+        conn = get_db_connection()
+        cursor = conn.cursor(dictionary=True)
+        try:
+            cursor.execute("SELECT * FROM light_export_jobs WHERE job_id = %s", (job_id,))
+            return cursor.fetchone()
+        finally:
+            cursor.close()
+            conn.close()
+
+    def path(self, job):
+        """Sti til jobbets færdige fil."""
+        return os.path.join(self.export_dir, job["file_name"])
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, workers=self.workers, started=self._executor is not None)
+
+    def start(self):
+        """Starter puljen og vedligeholdelsestråden (idempotent)."""
+        if self._maintainer is not None:
+            return
+        with self._lock:
+            if self._maintainer is not None:
+                return
+            os.makedirs(self.export_dir, exist_ok=True)
+            self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                thread_name_prefix="light-export")
+            self._maintainer = threading.Thread(target=self._maintain_loop,
+                                                name="light-export-maintenance", daemon=True)
+            self._maintainer.start()
+
+    # ── Baggrundstråde ────────────────────────────────────────────
+
+    def _enqueue(self, job_id):
+        with self._lock:
+            if job_id in self._pending:
+                return
+            self._pending.add(job_id)
+        self._executor.submit(self._run, job_id)
+
+    def _maintain_loop(self):
+        while True:
+            try:
+                self._maintain()
+            except Exception as e:
+                print(f"[{__name__}] Vedligeholdelse af eksportjob fejlede: {e}")
+            time.sleep(self.maintenance_interval)
+
+    def _maintain(self):
+        for job_id in self._recoverable_jobs():
+            self._enqueue(job_id)
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            self._expire_old(cursor)
+            conn.commit()
+        finally:
+            cursor.close()
+            conn.close()
+
+    def _recoverable_jobs(self):
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("""
+                UPDATE light_export_jobs
+                SET status = 'queued', rows_written = 0
+                WHERE status = 'running'
+                  AND updated_at < NOW() - INTERVAL %s SECOND
+            """, (self.stale_after,))
+            cursor.execute("SELECT job_id FROM light_export_jobs WHERE status = 'queued' ORDER BY created_at")
+            job_ids = [job_id for (job_id,) in cursor.fetchall()]
+            conn.commit()
+        finally:
+            cursor.close()
+            conn.close()
+        if job_ids:
+            print(f"[{__name__}] Genoptager {len(job_ids)} eksportjob")
+        return job_ids
+
+    def _run(self, job_id):
+        with self._lock:
+            self._pending.discard(job_id)
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        part_path = None
+        try:
+            cursor.execute("""
+                UPDATE light_export_jobs
+                SET status = 'running', started_at = NOW(), rows_written = 0
+                WHERE job_id = %s AND status = 'queued'
+            """, (job_id,))
+            conn.commit()
+            if cursor.rowcount == 0:
+                return      # taget af en anden worker
+
+            job = self._load(conn, job_id)
+            patients = self._patients(cursor, job)
+            cursor.execute("UPDATE light_export_jobs SET rows_total = %s WHERE job_id = %s",
+                           (self._estimate(cursor, patients, job), job_id))
+            conn.commit()
+
+            file_name = _file_name(job)
+            part_path = os.path.join(self.export_dir, f"{file_name}.part")
+            sink = (_ParquetSink if job["format"] == "parquet" else _CsvSink)(part_path, job["gzip"])
+            written = 0
+            try:
+                for patient_id in patients:
+                    for rows in self._pages(cursor, patient_id, job["from_dt"], job["to_dt"]):
+                        sink.write(patient_id, rows)
+                        written += len(rows)
+                        # Fremdrift og heartbeat – én lille UPDATE pr. side
+                        cursor.execute("UPDATE light_export_jobs SET rows_written = %s WHERE job_id = %s",
+                                       (written, job_id))
+                        conn.commit()
+            finally:
+                sink.close()
+
+            os.replace(part_path, os.path.join(self.export_dir, file_name))
+            part_path = None
+            cursor.execute("""
+                UPDATE light_export_jobs
+                SET status = 'done', rows_written = %s, file_name = %s, size_bytes = %s, finished_at = NOW()
+                WHERE job_id = %s
+            """, (written, file_name, os.path.getsize(os.path.join(self.export_dir, file_name)), job_id))
+            conn.commit()
+            with self._lock:
+                self._stats["completed"] += 1
+                self._stats["rows_written"] += written
+            print(f"[{__name__}] Eksportjob {job_id} færdigt: {written} rækker")
+
+        except Exception as e:
+            print(f"[{__name__}] Eksportjob {job_id} fejlede: {e}")
+            conn.rollback()
+            cursor.execute("""
+                UPDATE light_export_jobs
+                SET status = 'failed', error = %s, finished_at = NOW()
+                WHERE job_id = %s
+            """, (str(e)[:500], job_id))
+            conn.commit()
+            with self._lock:
+                self._stats["failed"] += 1
+        finally:
+            if part_path and os.path.exists(part_path):
+                os.remove(part_path)
+            cursor.close()
+            conn.close()
+
+    def _load(self, conn, job_id):
+        cursor = conn.cursor(dictionary=True)
+        try:
+            cursor.execute("SELECT * FROM light_export_jobs WHERE job_id = %s", (job_id,))
+            return cursor.fetchone()
+        finally:
+            cursor.close()
+
+    def _patients(self, cursor, job):
+        if job["scope"] == "patient":
+            return [job["subject_id"]]
+        cursor.execute("""
+            SELECT CAST(patient_id AS CHAR)
+            FROM clinician_patients
+            WHERE clinician_id = %s
+            ORDER BY patient_id
+        """, (job["subject_id"],))
+        return [patient_id for (patient_id,) in cursor.fetchall()]
+
+    def _estimate(self, cursor, patients, job):
+        """Forventet antal rækker fra timerollups – billigt, og godt nok til en fremdriftsbjælke."""
+        if not patients:
+            return 0
+        conditions = [f"patient_id IN ({', '.join(['%s'] * len(patients))})", "bucket = 'hour'"]
+        params = list(patients)
+        if job["from_dt"] is not None:
+            conditions.append("bucket_start >= %s")
+            params.append(job["from_dt"].replace(minute=0, second=0, microsecond=0))
+        if job["to_dt"] is not None:
+            conditions.append("bucket_start <= %s")
+            params.append(job["to_dt"])
+        cursor.execute(f"""
+            SELECT COALESCE(SUM(total_measurements), 0)
+            FROM patient_light_rollups
+            WHERE {" AND ".join(conditions)}
+        """, params)
+        return int(cursor.fetchone()[0])
+
+    def _pages(self, cursor, patient_id, from_dt, to_dt):
+        """Patientens rækker (LIGHT_PAGE_COLUMNS) i keyset‐sider på højst page_rows rækker."""
+        after = None
+        while True:
+            sql, params = light_page_query(patient_id, from_dt, to_dt, after, self.page_rows)
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+            if not rows:
+                return
+            yield rows
+            if len(rows) < self.page_rows:
+                return
+            last = rows[-1]
+            after = (last[LIGHT_PAGE_COLUMNS.index("captured_at")], last[LIGHT_PAGE_COLUMNS.index("id")])
+
+    def _expire_old(self, cursor):
+        """Sletter filer for færdige job ældre end retention_hours og markerer dem 'expired'."""
+        cursor.execute("""
+            SELECT job_id, file_name
+            FROM light_export_jobs
+            WHERE status = 'done'
+              AND finished_at < NOW() - INTERVAL %s HOUR
+        """, (self.retention_hours,))
+        expired = cursor.fetchall()
+        for job_id, file_name in expired:
+            path = os.path.join(self.export_dir, file_name)
+            if os.path.exists(path):
+                os.remove(path)
+        if expired:
+            cursor.executemany("UPDATE light_export_jobs SET status = 'expired' WHERE job_id = %s",
+                               [(job_id,) for job_id, _ in expired])
+
+
+light_exports = LightExportJobs(
+    workers=int(os.environ.get("LIGHT_EXPORT_WORKERS", 2)),
+    export_dir=os.environ.get("LIGHT_EXPORT_DIR"),
+    retention_hours=int(os.environ.get("LIGHT_EXPORT_RETENTION_H", 24)),
+    maintenance_interval=int(os.environ.get("LIGHT_EXPORT_MAINTENANCE_S", 300)),
+)
@@ -0,0 +1,140 @@
+# light_formats.py
+#
+# Kolonneorienterede svarformater for lysdata‐siderne fra light_pages:
+#   format=columnar  JSON med parallelle arrays pr. felt (ingen gentagne nøgler)
+#   format=arrow     Arrow IPC‐stream, skrevet batch for batch direkte fra cursoren
+#   format=parquet   Parquet‐fil for hele siden
+# Arrow/Parquet kræver pyarrow, som er en valgfri afhængighed.
+
+import io
+import json
+
+from light_pages import DEFAULT_PAGE_SIZE, STREAM_CHUNK_ROWS, start_light_page, iter_light_chunks
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pa = None
+
+FORMATS = ("json", "columnar", "arrow", "parquet")
+ARROW_CONTENT_TYPE = "application/vnd.apache.arrow.stream"
+PARQUET_CONTENT_TYPE = "application/vnd.apache.parquet"
+
+# Felter i samme rækkefølge som LIGHT_PAGE_COLUMNS (uden id)
+FIELDS = ("captured_at", "melanopic_edi", "illuminance", "light_type", "exposure_score", "action_required")
+
+
+class FormatUnavailable(RuntimeError):
+    pass
+
+
+def _float_column(values):
+    return [float(v) if v is not None else None for v in values]
+
+
+def _columns(rows):
+    """Transponerer række‐tupler fra light_pages til lister pr. felt."""
+    _, captured_at, edi, illuminance, light_type, score, action = zip(*rows)
+    return {
+        "captured_at":     captured_at,
+        "melanopic_edi":   _float_column(edi),
+        "illuminance":     _float_column(illuminance),
+        "light_type":      list(light_type),
+        "exposure_score":  _float_column(score),
+        "action_required": [bool(v) for v in action],
+    }
+
+
+def read_columnar(conn, patient_id, from_dt=None, to_dt=None, after=None,
+                  limit=DEFAULT_PAGE_SIZE, chunk_size=STREAM_CHUNK_ROWS):
+    """
+    Returnerer (next_page_token, JSON‐streng) med ét array pr. felt – eller
+    (None, None) for en tom side. Sidens størrelse er afgrænset af `limit`.
+    """
+    page = start_light_page(conn, patient_id, from_dt, to_dt, after, limit, chunk_size)
+    if page is None:
+        return None, None
+    cursor, token, first = page
+
+    result = {field: [] for field in FIELDS}
+    for rows in iter_light_chunks(conn, cursor, first, chunk_size):
+        for field, values in _columns(rows).items():
+            if field == "captured_at":
+                values = [ts.isoformat() for ts in values]
+            result[field].extend(values)
+    result["count"] = len(result["captured_at"])
+    return token, json.dumps(result)
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise FormatUnavailable("pyarrow er ikke installeret på serveren")
+
+
+def _arrow_schema():
+    return pa.schema([
+        ("captured_at",     pa.timestamp("ms", tz="UTC")),
+        ("melanopic_edi",   pa.float64()),
+        ("illuminance",     pa.float64()),
+        ("light_type",      pa.string()),
+        ("exposure_score",  pa.float64()),
+        ("action_required", pa.bool_()),
+    ])
+
+
+def _record_batch(rows, schema):
+    columns = _columns(rows)
+    return pa.record_batch(
+        [pa.array(columns[field.name], type=field.type) for field in schema],
+        schema=schema,
+    )
+
+
+def open_arrow_stream(conn, patient_id, from_dt=None, to_dt=None, after=None,
+                      limit=DEFAULT_PAGE_SIZE, chunk_size=STREAM_CHUNK_ROWS):
+    """
+    Returnerer (next_page_token, generator af bytes) med en Arrow IPC‐stream,
+    hvor hver fetchmany‐bid bliver én record batch – eller (None, None) for en tom side.
+    Kaster FormatUnavailable, hvis pyarrow mangler.
+    """
+    _require_pyarrow()
+    page = start_light_page(conn, patient_id, from_dt, to_dt, after, limit, chunk_size)
+    if page is None:
+        return None, None
+    cursor, token, first = page
+    schema = _arrow_schema()
+
+    def generate():
+        sink = io.BytesIO()
+        with pa.ipc.new_stream(sink, schema) as writer:
+            for rows in iter_light_chunks(conn, cursor, first, chunk_size):
+                writer.write_batch(_record_batch(rows, schema))
+                yield sink.getvalue()
+                sink.seek(0)
+                sink.truncate()
+        yield sink.getvalue()   # end‐of‐stream markør
+
+    return token, generate()
+
+
+def read_parquet(conn, patient_id, from_dt=None, to_dt=None, after=None,
+                 limit=DEFAULT_PAGE_SIZE, chunk_size=STREAM_CHUNK_ROWS):
+    """
+    Returnerer (next_page_token, Parquet‐bytes) for siden – eller (None, None).
+    Parquet‐footeren skrives til sidst, så siden bygges i hukommelsen.
+    Kaster FormatUnavailable, hvis pyarrow mangler.
+    """
+    _require_pyarrow()
+    page = start_light_page(conn, patient_id, from_dt, to_dt, after, limit, chunk_size)
+    if page is None:
+        return None, None
+    cursor, token, first = page
+    schema = _arrow_schema()
+
+    sink = io.BytesIO()
+    with pa.parquet.ParquetWriter(sink, schema, compression="zstd") as writer:
+        for rows in iter_light_chunks(conn, cursor, first, chunk_size):
+            writer.write_batch(_record_batch(rows, schema))
+    return token, sink.getvalue()
@@ -0,0 +1,256 @@
+# light_ingest.py
+
+import json
+from datetime import datetime, timezone
+
+from light_metrics import RAW_CHANNELS, derive_metrics, require_calibration
+from light_rollups import update_rollups
+from sensor_liveness import update_liveness
+from light_validators import light_validators
+from light_period_cache import period_cache
+
+# Kolonnerækkefølgen for patient_light_sensor_data – alle række‐tupler
+# i ingest‐stien følger netop denne rækkefølge.
+LIGHT_COLUMNS = (
+    "patient_id",
+    "sensor_id",
+    "lux_level",
+    "captured_at",
+    "melanopic_edi",
+    "der",
+    "illuminance",
+    "light_type",
+    "exposure_score",
+    "action_required",
+    "raw_channels",
+    "metrics_version",
+)
+_COL = {name: i for i, name in enumerate(LIGHT_COLUMNS)}
+
+# Idempotent INSERT mod den unikke nøgle (patient_id, sensor_key, captured_at) – se
+# sql/001_light_sample_dedup.sql. En dublet rammer ON DUPLICATE KEY UPDATE id = id,
+# som ikke ændrer noget og tæller 0 berørte rækker, så cursor.rowcount fortæller, hvor
+# mange rækker der faktisk var nye. I modsætning til INSERT IGNORE nedgraderes andre
+# fejl (for lange strenge, NULL i NOT NULL‐kolonner, …) ikke til advarsler.
+# Forudsætter, at forbindelsen ikke bruger CLIENT_FOUND_ROWS.
+INSERT_LIGHT_SQL = """
+    INSERT INTO patient_light_sensor_data (
+        patient_id,
+        sensor_id,
+        lux_level,
+        captured_at,
+        melanopic_edi,
+        der,
+        illuminance,
+        light_type,
+        exposure_score,
+        action_required,
+        raw_channels,
+        metrics_version
+    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE id = id
+"""
+
+
+def parse_timestamp(raw_ts):
+    """
+    Parser klientens ISO8601‐tidsstempel (evt. med “Z” bagerst) til en naiv UTC‐datetime;
+    tidsstempler med offset omregnes, så alle captured_at kan sammenlignes.
+    Mangler tidsstemplet, falder vi tilbage på serverens aktuelle UTC‐tid.
+    """
+    if raw_ts is None:
+        return datetime.now(timezone.utc).replace(tzinfo=None)
+    if not isinstance(raw_ts, str):
+        raise ValueError(f"Ugyldigt timestamp: {raw_ts!r}")
+    value = datetime.fromisoformat(raw_ts.replace("Z", "+00:00"))
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def parse_sensor_id(raw):
+    """
+    sensor_id som heltal (eller None). Accepterer også heltal sendt som streng, fx fra
+    query‐parametre; alt andet afvises, så ugyldige id'er aldrig når rollups og livstegn.
+    """
+    if raw is None:
+        return None
+    if isinstance(raw, bool) or not isinstance(raw, (int, str)):
+        raise ValueError(f"Ugyldigt sensor_id: {raw!r}")
+    try:
+        return int(raw)
+    except ValueError:
+        raise ValueError(f"Ugyldigt sensor_id: {raw!r}")
+
+
+def parse_channels(raw):
+    """
+    Validerer rå sensorkanaler – enten en liste i RAW_CHANNELS‐rækkefølge
+    eller et objekt med kanalnavnene som nøgler. Afvises (CalibrationMissing,
+    en ValueError), så længe serveren ikke har en sensorkalibrering.
+    """
+    if raw is None:
+        return None
+    require_calibration()
+    if isinstance(raw, dict):
+        raw = [raw[name] for name in RAW_CHANNELS]
+    if not isinstance(raw, list) or len(raw) != len(RAW_CHANNELS):
+        raise ValueError(f"channels skal have {len(RAW_CHANNELS)} værdier")
+    return [float(value) for value in raw]
+
+
+def parse_light_sample(data, defaults=None):
+    """
+    Udpakker ét lysdatapunkt fra klientens JSON til en række‐tuple i LIGHT_COLUMNS‐rækkefølge.
+    `defaults` kan indeholde patient_id/sensor_id fra en batch‐header, som bruges
+    når det enkelte datapunkt ikke selv angiver dem.
+    Sender klienten rå "channels" i stedet for illuminance/melanopic_edi/der, beregnes
+    de af derive_missing_metrics() (sker senest i insert_light_rows); exposure_score
+    og light_type skal stadig sendes med.
+    Kaster KeyError/ValueError/TypeError ved ugyldige felter.
+    """
+    if not isinstance(data, dict):
+        raise TypeError("Datapunktet skal være et JSON‐objekt")
+    defaults = defaults or {}
+
+    patient_id = data.get("patient_id", defaults.get("patient_id"))
+    if patient_id is None:
+        raise KeyError("patient_id")
+
+    return (
+        patient_id,
+        parse_sensor_id(data.get("sensor_id", defaults.get("sensor_id"))),
+        data.get("lux_level"),
+        # Klienten sender "timestamp" i stedet for "captured_at":
+        parse_timestamp(data.get("timestamp")),
+        data.get("melanopic_edi"),
+        data.get("der"),
+        data.get("illuminance"),
+        data.get("light_type"),
+        data.get("exposure_score"),
+        data.get("action_required", 0),
+        _parse_sample_channels(data),
+        None,
+    )
+
+
+def _parse_sample_channels(data):
+    channels = parse_channels(data.get("channels"))
+    if channels is not None:
+        for name in ("exposure_score", "light_type"):
+            if data.get(name) is None:
+                raise KeyError(f"{name} skal sendes sammen med channels")
+    return channels
+
+
+# rowcount er 0, hvis batchen allerede er modtaget (se INSERT_LIGHT_SQL)
+CLAIM_BATCH_SQL = """
+    INSERT INTO light_ingest_batches (batch_id, sample_count)
+    VALUES (%s, %s)
+    ON DUPLICATE KEY UPDATE batch_id = batch_id
+"""
+
+_KEY_INDEXES = (_COL["patient_id"], _COL["sensor_id"], _COL["captured_at"])
+
+
+def sample_key(row):
+    """Naturlig nøgle for et datapunkt: (patient_id, sensor_id, captured_at)."""
+    return tuple(row[i] for i in _KEY_INDEXES)
+
+
+def derive_missing_metrics(rows):
+    """
+    Beregner melanopic_edi, der og illuminance for alle rækker med rå kanaler men
+    uden afledte mål – vektoriseret over hele listen i ét NumPy‐kald. Returnerer en
+    ny liste; øvrige rækker er uændrede.
+    """
+    pending = [
+        i for i, row in enumerate(rows)
+        if row[_COL["raw_channels"]] is not None and row[_COL["melanopic_edi"]] is None
+    ]
+    if not pending:
+        return rows
+
+    calibration = require_calibration()
+    metrics = derive_metrics([rows[i][_COL["raw_channels"]] for i in pending], calibration)
+    columns = {name: metrics[name].tolist() for name in metrics}
+
+    rows = list(rows)
+    for n, i in enumerate(pending):
+        row = list(rows[i])
+        for name, values in columns.items():
+            row[_COL[name]] = values[n]
+        if row[_COL["lux_level"]] is None:
+            row[_COL["lux_level"]] = row[_COL["illuminance"]]
+        row[_COL["metrics_version"]] = calibration["version"]
+        rows[i] = tuple(row)
+    return rows
+
+
+def insert_light_rows(cursor, rows):
+    """
+    Indsætter en liste af række‐tupler og returnerer antallet af NYE rækker.
+    Time‐/dagsrollups og sensorernes livstegn/huller opdateres i samme transaktion.
+    Dubletter inden for listen fjernes i hukommelsen, og dubletter mod tabellen
+    ignoreres af den unikke nøgle. mysql‐connector omskriver executemany på en
+    INSERT … VALUES til én multi‐row INSERT, så hele listen går i én runde.
+    Committer ikke – det er kalderens ansvar.
+    """
+    if not rows:
+        return 0
+    rows = derive_missing_metrics(rows)
+    raw_index = _COL["raw_channels"]
+    seen = set()
+    unique_rows = []
+    for row in rows:
+        key = sample_key(row)
+        if key not in seen:
+            seen.add(key)
+            if row[raw_index] is not None:
+                row = row[:raw_index] + (json.dumps(row[raw_index]),) + row[raw_index + 1:]
+            unique_rows.append(row)
+    cursor.executemany(INSERT_LIGHT_SQL, unique_rows)
+    new = max(cursor.rowcount, 0)
+    update_rollups(cursor, unique_rows, LIGHT_COLUMNS, new)
+    update_liveness(cursor, unique_rows, LIGHT_COLUMNS, new)
+    return new
+
+
+def rows_committed(rows):
+    """
+    Kaldes efter commit af indsatte rækker, så patienternes ETag/Last-Modified‐
+    validatorer og cachede periodesvar i denne proces ikke længere bruges
+    (se light_validators.py og light_period_cache.py).
+    """
+    pid, ts = _COL["patient_id"], _COL["captured_at"]
+    light_validators.touch(row[pid] for row in rows)
+    # Perioderne følger hele døgn, så én invalidering pr. (patient, dag) er nok
+    period_cache.invalidate({
+        (row[pid], row[ts].replace(hour=0, minute=0, second=0, microsecond=0)) for row in rows
+    })
+
+
+def store_light_rows(conn, rows, batch_id=None):
+    """
+    Indsætter rækkerne idempotent og committer. Er `batch_id` angivet, registreres
+    den i light_ingest_batches i samme transaktion; er batchen allerede modtaget,
+    springes hele indsættelsen over.
+    Returnerer {"new": …, "duplicates": …, "batch_replayed": …}.
+    """
+    cursor = conn.cursor()
+    try:
+        if batch_id is not None:
+            cursor.execute(CLAIM_BATCH_SQL, (batch_id, len(rows)))
+            if cursor.rowcount == 0:
+                conn.rollback()
+                return {"new": 0, "duplicates": len(rows), "batch_replayed": True}
+        new = insert_light_rows(cursor, rows)
+        conn.commit()
+        if new:
+            rows_committed(rows)
+        return {"new": new, "duplicates": len(rows) - new, "batch_replayed": False}
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
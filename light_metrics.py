@@ -0,0 +1,232 @@
+# light_metrics.py
+#
+# Server‐side beregning af de fysiske lysmål (illuminance, melanopic_edi, der)
+# ud fra sensorens rå spektralkanaler. Alt beregnes vektoriseret med NumPy over en
+# hel batch af datapunkter.
+#
+# Kalibreringen er sensorspecifik og læses fra den JSON‐fil, LIGHT_CALIBRATION_FILE
+# peger på (se load_calibration). Er den ikke konfigureret, afvises datapunkter med
+# rå kanaler, så der aldrig gemmes værdier beregnet med gættede koefficienter.
+# exposure_score, light_type og action_required beregnes af appen og skal sendes
+# med sammen med kanalerne.
+#
+# Genberegning af historiske rækker, når kalibreringen ændres:
+#   python light_metrics.py --from 2025-06-01 --to 2025-07-01 [--patient P3]
+
+import argparse
+import json
+import os
+from datetime import datetime, time, timedelta
+
+import numpy as np
+import pytz
+
+from mysql_db import get_db_connection
+from light_rollups import hour_start, refresh_rollups
+
+LOCAL_TZ = pytz.timezone("Europe/Copenhagen")
+
+# Sensorens kanaler i den rækkefølge, klienten sender dem i "channels".
+RAW_CHANNELS = ("f1", "f2", "f3", "f4", "f5", "f6", "f7", "f8", "clear", "nir")
+
+# Nøgler i kalibreringsfilen – én værdi pr. kanal i RAW_CHANNELS‐rækkefølge:
+#   irradiance_per_count  rå tælling → spektral irradians (W/m²/nm), fra sensorens kalibrering
+#   bandwidth_nm          kanalens effektive båndbredde (nm)
+#   photopic              kanalens vægt for CIE V(λ)
+#   melanopic             kanalens vægt for CIE S026 melanopisk følsomhed
+# Derudover "version" (heltal), som gemmes i metrics_version og skal hæves, når
+# kalibreringen ændres, så reprocess_light_metrics() kan finde ældre rækker.
+CALIBRATION_KEYS = ("irradiance_per_count", "bandwidth_nm", "photopic", "melanopic")
+PHOTOPIC_EFFICACY = 683.0          # lm/W
+MELANOPIC_D65_EFFICACY = 1.3262e-3  # W/m² melanopisk irradians pr. lux (D65)
+
+
+class CalibrationMissing(ValueError):
+    pass
+
+
+def load_calibration(path):
+    """Læser og validerer en kalibreringsfil. Returnerer {"version": int, <nøgle>: array}."""
+    with open(path, encoding="utf-8") as f:
+        raw = json.load(f)
+    calibration = {"version": int(raw["version"])}
+    for key in CALIBRATION_KEYS:
+        values = np.asarray(raw[key], dtype=float)
+        if values.shape != (len(RAW_CHANNELS),):
+            raise ValueError(f"{path}: {key} skal have {len(RAW_CHANNELS)} værdier")
+        calibration[key] = values
+    return calibration
+
+
+CALIBRATION = (
+    load_calibration(os.environ["LIGHT_CALIBRATION_FILE"])
+    if os.environ.get("LIGHT_CALIBRATION_FILE") else None
+)
+
+
+def require_calibration():
+    """Den konfigurerede kalibrering – kaster CalibrationMissing, hvis der ikke er nogen."""
+    if CALIBRATION is None:
+        raise CalibrationMissing(
+            "Rå kanaler kan ikke modtages: sensorkalibrering er ikke konfigureret "
+            "(LIGHT_CALIBRATION_FILE)"
+        )
+    return CALIBRATION
+
+
+def _utc_offset(utc_naive):
+    """Europe/Copenhagens UTC‐offset i sekunder på UTC‐tidspunktet `utc_naive`."""
+    return int(pytz.utc.localize(utc_naive).astimezone(LOCAL_TZ).utcoffset().total_seconds())
+
+
+def _offset_change(day_start, day_end):
+    """Første UTC‐sekund i [day_start, day_end), hvor offset skifter (kalderen ved, at det gør)."""
+    before = _utc_offset(day_start)
+    lo, hi = 0, int((day_end - day_start).total_seconds())
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if _utc_offset(day_start + timedelta(seconds=mid)) == before:
+            lo = mid
+        else:
+            hi = mid
+    return day_start + timedelta(seconds=hi)
+
+
+def local_seconds(captured_at):
+    """
+    Lokale (Europe/Copenhagen) sekunder siden epoch som int64 for naive UTC‐tidspunkter.
+    Offset slås op ved starten og slutningen af hver UTC‐dag; er de forskellige (skift
+    til/fra sommertid), findes skiftetidspunktet, og hvert tidspunkt får offset fra sin
+    side af skiftet. Resten er vektoriseret.
+    """
+    ts = np.array(captured_at, dtype="datetime64[s]")
+    days = ts.astype("datetime64[D]")
+    offsets = np.empty(len(ts), dtype=np.int64)
+    for day in np.unique(days):
+        in_day = days == day
+        day_start = datetime.combine(day.astype(datetime), time())
+        day_end = day_start + timedelta(days=1)
+        start_offset, end_offset = _utc_offset(day_start), _utc_offset(day_end)
+        if start_offset == end_offset:
+            offsets[in_day] = start_offset
+            continue
+        change = np.datetime64(_offset_change(day_start, day_end), "s")
+        offsets[in_day] = np.where(ts[in_day] < change, start_offset, end_offset)
+    return ts.astype(np.int64) + offsets
+
+
+def local_hours(captured_at):
+    """Lokal (Europe/Copenhagen) time på døgnet som float for naive UTC‐tidspunkter."""
+    return (local_seconds(captured_at) % 86400) / 3600.0
+
+
+def derive_metrics(channels, calibration=None):
+    """
+    `channels`: (n, len(RAW_CHANNELS)) array af rå tællinger.
+    Returnerer en dict af arrays: illuminance, melanopic_edi og der.
+    Kaster CalibrationMissing, hvis ingen kalibrering er angivet eller konfigureret.
+    """
+    calibration = calibration or require_calibration()
+    channels = np.asarray(channels, dtype=float)
+    spectral = channels * calibration["irradiance_per_count"] * calibration["bandwidth_nm"]
+
+    illuminance = PHOTOPIC_EFFICACY * spectral @ calibration["photopic"]
+    melanopic_edi = (spectral @ calibration["melanopic"]) / MELANOPIC_D65_EFFICACY
+    der = np.divide(melanopic_edi, illuminance, out=np.zeros_like(illuminance), where=illuminance > 0)
+
+    return {
+        "illuminance":   illuminance,
+        "melanopic_edi": melanopic_edi,
+        "der":           der,
+    }
+
+
+def reprocess_light_metrics(start, end, patient_id=None, batch_size=5000, all_versions=False):
+    """
+    Genberegner de fysiske lysmål for rækker med rå kanaler i [start, end).
+    Som standard kun rækker beregnet med en ældre kalibreringsversion.
+    Læser og opdaterer i keyset‐sider på id, så hukommelsesforbruget er konstant.
+    Kører typisk i sin egen proces og kan derfor ikke rydde webprocessernes
+    validatorer og periodecache direkte. De opdager ændringen via rollups' updated_at
+    (se light_validators.py), dvs. senest efter LIGHT_VALIDATOR_TTL_S sekunder.
+    """
+    conditions = ["raw_channels IS NOT NULL", "captured_at >= %s", "captured_at < %s"]
+    params = [start, end]
+    if patient_id is not None:
+        conditions.append("patient_id = %s")
+        params.append(patient_id)
+    calibration = require_calibration()
+    if not all_versions:
+        conditions.append("(metrics_version IS NULL OR metrics_version < %s)")
+        params.append(calibration["version"])
+
+    conditions.append("id > %s")
+    query = f"""
+        SELECT id, captured_at, raw_channels, patient_id
+        FROM patient_light_sensor_data
+        WHERE {" AND ".join(conditions)}
+        ORDER BY id ASC
+        LIMIT %s
+    """
+    update = """
+        UPDATE patient_light_sensor_data
+        SET illuminance = %s, melanopic_edi = %s, der = %s, metrics_version = %s
+        WHERE id = %s
+    """
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    updated = 0
+    last_id = 0
+    try:
+        while True:
+            cursor.execute(query, (*params, last_id, batch_size))
+            page = cursor.fetchall()
+            if not page:
+                break
+            last_id = page[-1][0]
+
+            ids = [row[0] for row in page]
+            metrics = derive_metrics(
+                np.array([json.loads(row[2]) for row in page], dtype=float), calibration,
+            )
+            cursor.executemany(update, list(zip(
+                metrics["illuminance"].tolist(),
+                metrics["melanopic_edi"].tolist(),
+                metrics["der"].tolist(),
+                [calibration["version"]] * len(ids),
+                ids,
+            )))
+            # Rollups for de berørte timer genberegnes i samme transaktion
+            refresh_rollups(cursor, {(row[3], hour_start(row[1])) for row in page})
+            conn.commit()
+            updated += len(ids)
+            print(f"[{__name__}] Genberegnet {updated} rækker (til og med id {last_id})")
+    finally:
+        cursor.close()
+        conn.close()
+    return updated
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Genberegn afledte lysmål ud fra rå kanaler")
+    parser.add_argument("--from", dest="start", required=True, help="ISO8601, inklusiv")
+    parser.add_argument("--to", dest="end", required=True, help="ISO8601, eksklusiv")
+    parser.add_argument("--patient")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--all-versions", action="store_true",
+                        help="genberegn også rækker med nuværende kalibreringsversion")
+    args = parser.parse_args()
+
+    updated = reprocess_light_metrics(
+        datetime.fromisoformat(args.start),
+        datetime.fromisoformat(args.end),
+        patient_id=args.patient,
+        batch_size=args.batch_size,
+        all_versions=args.all_versions,
+    )
+    print(f"{updated} rækker genberegnet")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+# light_pages.py
+#
+# Keyset‐paginering af en patients lysmålinger på (captured_at, id). Hver side
+# læses med en afgrænset forespørgsel, der starter lige efter forrige sides
+# sidste række, så klienter og eksportværktøjer kan gennemløbe hele historikken
+# med konstant hukommelsesforbrug – uanset hvor langt inde i historikken de er.
+
+import base64
+import json
+from datetime import datetime
+
+DEFAULT_PAGE_SIZE = 5000
+MAX_PAGE_SIZE = 20000
+STREAM_CHUNK_ROWS = 1000
+
+LIGHT_PAGE_COLUMNS = (
+    "id",
+    "captured_at",
+    "melanopic_edi",
+    "illuminance",
+    "light_type",
+    "exposure_score",
+    "action_required",
+)
+
+
+class PageTokenError(ValueError):
+    pass
+
+
+def encode_page_token(captured_at, row_id):
+    raw = f"{captured_at.isoformat()}|{row_id}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_page_token(token):
+    """Returnerer (captured_at, id) fra en token fra encode_page_token."""
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)).decode("utf-8")
+        captured_at, row_id = raw.split("|")
+        return datetime.fromisoformat(captured_at), int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        raise PageTokenError("Ugyldig page_token")
+
+
+def parse_page_size(raw):
+    """Sidestørrelse fra query‐parameteren `limit`, afgrænset til MAX_PAGE_SIZE."""
+    if raw is None:
+        return DEFAULT_PAGE_SIZE
+    try:
+        size = int(raw)
+    except ValueError:
+        raise PageTokenError('"limit" skal være et heltal')
+    if size < 1:
+        raise PageTokenError('"limit" skal være mindst 1')
+    return min(size, MAX_PAGE_SIZE)
+
+
+def light_page_query(patient_id, from_dt=None, to_dt=None, after=None, limit=DEFAULT_PAGE_SIZE,
+                     columns=LIGHT_PAGE_COLUMNS, offset=0):
+    """
+    Bygger (sql, params) for op til `limit` rækker stigende på (captured_at, id).
+    `after` er (captured_at, id) for forrige sides sidste række.
+    Udfoldet keyset‐betingelse, så MySQL kan bruge idx_light_patient_captured
+    (sekundære InnoDB‐indeks indeholder primærnøglen id).
+    """
+    conditions = ["patient_id = %s"]
+    params = [patient_id]
+    if from_dt is not None:
+        conditions.append("captured_at >= %s")
+        params.append(from_dt)
+    if to_dt is not None:
+        conditions.append("captured_at <= %s")
+        params.append(to_dt)
+    if after is not None:
+        conditions.append("(captured_at > %s OR (captured_at = %s AND id > %s))")
+        params.extend([after[0], after[0], after[1]])
+    params.extend([limit, offset])
+
+    sql = f"""
+        SELECT {", ".join(columns)}
+        FROM patient_light_sensor_data
+        WHERE {" AND ".join(conditions)}
+        ORDER BY captured_at ASC, id ASC
+        LIMIT %s OFFSET %s
+    """
+    return sql, params
+
+
+def fetch_light_page(cursor, patient_id, from_dt=None, to_dt=None, after=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    Henter én side med en dictionary‐cursor.
+    Returnerer (rækker, next_page_token) – token er None på sidste side.
+    """
+    # limit + 1 rækker, så vi kan se, om der findes en næste side
+    sql, params = light_page_query(patient_id, from_dt, to_dt, after, limit + 1)
+    cursor.execute(sql, params)
+    rows = cursor.fetchall()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_page_token(last["captured_at"], last["id"])
+
+
+def next_page_token(cursor, patient_id, from_dt=None, to_dt=None, after=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    Token til siden efter den aktuelle, uden at læse siden selv: slår kun
+    nøglerne for sidens sidste række og rækken efter op (dækket af indekset).
+    Returnerer None, hvis den aktuelle side er den sidste.
+    """
+    sql, params = light_page_query(patient_id, from_dt, to_dt, after, 2,
+                                   columns=("captured_at", "id"), offset=limit - 1)
+    cursor.execute(sql, params)
+    keys = cursor.fetchall()
+    if len(keys) < 2:
+        return None
+    return encode_page_token(*keys[0])
+
+
+def _light_row_json(row):
+    _, captured_at, edi, illuminance, light_type, score, action = row
+    return json.dumps({
+        "captured_at":     captured_at.isoformat(),
+        "melanopic_edi":   float(edi) if edi is not None else None,
+        "illuminance":     float(illuminance) if illuminance is not None else None,
+        "light_type":      light_type,
+        "exposure_score":  float(score) if score is not None else None,
+        "action_required": bool(action) if action is not None else False,
+    })
+
+
+def start_light_page(conn, patient_id, from_dt=None, to_dt=None, after=None,
+                     limit=DEFAULT_PAGE_SIZE, chunk_size=STREAM_CHUNK_ROWS):
+    """
+    Åbner en side på en ikke‐bufferet cursor og læser første bid.
+    Returnerer (cursor, next_page_token, første bid) – eller None, hvis siden er
+    tom; så er cursor og forbindelse allerede lukket. Ellers ejer kalderen dem.
+
+    Token og side læses i samme konsistente snapshot (REPEATABLE READ), så en
+    række indsat mellem de to forespørgsler ikke kan flytte sidegrænsen og få
+    klienten til at springe rækker over eller få dem to gange.
+    """
+    cursor = conn.cursor()
+    try:
+        conn.start_transaction(consistent_snapshot=True, isolation_level="REPEATABLE READ",
+                               readonly=True)
+        token = next_page_token(cursor, patient_id, from_dt, to_dt, after, limit)
+        sql, params = light_page_query(patient_id, from_dt, to_dt, after, limit)
+        cursor.execute(sql, params)
+        first = cursor.fetchmany(chunk_size)
+    except Exception:
+        _end_page(conn, cursor)
+        raise
+    if not first:
+        _end_page(conn, cursor)
+        return None
+    return cursor, token, first
+
+
+def _end_page(conn, cursor):
+    # At lukke forbindelsen afslutter også sidens snapshot‐transaktion (en afbrudt
+    # stream kan have ulæste rækker, så et eksplicit rollback ville fejle)
+    cursor.close()
+    conn.close()
+
+
+def iter_light_chunks(conn, cursor, first, chunk_size=STREAM_CHUNK_ROWS):
+    """Bidder af række‐tupler fra start_light_page; lukker cursor og forbindelse til sidst."""
+    try:
+        rows = first
+        while rows:
+            yield rows
+            rows = cursor.fetchmany(chunk_size)
+    finally:
+        _end_page(conn, cursor)
+
+
+def open_light_stream(conn, patient_id, from_dt=None, to_dt=None, after=None,
+                      limit=DEFAULT_PAGE_SIZE, chunk_size=STREAM_CHUNK_ROWS):
+    """
+    Starter en side som JSON‐stream. Returnerer (next_page_token, generator) –
+    eller (None, None), hvis siden er tom; så er forbindelsen allerede lukket.
+
+    Rækkerne hentes med fetchmany fra en ikke‐bufferet cursor og serialiseres
+    `chunk_size` ad gangen, så hukommelsesforbruget er konstant uanset sidens
+    størrelse. Generatoren lukker cursor og forbindelse, også hvis klienten
+    afbryder undervejs.
+    """
+    page = start_light_page(conn, patient_id, from_dt, to_dt, after, limit, chunk_size)
+    if page is None:
+        return None, None
+    cursor, token, first = page
+
+    def generate():
+        separator = "["
+        for rows in iter_light_chunks(conn, cursor, first, chunk_size):
+            yield separator + ",".join(_light_row_json(r) for r in rows)
+            separator = ","
+        yield "]"
+
+    return token, generate()
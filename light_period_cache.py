@@ -0,0 +1,110 @@
+# light_period_cache.py
+#
+# Cache for færdige svar på lukkede perioder (en afsluttet uge eller måned) pr.
+# patient. Data for lukkede perioder ændrer sig kun, når en sen måling for
+# perioden indsættes, så svarene gemmes uden udløbstid – kun LRU‐fortrængning
+# ved hukommelsesgrænsen. Svarene gemmes som færdigserialiserede bytes, så
+# hukommelsesforbruget kan tælles præcist.
+#
+# Ugyldiggørelse:
+#   - indsættelser i denne proces kalder invalidate() (via light_ingest.rows_committed)
+#     efter commit og fjerner netop de perioder, de sene målinger falder i
+#   - hvert opslag sammenholdes med periodens ETag fra light_validators (MAX(updated_at)
+#     i patient_light_rollups, husket højst LIGHT_VALIDATOR_TTL_S sekunder), så ændringer
+#     fra andre processer – andre workers, ingest‐køen, error_log_replay og
+#     reprocess_light_metrics – også opdages
+
+import os
+import threading
+from collections import OrderedDict
+
+
+class PeriodCache:
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()   # (patient_id, bucket, start) → (end, etag, body)
+        self._by_patient = {}           # patient_id → sæt af nøgler
+        self._generation = {}           # patient_id → antal invalideringer
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "stale": 0, "invalidations": 0, "evictions": 0}
+
+    def get(self, patient_id, bucket, start_dt, etag):
+        """Gemt svar for perioden, hvis det stadig svarer til `etag` – ellers None."""
+        key = (patient_id, bucket, start_dt)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            if entry[1] != etag:
+                self._stats["stale"] += 1
+                self._stats["misses"] += 1
+                self._drop(key)
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return entry[2]
+
+    def generation(self, patient_id):
+        """Hentes før svaret beregnes og gives til put()."""
+        with self._lock:
+            return self._generation.get(patient_id, 0)
+
+    def put(self, patient_id, bucket, start_dt, end_dt, etag, body, generation):
+        """
+        Gemmer svaret. Er der indsat målinger for patienten, siden `generation` blev
+        hentet, kan svaret være forældet og gemmes ikke.
+        """
+        size = len(body)
+        if size > self.max_bytes:
+            return
+        key = (patient_id, bucket, start_dt)
+        with self._lock:
+            if self._generation.get(patient_id, 0) != generation:
+                return
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (end_dt, etag, body)
+            self._by_patient.setdefault(patient_id, set()).add(key)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self._stats["evictions"] += 1
+
+    def invalidate(self, samples):
+        """`samples`: (patient_id, captured_at)‐par for netop indsatte målinger."""
+        with self._lock:
+            for patient_id, captured_at in samples:
+                self._generation[patient_id] = self._generation.get(patient_id, 0) + 1
+                for key in list(self._by_patient.get(patient_id, ())):
+                    end_dt = self._entries[key][0]
+                    if key[2] <= captured_at < end_dt:
+                        self._drop(key)
+                        self._stats["invalidations"] += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return dict(
+                self._stats,
+                entries=len(self._entries),
+                bytes=self._bytes,
+                max_bytes=self.max_bytes,
+                hit_ratio=round(self._stats["hits"] / lookups, 4) if lookups else None,
+            )
+
+    def _drop(self, key):
+        _, _, body = self._entries.pop(key)
+        self._bytes -= len(body)
+        keys = self._by_patient[key[0]]
+        keys.discard(key)
+        if not keys:
+            del self._by_patient[key[0]]
+
+
+period_cache = PeriodCache(
+    max_bytes=int(os.environ.get("LIGHT_PERIOD_CACHE_MB", 64)) * 1024 * 1024,
+)
@@ -0,0 +1,231 @@
+# light_rollups.py
+#
+# Time‐ og dagsopsummeringer pr. patient i patient_light_rollups
+# (se sql/006_light_rollups.sql). Holdes ajour i samme transaktion som
+# indsættelsen i patient_light_sensor_data, så weekly/monthly kan læse en
+# håndfuld rollup‐rækker i stedet for at aggregere alle rå målinger.
+
+from datetime import timedelta
+
+HIGH_LIGHT_LUX = 1000
+
+_METRICS = (
+    # (præfiks i rollup‐tabellen, kolonne i patient_light_sensor_data)
+    ("edi",   "melanopic_edi"),
+    ("lux",   "illuminance"),
+    ("score", "exposure_score"),
+)
+
+_STAT_COLUMNS = [f"{p}_{s}" for p, _ in _METRICS for s in ("count", "sum", "min", "max")]
+ROLLUP_COLUMNS = (
+    "total_measurements",
+    "count_high_light",
+    "count_low_light",
+    "action_required_count",
+    *_STAT_COLUMNS,
+)
+
+_INSERT_COLUMNS = ", ".join(("patient_id", "bucket", "bucket_start") + ROLLUP_COLUMNS)
+_PLACEHOLDERS = ", ".join(["%s"] * (3 + len(ROLLUP_COLUMNS)))
+
+
+def _merge_clause(column):
+    if column.endswith("_min"):
+        return f"{column} = LEAST(COALESCE({column}, VALUES({column})), COALESCE(VALUES({column}), {column}))"
+    if column.endswith("_max"):
+        return f"{column} = GREATEST(COALESCE({column}, VALUES({column})), COALESCE(VALUES({column}), {column}))"
+    return f"{column} = {column} + VALUES({column})"
+
+
+# Additiv upsert: bruges når alle rækker i batchen var nye
+_ADD_HOURLY_SQL = f"""
+    INSERT INTO patient_light_rollups ({_INSERT_COLUMNS})
+    VALUES ({_PLACEHOLDERS})
+    ON DUPLICATE KEY UPDATE {", ".join(_merge_clause(c) for c in ROLLUP_COLUMNS)}
+"""
+
+_REPLACE_CLAUSE = ", ".join(f"{c} = VALUES({c})" for c in ROLLUP_COLUMNS)
+
+_RAW_AGGREGATES = ",\n".join([
+    "COUNT(*)",
+    f"SUM(CASE WHEN illuminance >= {HIGH_LIGHT_LUX} THEN 1 ELSE 0 END)",
+    f"SUM(CASE WHEN illuminance <  {HIGH_LIGHT_LUX} THEN 1 ELSE 0 END)",
+    "SUM(CASE WHEN action_required THEN 1 ELSE 0 END)",
+    *[
+        f"COUNT({col}), COALESCE(SUM({col}), 0), MIN({col}), MAX({col})"
+        for _, col in _METRICS
+    ],
+])
+
+# Genberegning af én time fra rå data: bruges ved dubletter, sene data og genberegning
+_RECOMPUTE_HOUR_SQL = f"""
+    INSERT INTO patient_light_rollups ({_INSERT_COLUMNS})
+    SELECT %s, 'hour', %s,
+           {_RAW_AGGREGATES}
+    FROM patient_light_sensor_data
+    WHERE patient_id = %s
+      AND captured_at >= %s
+      AND captured_at <  %s
+    HAVING COUNT(*) > 0
+    ON DUPLICATE KEY UPDATE {_REPLACE_CLAUSE}
+"""
+
+_HOUR_AGGREGATES = ",\n".join([
+    "SUM(total_measurements)",
+    "SUM(count_high_light)",
+    "SUM(count_low_light)",
+    "SUM(action_required_count)",
+    *[
+        f"SUM({p}_count), SUM({p}_sum), MIN({p}_min), MAX({p}_max)"
+        for p, _ in _METRICS
+    ],
+])
+
+# Dagsrækken bygges af dagens (højst 24) timerækker
+_REFRESH_DAY_SQL = f"""
+    INSERT INTO patient_light_rollups ({_INSERT_COLUMNS})
+    SELECT %s, 'day', %s,
+           {_HOUR_AGGREGATES}
+    FROM patient_light_rollups
+    WHERE patient_id   = %s
+      AND bucket       = 'hour'
+      AND bucket_start >= %s
+      AND bucket_start <  %s
+    HAVING COUNT(*) > 0
+    ON DUPLICATE KEY UPDATE {_REPLACE_CLAUSE}
+"""
+
+
+def hour_start(dt):
+    return dt.replace(minute=0, second=0, microsecond=0)
+
+
+def _hourly_deltas(rows, columns):
+    """Aggregerer række‐tupler (i `columns`‐rækkefølge) pr. (patient_id, time) i Python."""
+    col = {name: i for i, name in enumerate(columns)}
+    buckets = {}
+    for row in rows:
+        key = (row[col["patient_id"]], hour_start(row[col["captured_at"]]))
+        agg = buckets.get(key)
+        if agg is None:
+            agg = buckets[key] = dict.fromkeys(ROLLUP_COLUMNS[:4], 0)
+            for prefix, _ in _METRICS:
+                agg.update({f"{prefix}_count": 0, f"{prefix}_sum": 0.0,
+                            f"{prefix}_min": None, f"{prefix}_max": None})
+
+        agg["total_measurements"] += 1
+        illuminance = row[col["illuminance"]]
+        if illuminance is not None:
+            agg["count_high_light" if float(illuminance) >= HIGH_LIGHT_LUX else "count_low_light"] += 1
+        if row[col["action_required"]]:
+            agg["action_required_count"] += 1
+        for prefix, column in _METRICS:
+            value = row[col[column]]
+            if value is None:
+                continue
+            value = float(value)
+            agg[f"{prefix}_count"] += 1
+            agg[f"{prefix}_sum"] += value
+            lo, hi = agg[f"{prefix}_min"], agg[f"{prefix}_max"]
+            agg[f"{prefix}_min"] = value if lo is None else min(lo, value)
+            agg[f"{prefix}_max"] = value if hi is None else max(hi, value)
+    return buckets
+
+
+def refresh_rollups(cursor, hours):
+    """
+    Genberegner de angivne (patient_id, time)‐buckets fra rå data og derefter de berørte dage.
+    """
+    hours = sorted(set(hours))
+    cursor.executemany(_RECOMPUTE_HOUR_SQL, [
+        (patient_id, start, patient_id, start, start + timedelta(hours=1))
+        for patient_id, start in hours
+    ])
+    _refresh_days(cursor, hours)
+
+
+def update_rollups(cursor, rows, columns, new_count):
+    """
+    Opdaterer rollups for netop indsatte rækker (i `columns`‐rækkefølge) i kalderens transaktion.
+    `new_count` er antal rækker, databasen faktisk indsatte:
+      - 0: alt var dubletter, intet at gøre
+      - alle: deltaerne lægges direkte til (ingen læsning af rå data)
+      - ellers genberegnes de berørte timer fra rå data, så dubletter ikke tælles dobbelt.
+    """
+    if not rows or new_count == 0:
+        return
+    deltas = _hourly_deltas(rows, columns)
+    if new_count != len(rows):
+        refresh_rollups(cursor, deltas.keys())
+        return
+
+    cursor.executemany(_ADD_HOURLY_SQL, [
+        (patient_id, "hour", start, *(agg[c] for c in ROLLUP_COLUMNS))
+        for (patient_id, start), agg in deltas.items()
+    ])
+    _refresh_days(cursor, deltas.keys())
+
+
+def _refresh_days(cursor, hours):
+    days = sorted({(patient_id, start.replace(hour=0)) for patient_id, start in hours})
+    cursor.executemany(_REFRESH_DAY_SQL, [
+        (patient_id, day, patient_id, day, day + timedelta(days=1))
+        for patient_id, day in days
+    ])
+
+
+def fetch_daily_rollups(cursor, patient_id, start_dt, end_dt):
+    """
+    Returnerer dagsrækker for patienten i [start_dt, end_dt) som {date: dict}.
+    Forventer en dictionary‐cursor.
+    """
+    cursor.execute(f"""
+        SELECT bucket_start, {", ".join(ROLLUP_COLUMNS)}
+        FROM patient_light_rollups
+        WHERE patient_id   = %s
+          AND bucket       = 'day'
+          AND bucket_start >= %s
+          AND bucket_start <  %s
+        ORDER BY bucket_start ASC
+    """, (patient_id, start_dt, end_dt))
+    return {row["bucket_start"].date(): row for row in cursor.fetchall()}
+
+
+def fetch_cohort_rollups(cursor, clinician_id, start_dt, end_dt):
+    """
+    Opsummering af [start_dt, end_dt) for alle klinikerens patienter i én grupperet
+    forespørgsel over patient_light_rollups. Grænserne rundes ud til hele timer;
+    ligger begge på midnat, læses dagsrækkerne i stedet for timerækkerne.
+    Patienter uden målinger i intervallet kommer med med 0'er.
+    Forventer en dictionary‐cursor.
+    """
+    start_dt = hour_start(start_dt)
+    if hour_start(end_dt) != end_dt:
+        end_dt = hour_start(end_dt) + timedelta(hours=1)
+    bucket = "day" if start_dt.hour == 0 and end_dt.hour == 0 else "hour"
+
+    # CAST på klinikersiden, så sammenligningen bruger primærnøglen på patient_light_rollups
+    cursor.execute("""
+        SELECT cp.patient_id, p.first_name, p.last_name,
+               COALESCE(SUM(r.total_measurements), 0)    AS total_measurements,
+               COALESCE(SUM(r.count_high_light), 0)      AS count_high_light,
+               COALESCE(SUM(r.count_low_light), 0)       AS count_low_light,
+               COALESCE(SUM(r.action_required_count), 0) AS action_required_count,
+               SUM(r.edi_sum)   / NULLIF(SUM(r.edi_count), 0)   AS mean_melanopic_edi,
+               MAX(r.edi_max)                                   AS max_melanopic_edi,
+               SUM(r.lux_sum)   / NULLIF(SUM(r.lux_count), 0)   AS mean_illuminance,
+               SUM(r.score_sum) / NULLIF(SUM(r.score_count), 0) AS mean_exposure_score,
+               MAX(r.bucket_start)                              AS last_bucket
+        FROM clinician_patients AS cp
+        JOIN patients AS p
+          ON p.id = cp.patient_id
+        LEFT JOIN patient_light_rollups AS r
+          ON r.patient_id    = CAST(cp.patient_id AS CHAR)
+         AND r.bucket        = %s
+         AND r.bucket_start >= %s
+         AND r.bucket_start <  %s
+        WHERE cp.clinician_id = %s
+        GROUP BY cp.patient_id, p.first_name, p.last_name
+        ORDER BY p.last_name, p.first_name
+    """, (bucket, start_dt, end_dt, clinician_id))
+    return start_dt, end_dt, cursor.fetchall()
@@ -0,0 +1,106 @@
+# light_validators.py
+#
+# Billige validatorer (ETag / Last-Modified) for en patients lysdata i et
+# interval, så dashboards der poller daily/weekly/monthly kan få 304 uden at
+# forespørgslen mod patient_light_sensor_data køres igen.
+#
+# Validatoren er MAX(updated_at) og SUM(total_measurements) over patientens
+# timerækker i patient_light_rollups (se sql/007_light_rollup_updated_at.sql) –
+# et opslag på primærnøglen i en lille tabel. Rollups ændres i samme transaktion
+# som de rå data, så validatoren kan aldrig være nyere end dataene.
+#
+# Resultatet huskes i hukommelsen i `ttl` sekunder. Indsættelser i denne proces
+# kalder touch() efter commit og rydder patientens validatorer med det samme;
+# indsættelser i andre processer ses senest efter `ttl` sekunder.
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from mysql_db import get_db_connection
+
+_VALIDATOR_SQL = """
+    SELECT COALESCE(SUM(total_measurements), 0),
+           UNIX_TIMESTAMP(MAX(updated_at))
+    FROM patient_light_rollups
+    WHERE patient_id   = %s
+      AND bucket       = 'hour'
+      AND bucket_start >= %s
+      AND bucket_start <  %s
+"""
+
+
+class LightDataValidators:
+
+    def __init__(self, ttl=2.0, max_patients=10000):
+        self.ttl = ttl
+        self.max_patients = max_patients
+        self._entries = OrderedDict()   # patient_id → {(start, end): (udløb, tælling, ændret)}
+        self._generation = {}           # patient_id → antal touch() (mod kapløb med opslag)
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0}
+
+    def validator(self, kind, patient_id, start_dt, end_dt):
+        """
+        Returnerer (etag, last_modified) for patientens data i [start_dt, end_dt)
+        (naive UTC, hele timer). `kind` skelner mellem endpoints med forskellige svar.
+        last_modified er en UTC‐datetime eller None, hvis intervallet ingen data har.
+        """
+        key = (start_dt, end_dt)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(patient_id, {}).get(key)
+            if entry is not None and entry[0] > now:
+                self._stats["hits"] += 1
+                count, modified = entry[1], entry[2]
+            else:
+                entry = None
+                self._stats["misses"] += 1
+            generation = self._generation.get(patient_id, 0)
+
+        if entry is None:
+            count, modified = self._load(patient_id, start_dt, end_dt)
+            with self._lock:
+                # Kom en indsættelse imellem, gemmes det (måske forældede) resultat ikke
+                if self._generation.get(patient_id, 0) == generation:
+                    self._entries.setdefault(patient_id, {})[key] = (now + self.ttl, count, modified)
+                    self._entries.move_to_end(patient_id)
+                    while len(self._entries) > self.max_patients:
+                        self._entries.popitem(last=False)
+
+        raw = f"{kind}|{patient_id}|{start_dt.isoformat()}|{end_dt.isoformat()}|{count}|{modified}"
+        etag = hashlib.sha1(raw.encode("utf-8")).hexdigest()[:20]
+        last_modified = (
+            datetime.fromtimestamp(int(modified), tz=timezone.utc) if modified is not None else None
+        )
+        return etag, last_modified
+
+    def touch(self, patient_ids):
+        """Kaldes af ingest efter commit: patientens gemte validatorer er forældede."""
+        with self._lock:
+            for patient_id in set(patient_ids):
+                self._entries.pop(patient_id, None)
+                self._generation[patient_id] = self._generation.get(patient_id, 0) + 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, patients=len(self._entries))
+
+    def _load(self, patient_id, start_dt, end_dt):
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute(_VALIDATOR_SQL, (patient_id, start_dt, end_dt))
+            count, modified = cursor.fetchone()
+            return int(count), modified
+        finally:
+            cursor.close()
+            conn.close()
+
+
+light_validators = LightDataValidators(
+    ttl=float(os.environ.get("LIGHT_VALIDATOR_TTL_S", 2.0)),
+)
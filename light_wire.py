@@ -0,0 +1,155 @@
+# light_wire.py
+
+import math
+import os
+import struct
+from datetime import datetime, timedelta
+
+# Kompakt binært format for mange lysdatapunkter fra samme patient/sensor.
+# Alle tal er little‐endian.
+#
+#   Header:
+#     magic            4s   b"OLS1"
+#     patient_id_len   B    efterfulgt af patient_id (UTF‐8)
+#     sensor_id        i    -1 = ingen sensor
+#     base_ts_ms       q    millisekunder siden epoch (UTC) for første datapunkt
+#     light_type_count B    efterfulgt af light_type‐tabellen: (B længde + UTF‐8) pr. type
+#     sample_count     I
+#
+#   Record (fast længde, sample_count stk.):
+#     delta_ms         I    millisekunder siden forrige datapunkt (første er ift. base_ts_ms)
+#     lux_level        f
+#     melanopic_edi    f
+#     der              f
+#     illuminance      f
+#     exposure_score   f
+#     light_type       B    indeks i light_type‐tabellen (255 = ingen)
+#     action_required  B
+#
+# Manglende float‐værdier sendes som NaN og gemmes som NULL.
+
+CONTENT_TYPE = "application/x-ocutune-light"
+MAGIC = b"OLS1"
+# Loft over én frames størrelse – kroppen læses helt ind, før den afkodes
+MAX_FRAME_BYTES = int(os.environ.get("LIGHT_MAX_FRAME_KB", 4096)) * 1024
+
+_RECORD = struct.Struct("<I5fBB")
+_EPOCH = datetime(1970, 1, 1)
+
+
+class WireFormatError(ValueError):
+    pass
+
+
+class FrameTooLarge(WireFormatError):
+    pass
+
+
+def _nullable(value):
+    return None if math.isnan(value) else value
+
+
+def decode_light_frame(buf):
+    """
+    Afkoder en binær frame direkte til række‐tupler i LIGHT_COLUMNS‐rækkefølge
+    uden mellemliggende dicts. Kaster WireFormatError ved ugyldig frame.
+    """
+    view = memoryview(buf)
+    try:
+        if bytes(view[:4]) != MAGIC:
+            raise WireFormatError("Ukendt frame‐format")
+        pos = 4
+        (pid_len,) = struct.unpack_from("<B", view, pos)
+        pos += 1
+        patient_id = bytes(view[pos:pos + pid_len]).decode("utf-8")
+        pos += pid_len
+        sensor_id, base_ts_ms, type_count = struct.unpack_from("<iqB", view, pos)
+        pos += 13
+        light_types = []
+        for _ in range(type_count):
+            (length,) = struct.unpack_from("<B", view, pos)
+            pos += 1
+            light_types.append(bytes(view[pos:pos + length]).decode("utf-8"))
+            pos += length
+        (count,) = struct.unpack_from("<I", view, pos)
+        pos += 4
+    except (struct.error, UnicodeDecodeError) as e:
+        raise WireFormatError(f"Ugyldig header: {e}")
+
+    end = pos + count * _RECORD.size
+    if len(view) != end:
+        raise WireFormatError(
+            f"Forventede {count} datapunkter ({end} bytes), fik {len(view)} bytes"
+        )
+    if not patient_id:
+        raise WireFormatError("patient_id mangler")
+
+    sensor_id = None if sensor_id < 0 else sensor_id
+    ts_ms = base_ts_ms
+    rows = []
+    for delta, lux, edi, der, illum, score, type_idx, action in _RECORD.iter_unpack(view[pos:end]):
+        ts_ms += delta
+        if type_idx == 255:
+            light_type = None
+        elif type_idx < len(light_types):
+            light_type = light_types[type_idx]
+        else:
+            raise WireFormatError(f"Ukendt light_type‐indeks {type_idx}")
+        rows.append((
+            patient_id,
+            sensor_id,
+            _nullable(lux),
+            _EPOCH + timedelta(milliseconds=ts_ms),
+            _nullable(edi),
+            _nullable(der),
+            _nullable(illum),
+            light_type,
+            _nullable(score),
+            action,
+            None,
+            None,
+        ))
+    return rows
+
+
+def encode_light_frame(patient_id, sensor_id, samples):
+    """
+    Modstykket til decode_light_frame – bruges af værktøjer og tests.
+    `samples` er en liste af dicts med samme felter som /patient-light-data, hvor
+    "timestamp" er en datetime (naiv UTC).
+    """
+    samples = sorted(samples, key=lambda s: s["timestamp"])
+    light_types = sorted({s["light_type"] for s in samples if s.get("light_type") is not None})
+    type_index = {t: i for i, t in enumerate(light_types)}
+
+    def ms(dt):
+        return (dt - _EPOCH) // timedelta(milliseconds=1)
+
+    def f(value):
+        return math.nan if value is None else value
+
+    pid = patient_id.encode("utf-8")
+    out = bytearray(MAGIC)
+    base = ms(samples[0]["timestamp"]) if samples else 0
+    out += struct.pack("<B", len(pid)) + pid
+    out += struct.pack("<iqB", -1 if sensor_id is None else sensor_id, base, len(light_types))
+    for t in light_types:
+        encoded = t.encode("utf-8")
+        out += struct.pack("<B", len(encoded)) + encoded
+    out += struct.pack("<I", len(samples))
+
+    prev = base
+    for s in samples:
+        ts = ms(s["timestamp"])
+        out += _RECORD.pack(
+            ts - prev,
+            f(s.get("lux_level")),
+            f(s.get("melanopic_edi")),
+            f(s.get("der")),
+            f(s.get("illuminance")),
+            f(s.get("exposure_score")),
+            type_index.get(s.get("light_type"), 255),
+            int(s.get("action_required") or 0),
+        )
+        prev = ts
+    return bytes(out)
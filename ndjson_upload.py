@@ -0,0 +1,144 @@
+# ndjson_upload.py
+
+import json
+import os
+import zlib
+
+from mysql_db import get_db_connection
+
+READ_SIZE = 64 * 1024
+MAX_LINE_BYTES = 64 * 1024
+# Loft over en uploads samlede (dekomprimerede) størrelse – beskytter mod gzip‐bomber
+MAX_UPLOAD_BYTES = int(os.environ.get("NDJSON_MAX_UPLOAD_MB", 512)) * 1024 * 1024
+
+
+class UploadTooLarge(ValueError):
+    pass
+
+
+class MalformedUpload(ValueError):
+    pass
+
+
+def _decompressed(stream, gzipped, read_size):
+    """
+    Yielder kroppen i bidder på højst `read_size` bytes. Gzip dekomprimeres med
+    max_length, så ét lille komprimeret stykke aldrig bliver til en stor buffer.
+    En gzip‐krop med flere members (fx sammenkædede .gz‐filer) dekomprimeres member
+    for member; bytes efter en member, der ikke er gyldig gzip, giver MalformedUpload.
+    """
+    decompressor = zlib.decompressobj(wbits=31) if gzipped else None
+    while True:
+        chunk = stream.read(read_size)
+        if not chunk:
+            break
+        if decompressor is None:
+            yield chunk
+            continue
+        while chunk:
+            if decompressor.eof:
+                # Forrige member er slut – resten er starten på den næste
+                decompressor = zlib.decompressobj(wbits=31)
+            try:
+                out = decompressor.decompress(chunk, read_size)
+            except zlib.error as e:
+                raise MalformedUpload(f"Ugyldig gzip‐krop: {e}")
+            if out:
+                yield out
+            chunk = decompressor.unconsumed_tail or decompressor.unused_data
+    if decompressor is not None:
+        tail = decompressor.flush()
+        if tail:
+            yield tail
+
+
+def iter_ndjson_lines(stream, gzipped=False, read_size=READ_SIZE, max_bytes=MAX_UPLOAD_BYTES):
+    """
+    Læser en newline‐delimited JSON‐krop stykvis fra `stream` og yielder én linje (bytes) ad gangen.
+    Er kroppen gzip‐komprimeret, dekomprimeres den løbende – hele kroppen ligger aldrig i hukommelsen.
+    Tomme linjer yieldes også, så linjenumre svarer til klientens egen fil.
+    Kaster UploadTooLarge, hvis kroppen (dekomprimeret) overstiger `max_bytes`.
+    """
+    pending = b""
+    total = 0
+
+    for chunk in _decompressed(stream, gzipped, read_size):
+        total += len(chunk)
+        if total > max_bytes:
+            raise UploadTooLarge(f"Uploaden overstiger {max_bytes} bytes")
+        pending += chunk
+        lines = pending.split(b"\n")
+        pending = lines.pop()
+        if len(pending) > MAX_LINE_BYTES:
+            raise ValueError("NDJSON‐linje er for lang")
+        for line in lines:
+            yield line
+
+    if pending:
+        yield pending
+
+
+class UploadProgress:
+    """
+    Seneste committede linje‐offset pr. upload_id i light_upload_progress
+    (se sql/010_light_upload_progress.sql), så en afbrudt upload kan genoptages fra
+    det sted, hvor serveren sidst committede – også mod en anden proces.
+    save() kører på kalderens cursor, så fremdriften committes sammen med rækkerne.
+    Afsluttede uploads ældre end `retention_days` slettes, når en ny afsluttes.
+    """
+
+    def __init__(self, retention_days=7):
+        self.retention_days = retention_days
+
+    def get(self, upload_id):
+        conn = get_db_connection()
+        cursor = conn.cursor(dictionary=True)
+        try:
+            cursor.execute("""
+                SELECT upload_id, committed_offset, accepted, new_rows, duplicates,
+                       rejected, rejected_lines, complete
+                FROM light_upload_progress
+                WHERE upload_id = %s
+            """, (upload_id,))
+            row = cursor.fetchone()
+        finally:
+            cursor.close()
+            conn.close()
+        if row is None:
+            return None
+        row["new"] = row.pop("new_rows")
+        row["rejected_lines"] = json.loads(row["rejected_lines"])
+        row["complete"] = bool(row["complete"])
+        return row
+
+    def save(self, cursor, progress):
+        cursor.execute("""
+            INSERT INTO light_upload_progress (
+                upload_id, committed_offset, accepted, new_rows, duplicates,
+                rejected, rejected_lines, complete
+            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE
+                committed_offset = VALUES(committed_offset),
+                accepted         = VALUES(accepted),
+                new_rows         = VALUES(new_rows),
+                duplicates       = VALUES(duplicates),
+                rejected         = VALUES(rejected),
+                rejected_lines   = VALUES(rejected_lines),
+                complete         = VALUES(complete)
+        """, (
+            progress["upload_id"], progress["committed_offset"], progress["accepted"],
+            progress["new"], progress["duplicates"], progress["rejected"],
+            json.dumps(progress["rejected_lines"]), int(progress["complete"]),
+        ))
+        if progress["complete"]:
+            cursor.execute("""
+                DELETE FROM light_upload_progress
+                WHERE complete = 1
+                  AND updated_at < NOW() - INTERVAL %s DAY
+                LIMIT 1000
+            """, (self.retention_days,))
+
+
+upload_progress = UploadProgress(
+    retention_days=int(os.environ.get("NDJSON_PROGRESS_RETENTION_DAYS", 7)),
+)
@@ -2,16 +2,40 @@
 
 import re
 import traceback
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, Response, request, jsonify, current_app, send_file
 from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
+from werkzeug.http import is_resource_modified
 from mysql_db import get_db_connection
 from models.light_data import LightData
+from mysql.connector import errors as mysql_errors
+from light_rollups import fetch_daily_rollups
+from light_aggregation import aggregate_light_data, AggregationError
+from light_pages import open_light_stream, decode_page_token, parse_page_size, PageTokenError
+from light_formats import (
+    FORMATS, FIELDS, ARROW_CONTENT_TYPE, PARQUET_CONTENT_TYPE, FormatUnavailable,
+    read_columnar, open_arrow_stream, read_parquet,
+)
+from light_validators import light_validators
+from light_period_cache import period_cache
+from light_metrics import LOCAL_TZ
+from circadian_metrics import (
+    circadian_metrics, circadian_memo, DEFAULT_LUX_THRESHOLD, DEFAULT_EDI_THRESHOLD,
+)
+from sensor_liveness import sensor_status, sensor_gaps
+from light_export import (
+    light_exports, export_job_json, parse_export_params, content_type, ExportError,
+)
+from light_downsample import fetch_downsampled, METHODS, Y_METRICS, MIN_POINTS, MAX_POINTS, SourceTooLarge
 from datetime import datetime, timedelta, timezone
 import pytz
 import json
 
 patient_bp = Blueprint("patient_bp", __name__)
 
+# Eksportpuljen og dens vedligeholdelse (genoptagelse, oprydning) startes, når appen
+# registrerer blueprintet – ikke først ved næste eksportbestilling.
+patient_bp.record_once(lambda state: light_exports.start())
+
 
 def _extract_user_and_role():
     """
@@ -41,6 +65,130 @@ def fetch_all_dict(cursor):
     return [dict(zip(cols, row)) for row in rows]
 
 
+def _paged_response(result, next_token):
+    """JSON‐liste som hidtil; token til næste side lægges i X-Next-Page-Token."""
+    response = jsonify(result)
+    if next_token:
+        response.headers["X-Next-Page-Token"] = next_token
+    return response, 200
+
+
+MAX_METRICS_DAYS = 93
+MAX_GAP_RANGE = timedelta(days=93)
+
+
+def _sensor_status_json(row):
+    return {
+        "sensor_id":        row["sensor_id"],
+        "first_seen_at":    row["first_seen_at"].isoformat(),
+        "last_seen_at":     row["last_seen_at"].isoformat(),
+        "last_received_at": row["last_received_at"].isoformat(),
+        "session_open":     bool(row["session_open"]),
+    }
+
+
+def _is_not_modified(etag, last_modified):
+    """True hvis klientens If-None-Match / If-Modified-Since stadig gælder."""
+    if not request.if_none_match and not request.if_modified_since:
+        return False
+    return not is_resource_modified(request.environ, etag=etag, last_modified=last_modified)
+
+
+def _with_validator(response, etag, last_modified):
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response, 200
+
+
+def _not_modified_response(etag, last_modified):
+    response, _ = _with_validator(Response(status=304), etag, last_modified)
+    return response, 304
+
+
+def _streamed_response(chunks, next_token, mimetype="application/json"):
+    """Som _paged_response, men svaret sendes i bidder fra en generator."""
+    response = Response(chunks, mimetype=mimetype)
+    if next_token:
+        response.headers["X-Next-Page-Token"] = next_token
+    return response, 200
+
+
+def _downsampled_response(patient_id, from_dt, to_dt):
+    """
+    Intervallets målinger nedsamplet med light_downsample. X-Source-Count er antal
+    målinger med værdi for `y` (dem, der blev nedsamplet). 400, hvis intervallet har
+    flere end MAX_SOURCE_ROWS målinger.
+    """
+    try:
+        max_points = int(request.args["max_points"])
+    except ValueError:
+        return jsonify({"error": '"max_points" skal være et heltal'}), 400
+    if not MIN_POINTS <= max_points <= MAX_POINTS:
+        return jsonify({"error": f'"max_points" skal være mellem {MIN_POINTS} og {MAX_POINTS}'}), 400
+    method = request.args.get("downsample", "lttb")
+    if method not in METHODS:
+        return jsonify({"error": f'"downsample" skal være en af {", ".join(METHODS)}'}), 400
+    y_metric = request.args.get("y", "melanopic_edi")
+    if y_metric not in Y_METRICS:
+        return jsonify({"error": f'"y" skal være en af {", ".join(Y_METRICS)}'}), 400
+
+    conn = get_db_connection()
+    try:
+        total, result = fetch_downsampled(conn, patient_id, from_dt, to_dt, max_points, y_metric, method)
+    except SourceTooLarge as e:
+        return jsonify({"error": str(e)}), 400
+    if not result:
+        return jsonify({"error": "Ingen lysdata fundet i det ønskede interval"}), 404
+
+    response = jsonify(result)
+    response.headers["X-Source-Count"] = str(total)
+    return response, 200
+
+
+def _light_page_response(patient_id, from_dt, to_dt, after, limit, not_found):
+    """
+    Én side lysdata i formatet fra ?format=json|columnar|arrow|parquet (standard json).
+    404 hvis første side er tom; en tom senere side giver et tomt svar.
+    """
+    fmt = request.args.get("format", "json")
+    if fmt not in FORMATS:
+        return jsonify({"error": f'"format" skal være en af {", ".join(FORMATS)}'}), 400
+
+    conn = get_db_connection()
+    try:
+        if fmt == "json":
+            next_token, body = open_light_stream(conn, patient_id, from_dt, to_dt, after, limit)
+        elif fmt == "columnar":
+            next_token, body = read_columnar(conn, patient_id, from_dt, to_dt, after, limit)
+        elif fmt == "arrow":
+            next_token, body = open_arrow_stream(conn, patient_id, from_dt, to_dt, after, limit)
+        else:
+            next_token, body = read_parquet(conn, patient_id, from_dt, to_dt, after, limit)
+    except FormatUnavailable as e:
+        conn.close()
+        return jsonify({"error": str(e)}), 501
+
+    if body is None:
+        if after is None:
+            return jsonify({"error": not_found}), 404
+        if fmt in ("json", "columnar"):
+            empty = [] if fmt == "json" else {**{field: [] for field in FIELDS}, "count": 0}
+            return _paged_response(empty, None)
+        return "", 204
+
+    if fmt == "json":
+        return _streamed_response(body, next_token)
+    if fmt == "arrow":
+        return _streamed_response(body, next_token, mimetype=ARROW_CONTENT_TYPE)
+    mimetype = "application/json" if fmt == "columnar" else PARQUET_CONTENT_TYPE
+    response = Response(body, mimetype=mimetype)
+    if next_token:
+        response.headers["X-Next-Page-Token"] = next_token
+    return response, 200
+
+
 @patient_bp.route("/", methods=["GET"])
 @jwt_required()
 def get_patients():
@@ -265,6 +413,11 @@ def get_light_data(patient_id):
     GET /api/patients/<patient_id>/lightdata
     Hvis der medsendes ?from=<ISO8601>&to=<ISO8601>, filtreres data på interval.
     Ellers returnerer vi de seneste 7 dage (UTC).
+    Pagineret med ?limit=<n>&page_token=<token>; næste sides token sendes i
+    headeren X-Next-Page-Token (mangler på sidste side).
+    ?format=columnar|arrow|parquet giver kolonneorienterede svar (se light_formats).
+    ?max_points=<n>[&downsample=lttb|minmax][&y=melanopic_edi] returnerer i stedet
+    hele intervallet nedsamplet til højst n målinger (upagineret, kun JSON).
     (Ingen rolle‐og adgangstjek – enhver gyldig JWT kan hente.)
     """
     try:
@@ -291,42 +444,23 @@ def get_light_data(patient_id):
             to_dt   = nu_utc
             from_dt = nu_utc - timedelta(days=7)
 
-        # 2) Hent data mellem from_dt og to_dt
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute("""
-            SELECT
-              captured_at,
-              melanopic_edi,
-              illuminance,
-              light_type,
-              exposure_score,
-              action_required
-            FROM patient_light_sensor_data
-            WHERE patient_id   = %s
-              AND captured_at >= %s
-              AND captured_at <= %s
-            ORDER BY captured_at ASC
-        """, (patient_id, from_dt, to_dt))
-        rows = cursor.fetchall()
-        conn.close()
-
-        # 3) Hvis ingen data, returnér 404
-        if not rows:
-            return jsonify({"error": "Ingen lysdata fundet i det ønskede interval"}), 404
-
-        # 4) Konverter hver række til JSON‐venlig dict
-        result = []
-        for row in rows:
-            result.append({
-                "captured_at":    row["captured_at"].isoformat(),
-                "melanopic_edi":  float(row["melanopic_edi"]) if row["melanopic_edi"] is not None else None,
-                "illuminance":    float(row["illuminance"])   if row["illuminance"]   is not None else None,
-                "light_type":     row["light_type"],
-                "exposure_score": float(row["exposure_score"]) if row["exposure_score"] is not None else None,
-                "action_required": bool(row["action_required"])  if row["action_required"] is not None else False,
-            })
-        return jsonify(result), 200
+        # Nedsampling til grafer: hele intervallet reduceres til højst max_points målinger
+        if request.args.get("max_points"):
+            return _downsampled_response(patient_id, from_dt, to_dt)
+
+        try:
+            limit = parse_page_size(request.args.get("limit"))
+            page_token = request.args.get("page_token")
+            after = decode_page_token(page_token) if page_token else None
+        except PageTokenError as e:
+            return jsonify({"error": str(e)}), 400
+
+        # 2) Hent én side data mellem from_dt og to_dt i det ønskede format
+        #    (JSON‐rækker sendes i bidder, mens de læses fra databasen)
+        return _light_page_response(
+            patient_id, from_dt, to_dt, after, limit,
+            not_found="Ingen lysdata fundet i det ønskede interval",
+        )
 
     except Exception as e:
         current_app.logger.error(f"get_light_data fejl: {e}", exc_info=True)
@@ -338,41 +472,21 @@ def get_light_data(patient_id):
 def get_all_light_data(patient_id):
     """
     GET /api/patients/<patient_id>/lightdata/all
-    Returnerer samtlige lysmålinger for patienten sorteret stigende på captured_at.
+    Returnerer patientens lysmålinger sorteret stigende på captured_at, én side ad gangen
+    (?limit=<n>&page_token=<token>). Hele historikken gennemløbes ved at følge
+    X-Next-Page-Token, indtil headeren mangler. Samme ?format= som /lightdata.
+    Hele historikken som én fil: brug i stedet POST …/lightdata/exports.
     (Ingen rolle‐og adgangstjek – enhver gyldig JWT kan hente.)
     """
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute("""
-            SELECT
-              captured_at,
-              melanopic_edi,
-              illuminance,
-              light_type,
-              exposure_score,
-              action_required
-            FROM patient_light_sensor_data
-            WHERE patient_id = %s
-            ORDER BY captured_at ASC
-        """, (patient_id,))
-        rows = cursor.fetchall()
-        conn.close()
-
-        if not rows:
-            return jsonify({"error": "Ingen lysdata fundet"}), 404
+        try:
+            limit = parse_page_size(request.args.get("limit"))
+            page_token = request.args.get("page_token")
+            after = decode_page_token(page_token) if page_token else None
+        except PageTokenError as e:
+            return jsonify({"error": str(e)}), 400
 
-        result = []
-        for row in rows:
-            result.append({
-                "captured_at":    row["captured_at"].isoformat(),
-                "melanopic_edi":  float(row["melanopic_edi"]) if row["melanopic_edi"] is not None else None,
-                "illuminance":    float(row["illuminance"])   if row["illuminance"]   is not None else None,
-                "light_type":     row["light_type"],
-                "exposure_score": float(row["exposure_score"]) if row["exposure_score"] is not None else None,
-                "action_required": bool(row["action_required"])  if row["action_required"] is not None else False,
-            })
-        return jsonify(result), 200
+        return _light_page_response(patient_id, None, None, after, limit, not_found="Ingen lysdata fundet")
 
     except Exception as e:
         current_app.logger.error(f"get_all_light_data fejl: {e}", exc_info=True)
@@ -397,6 +511,11 @@ def get_light_data_daily(patient_id):
         start_dt = datetime(start_date.year, start_date.month, start_date.day, 0, 0, 0)
         end_dt = start_dt + timedelta(days=1)
 
+        # Uændret siden klientens sidste hentning? Så svares 304 uden at køre forespørgslen
+        validator = light_validators.validator("daily", patient_id, start_dt, end_dt)
+        if _is_not_modified(*validator):
+            return _not_modified_response(*validator)
+
         conn = get_db_connection()
         cursor = conn.cursor(dictionary=True)
 
@@ -416,10 +535,13 @@ def get_light_data_daily(patient_id):
         """
         cursor.execute(query, (patient_id, start_dt, end_dt))
         rows = cursor.fetchall()
-        conn.close()
 
         if not rows:
-            return jsonify({"error": "Ingen lysdata fundet for i dag"}), 404
+            # Sensorernes seneste livstegn, så klienten kan skelne "tavs sensor" fra "ingen sensor"
+            sensors = [_sensor_status_json(row) for row in sensor_status(cursor, patient_id)]
+            conn.close()
+            return jsonify({"error": "Ingen lysdata fundet for i dag", "sensors": sensors}), 404
+        conn.close()
 
         result = []
         for row in rows:
@@ -431,7 +553,7 @@ def get_light_data_daily(patient_id):
                 "exposure_score":  float(row["exposure_score"]),
                 "action_required": bool(row["action_required"]),
             })
-        return jsonify(result), 200
+        return _with_validator(jsonify(result), *validator)
 
     except mysql_errors.OperationalError as db_err:
         current_app.logger.error(f"Databasefejl i get_light_data_daily: {db_err}", exc_info=True)
@@ -449,6 +571,7 @@ def get_light_data_weekly(patient_id):
     GET /api/patients/<patient_id>/lightdata/weekly
     Returnerer 7 aggregerede datapunkter, ét for hver dag i sidste uge (man–søn),
     hvor hver dags værdier er baseret på ALLE råmålinger for den dag.
+    ?week=<YYYY-MM-DD> vælger ugen, der indeholder datoen (standard: indeværende uge).
     """
     try:
         # 1) Valider patient_id som alfanumerisk
@@ -458,6 +581,11 @@ def get_light_data_weekly(patient_id):
         # 2) Beregn dato‐interval: sidste mandag 00:00 UTC → næste mandag 00:00 UTC
         now_utc = datetime.utcnow()
         today = now_utc.date()
+        if request.args.get("week"):
+            try:
+                today = datetime.strptime(request.args["week"], "%Y-%m-%d").date()
+            except ValueError:
+                return jsonify({"error": '"week" skal være en dato (YYYY-MM-DD)'}), 400
         # Find mandag i indeværende uge:
         current_monday = today - timedelta(days=today.weekday())
 
@@ -472,35 +600,34 @@ def get_light_data_weekly(patient_id):
         )
         end_dt = start_dt + timedelta(days=7)
 
-        # 3) Kør SQL til at aggregere pr. dag:
+        closed = end_dt <= now_utc
+        generation = period_cache.generation(patient_id)
+
+        # Uændret siden klientens sidste hentning? Så svares 304 uden at køre forespørgslen
+        validator = light_validators.validator("weekly", patient_id, start_dt, end_dt)
+        if _is_not_modified(*validator):
+            return _not_modified_response(*validator)
+
+        # Lukkede perioder ændrer sig kun ved sene målinger – svaret genbruges, så længe
+        # periodens ETag (fra rollups' updated_at) er uændret
+        if closed:
+            cached = period_cache.get(patient_id, "weekly", start_dt, validator[0])
+            if cached is not None:
+                return _with_validator(Response(cached, mimetype="application/json"), *validator)
+
+        # 3) Hent ugens (højst 7) dagsrækker fra patient_light_rollups
+        #    i stedet for at aggregere alle rå målinger:
         conn = get_db_connection()
         cursor = conn.cursor(dictionary=True)
-        query = """
-            SELECT
-              DATE(captured_at) AS day_utc,
-              SUM(CASE WHEN illuminance >= 1000 THEN 1 ELSE 0 END) AS count_high_light,
-              SUM(CASE WHEN illuminance  <  1000 THEN 1 ELSE 0 END) AS count_low_light,
-              COUNT(*)                                        AS total_measurements
-            FROM patient_light_sensor_data
-            WHERE patient_id = %s
-              AND captured_at >= %s
-              AND captured_at <  %s
-            GROUP BY day_utc
-            ORDER BY day_utc ASC;
-        """
-        cursor.execute(query, (patient_id, start_dt, end_dt))
-        rows = cursor.fetchall()
+        agg_dict = fetch_daily_rollups(cursor, patient_id, start_dt, end_dt)  # date → række
         cursor.close()
         conn.close()
 
         # 4) Hvis ingen data for hele ugen, returnér 404
-        if not rows:
+        if not agg_dict:
             return jsonify({"error": "Ingen lysdata fundet for denne uge"}), 404
 
-        # 5) Byg en dict day→data for hurtig opslag
-        agg_dict = { row["day_utc"]: row for row in rows }
-
-        # 6) Iterér netop 7 dage (mandag→søndag) og tilsæt “0”‐dage, hvis mangler
+        # 5) Iterér netop 7 dage (mandag→søndag) og tilsæt “0”‐dage, hvis mangler
         result = []
         for i in range(7):
             d = start_dt.date() + timedelta(days=i)  # d er f.eks. 2025-06-02, 2025-06-03, …
@@ -520,7 +647,11 @@ def get_light_data_weekly(patient_id):
                     "total_measurements":  0
                 })
 
-        return jsonify(result), 200
+        response = jsonify(result)
+        if closed:
+            period_cache.put(patient_id, "weekly", start_dt, end_dt, validator[0],
+                             response.get_data(), generation)
+        return _with_validator(response, *validator)
 
     except mysql_errors.OperationalError as db_err:
         current_app.logger.error(f"Databasefejl i get_light_data_weekly: {db_err}", exc_info=True)
@@ -538,6 +669,7 @@ def get_light_data_monthly(patient_id):
     """
     GET /api/patients/<patient_id>/lightdata/monthly
     Returnerer én opsummering pr. dag for alle dage i denne måned (samme format som weekly).
+    ?month=<YYYY-MM> vælger en anden måned.
     """
     try:
         if not re.fullmatch(r"[A-Za-z0-9_-]+", patient_id):
@@ -546,6 +678,12 @@ def get_light_data_monthly(patient_id):
         now_utc = datetime.utcnow()
         year = now_utc.year
         month = now_utc.month
+        if request.args.get("month"):
+            try:
+                chosen = datetime.strptime(request.args["month"], "%Y-%m")
+            except ValueError:
+                return jsonify({"error": '"month" skal have formatet YYYY-MM'}), 400
+            year, month = chosen.year, chosen.month
 
         # Start/slut for denne måned
         start_dt = datetime(year, month, 1, 0, 0, 0)
@@ -561,29 +699,31 @@ def get_light_data_monthly(patient_id):
         # Antal dage i denne måned
         days_in_month = (end_dt - start_dt).days
 
+        closed = end_dt <= now_utc
+        generation = period_cache.generation(patient_id)
+
+        # Uændret siden klientens sidste hentning? Så svares 304 uden at køre forespørgslen
+        validator = light_validators.validator("monthly", patient_id, start_dt, end_dt)
+        if _is_not_modified(*validator):
+            return _not_modified_response(*validator)
+
+        # Lukkede perioder ændrer sig kun ved sene målinger – svaret genbruges, så længe
+        # periodens ETag (fra rollups' updated_at) er uændret
+        if closed:
+            cached = period_cache.get(patient_id, "monthly", start_dt, validator[0])
+            if cached is not None:
+                return _with_validator(Response(cached, mimetype="application/json"), *validator)
+
+        # Dagsrækker fra patient_light_rollups (én pr. dag med målinger)
         conn = get_db_connection()
         cursor = conn.cursor(dictionary=True)
-        query = """
-            SELECT
-                DATE(captured_at) AS day_utc,
-                SUM(CASE WHEN illuminance >= 1000 THEN 1 ELSE 0 END) AS count_high_light,
-                SUM(CASE WHEN illuminance  <  1000 THEN 1 ELSE 0 END) AS count_low_light,
-                COUNT(*) AS total_measurements
-            FROM patient_light_sensor_data
-            WHERE patient_id = %s
-              AND captured_at >= %s
-              AND captured_at <  %s
-            GROUP BY day_utc
-            ORDER BY day_utc ASC;
-        """
-        cursor.execute(query, (patient_id, start_dt, end_dt))
-        rows = cursor.fetchall()
+        agg_dict = {
+            d.isoformat(): row                                  # brug altid str()
+            for d, row in fetch_daily_rollups(cursor, patient_id, start_dt, end_dt).items()
+        }
         cursor.close()
         conn.close()
 
-        # Byg dict for hurtig opslag
-        agg_dict = { str(row["day_utc"]): row for row in rows }  # brug altid str()
-
         # Returnér alle dage, også dem uden målinger (giver 0’er)
         result = []
         for i in range(days_in_month):
@@ -605,10 +745,11 @@ def get_light_data_monthly(patient_id):
                     "total_measurements": 0
                 })
 
-        # Debug: se første 3 rækker (kan slettes i produktion)
-        print("MONTHLY RESULT SAMPLE:", result[:3])
-
-        return jsonify(result), 200
+        response = jsonify(result)
+        if closed:
+            period_cache.put(patient_id, "monthly", start_dt, end_dt, validator[0],
+                             response.get_data(), generation)
+        return _with_validator(response, *validator)
 
     except mysql_errors.OperationalError as db_err:
         current_app.logger.error(f"Databasefejl i get_light_data_monthly: {db_err}", exc_info=True)
@@ -617,3 +758,301 @@ def get_light_data_monthly(patient_id):
     except Exception as e:
         current_app.logger.error(f"get_light_data_monthly fejl: {e}", exc_info=True)
         return jsonify({"error": "Serverfejl ved hentning af månedlige lysdata"}), 500
+
+
+@patient_bp.route("/<patient_id>/lightdata/aggregate", methods=["GET"])
+@jwt_required()
+def get_light_data_aggregate(patient_id):
+    """
+    GET /api/patients/<patient_id>/lightdata/aggregate
+        ?from=<ISO8601>&to=<ISO8601>&bucket=5m|15m|1h|1d|1w
+        &metrics=melanopic_edi,illuminance&thresholds=illuminance:1000,melanopic_edi:250
+    Generisk aggregering i buckets. Døgn og uger følger lokal tid (Europe/Copenhagen);
+    lange intervaller med bucket >= 1h besvares fra patient_light_rollups.
+    """
+    try:
+        if not re.fullmatch(r"[A-Za-z0-9_-]+", patient_id):
+            return jsonify({"error": "Ugyldigt patient_id"}), 400
+
+        from_param = request.args.get("from")
+        to_param   = request.args.get("to")
+        if not from_param or not to_param:
+            return jsonify({"error": 'Parametrene "from" og "to" er påkrævet'}), 400
+        try:
+            # Tidspunkter med offset omregnes til naiv UTC; uden offset antages UTC
+            from_dt = datetime.fromisoformat(from_param.replace("Z", "+00:00"))
+            to_dt   = datetime.fromisoformat(to_param.replace("Z", "+00:00"))
+        except ValueError:
+            return jsonify({"error": 'Parametrene "from" og "to" skal være i ISO8601-format'}), 400
+        if from_dt.tzinfo is not None:
+            from_dt = from_dt.astimezone(timezone.utc).replace(tzinfo=None)
+        if to_dt.tzinfo is not None:
+            to_dt = to_dt.astimezone(timezone.utc).replace(tzinfo=None)
+
+        bucket = request.args.get("bucket", "1h")
+        metrics = [m for m in request.args.get("metrics", "melanopic_edi,illuminance").split(",") if m]
+        thresholds = [t for t in request.args.get("thresholds", "").split(",") if t]
+
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            result = aggregate_light_data(cursor, patient_id, from_dt, to_dt, bucket, metrics, thresholds)
+        finally:
+            cursor.close()
+            conn.close()
+
+        return jsonify(result), 200
+
+    except AggregationError as e:
+        return jsonify({"error": str(e)}), 400
+
+    except mysql_errors.OperationalError as db_err:
+        current_app.logger.error(f"Databasefejl i get_light_data_aggregate: {db_err}", exc_info=True)
+        return jsonify({"error": "Databaseforbindelse fejlede"}), 500
+
+    except Exception as e:
+        current_app.logger.error(f"get_light_data_aggregate fejl: {e}", exc_info=True)
+        return jsonify({"error": "Serverfejl ved aggregering af lysdata"}), 500
+
+
+@patient_bp.route("/<patient_id>/lightdata/metrics", methods=["GET"])
+@jwt_required()
+def get_light_metrics(patient_id):
+    """
+    GET /api/patients/<patient_id>/lightdata/metrics
+        ?from=<YYYY-MM-DD>&to=<YYYY-MM-DD>&lux_threshold=1000&edi_threshold=250
+    Døgnrytmemål for de lokale døgn from..to (begge inklusive, standard: de seneste
+    7 hele døgn): tid over tærskel, mean light timing, IS/IV og melanopisk dosis.
+    Se circadian_metrics.py.
+    """
+    try:
+        if not re.fullmatch(r"[A-Za-z0-9_-]+", patient_id):
+            return jsonify({"error": "Ugyldigt patient_id"}), 400
+
+        try:
+            if request.args.get("from") and request.args.get("to"):
+                first_day = datetime.strptime(request.args["from"], "%Y-%m-%d").date()
+                last_day  = datetime.strptime(request.args["to"], "%Y-%m-%d").date()
+            else:
+                last_day  = datetime.now(LOCAL_TZ).date() - timedelta(days=1)
+                first_day = last_day - timedelta(days=6)
+            lux_threshold = float(request.args.get("lux_threshold", DEFAULT_LUX_THRESHOLD))
+            edi_threshold = float(request.args.get("edi_threshold", DEFAULT_EDI_THRESHOLD))
+        except ValueError:
+            return jsonify({"error": '"from"/"to" skal være datoer (YYYY-MM-DD) og tærskler tal'}), 400
+        if last_day < first_day:
+            return jsonify({"error": '"to" må ikke ligge før "from"'}), 400
+        if (last_day - first_day).days >= MAX_METRICS_DAYS:
+            return jsonify({"error": f"Perioden må højst være {MAX_METRICS_DAYS} døgn"}), 400
+
+        result = circadian_metrics(patient_id, first_day, last_day, lux_threshold, edi_threshold)
+        if not result["samples"]:
+            return jsonify({"error": "Ingen lysdata fundet i perioden"}), 404
+        return jsonify(result), 200
+
+    except mysql_errors.OperationalError as db_err:
+        current_app.logger.error(f"Databasefejl i get_light_metrics: {db_err}", exc_info=True)
+        return jsonify({"error": "Databaseforbindelse fejlede"}), 500
+
+    except Exception as e:
+        current_app.logger.error(f"get_light_metrics fejl: {e}", exc_info=True)
+        return jsonify({"error": "Serverfejl ved beregning af lysmål"}), 500
+
+
+@patient_bp.route("/<patient_id>/sensors/status", methods=["GET"])
+@jwt_required()
+def get_sensor_status(patient_id):
+    """
+    GET /api/patients/<patient_id>/sensors/status
+    Seneste livstegn pr. sensor (se sensor_liveness.py) – opslag på primærnøglen.
+    """
+    try:
+        if not re.fullmatch(r"[A-Za-z0-9_-]+", patient_id):
+            return jsonify({"error": "Ugyldigt patient_id"}), 400
+
+        conn = get_db_connection()
+        cursor = conn.cursor(dictionary=True)
+        rows = sensor_status(cursor, patient_id)
+        conn.close()
+        return jsonify([_sensor_status_json(row) for row in rows]), 200
+
+    except mysql_errors.OperationalError as db_err:
+        current_app.logger.error(f"Databasefejl i get_sensor_status: {db_err}", exc_info=True)
+        return jsonify({"error": "Databaseforbindelse fejlede"}), 500
+
+    except Exception as e:
+        current_app.logger.error(f"get_sensor_status fejl: {e}", exc_info=True)
+        return jsonify({"error": "Serverfejl ved hentning af sensorstatus"}), 500
+
+
+@patient_bp.route("/<patient_id>/sensors/gaps", methods=["GET"])
+@jwt_required()
+def get_sensor_gaps(patient_id):
+    """
+    GET /api/patients/<patient_id>/sensors/gaps?from=<ISO8601>&to=<ISO8601>
+    Huller i patientens sensordata, registreret løbende ved indsættelse
+    (standard: de seneste 7 døgn, UTC).
+    """
+    try:
+        if not re.fullmatch(r"[A-Za-z0-9_-]+", patient_id):
+            return jsonify({"error": "Ugyldigt patient_id"}), 400
+
+        from_param = request.args.get("from")
+        to_param   = request.args.get("to")
+        if from_param and to_param:
+            try:
+                from_dt = datetime.fromisoformat(from_param.replace("Z", "+00:00"))
+                to_dt   = datetime.fromisoformat(to_param.replace("Z", "+00:00"))
+            except ValueError:
+                return jsonify({"error": 'Parametrene "from" og "to" skal være i ISO8601-format'}), 400
+            if from_dt.tzinfo is not None:
+                from_dt = from_dt.astimezone(timezone.utc).replace(tzinfo=None)
+            if to_dt.tzinfo is not None:
+                to_dt = to_dt.astimezone(timezone.utc).replace(tzinfo=None)
+            if to_dt <= from_dt:
+                return jsonify({"error": '"to" skal ligge efter "from"'}), 400
+            if to_dt - from_dt > MAX_GAP_RANGE:
+                return jsonify({"error": f"Perioden må højst være {MAX_GAP_RANGE.days} døgn"}), 400
+        else:
+            to_dt   = datetime.utcnow()
+            from_dt = to_dt - timedelta(days=7)
+
+        conn = get_db_connection()
+        cursor = conn.cursor(dictionary=True)
+        rows = sensor_gaps(cursor, patient_id, from_dt, to_dt)
+        conn.close()
+
+        return jsonify([
+            {
+                "sensor_id":  row["sensor_id"],
+                "gap_start":  row["gap_start"].isoformat(),
+                "gap_end":    row["gap_end"].isoformat(),
+                "duration_s": row["duration_s"],
+            }
+            for row in rows
+        ]), 200
+
+    except mysql_errors.OperationalError as db_err:
+        current_app.logger.error(f"Databasefejl i get_sensor_gaps: {db_err}", exc_info=True)
+        return jsonify({"error": "Databaseforbindelse fejlede"}), 500
+
+    except Exception as e:
+        current_app.logger.error(f"get_sensor_gaps fejl: {e}", exc_info=True)
+        return jsonify({"error": "Serverfejl ved hentning af sensorhuller"}), 500
+
+
+@patient_bp.route("/<patient_id>/lightdata/exports", methods=["POST"])
+@jwt_required()
+def create_light_export(patient_id):
+    """
+    POST /api/patients/<patient_id>/lightdata/exports
+    Body: {"from": <ISO8601>, "to": <ISO8601>, "format": "csv"|"parquet", "gzip": true|false}
+    (alle felter valgfrie). Opretter et eksportjob for patientens lyshistorik og svarer
+    202 med det samme; filen skrives i baggrunden (se light_export.py). Fremdrift:
+    GET /api/patients/lightdata/exports/<job_id>.
+    """
+    try:
+        if not re.fullmatch(r"[A-Za-z0-9_-]+", patient_id):
+            return jsonify({"error": "Ugyldigt patient_id"}), 400
+
+        user_id, _ = _extract_user_and_role()
+        try:
+            from_dt, to_dt, fmt, gzipped = parse_export_params(request.get_json(silent=True) or {})
+            job = light_exports.submit(user_id, "patient", patient_id, from_dt, to_dt, fmt, gzipped)
+        except ExportError as e:
+            return jsonify({"error": str(e)}), 400
+        except FormatUnavailable as e:
+            return jsonify({"error": str(e)}), 501
+
+        response = jsonify(export_job_json(job))
+        response.headers["Location"] = f"/api/patients/lightdata/exports/{job['job_id']}"
+        return response, 202
+
+    except mysql_errors.OperationalError as db_err:
+        current_app.logger.error(f"Databasefejl i create_light_export: {db_err}", exc_info=True)
+        return jsonify({"error": "Databaseforbindelse fejlede"}), 500
+
+    except Exception as e:
+        current_app.logger.error(f"create_light_export fejl: {e}", exc_info=True)
+        return jsonify({"error": "Serverfejl ved oprettelse af eksport"}), 500
+
+
+def _own_export_job(job_id):
+    """Jobbet, hvis det findes og er oprettet af den aktuelle bruger – ellers None."""
+    if not re.fullmatch(r"[0-9a-f]{32}", job_id):
+        return None
+    job = light_exports.get(job_id)
+    user_id, _ = _extract_user_and_role()
+    if job is None or job["requested_by"] != str(user_id):
+        return None
+    return job
+
+
+@patient_bp.route("/lightdata/exports/<job_id>", methods=["GET"])
+@jwt_required()
+def get_light_export(job_id):
+    """
+    GET /api/patients/lightdata/exports/<job_id>
+    Status og fremdrift for et eksportjob (patient‐ eller kohorteeksport).
+    Kun den bruger, der oprettede jobbet, kan se det.
+    """
+    try:
+        job = _own_export_job(job_id)
+        if job is None:
+            return jsonify({"error": "Ukendt eksportjob"}), 404
+        result = export_job_json(job)
+        if job["status"] == "done":
+            result["download_url"] = f"/api/patients/lightdata/exports/{job_id}/download"
+        return jsonify(result), 200
+
+    except Exception as e:
+        current_app.logger.error(f"get_light_export fejl: {e}", exc_info=True)
+        return jsonify({"error": "Serverfejl ved hentning af eksportstatus"}), 500
+
+
+@patient_bp.route("/lightdata/exports/<job_id>/download", methods=["GET"])
+@jwt_required()
+def download_light_export(job_id):
+    """
+    GET /api/patients/lightdata/exports/<job_id>/download
+    Sender den færdige eksportfil (409, hvis jobbet ikke er færdigt; 410, hvis filen er udløbet).
+    """
+    try:
+        job = _own_export_job(job_id)
+        if job is None:
+            return jsonify({"error": "Ukendt eksportjob"}), 404
+        if job["status"] == "expired":
+            return jsonify({"error": "Eksportfilen er slettet – opret en ny eksport"}), 410
+        if job["status"] != "done":
+            return jsonify({"error": f"Eksporten er ikke færdig (status: {job['status']})"}), 409
+
+        return send_file(
+            light_exports.path(job),
+            mimetype=content_type(job),
+            as_attachment=True,
+            download_name=job["file_name"],
+            conditional=True,
+        )
+
+    except FileNotFoundError:
+        return jsonify({"error": "Eksportfilen findes ikke på denne server"}), 410
+
+    except Exception as e:
+        current_app.logger.error(f"download_light_export fejl: {e}", exc_info=True)
+        return jsonify({"error": "Serverfejl ved hentning af eksportfil"}), 500
+
+
+@patient_bp.route("/lightdata/cache-stats", methods=["GET"])
+@jwt_required()
+def get_light_cache_stats():
+    """
+    GET /api/patients/lightdata/cache-stats
+    Hit/miss‐statistik for periodecachen og ETag‐validatorerne i denne proces –
+    bruges til at dimensionere LIGHT_PERIOD_CACHE_MB.
+    """
+    return jsonify({
+        "period_cache": period_cache.stats(),
+        "validators":   light_validators.stats(),
+        "circadian":    circadian_memo.stats(),
+        "exports":      light_exports.stats(),
+    }), 200
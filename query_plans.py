@@ -0,0 +1,405 @@
+# query_plans.py
+#
+# Regressionstjek af forespørgselsplaner for al SQL, som route‐ og hjælpemodulerne
+# udfører. SQL'en findes statisk (ast) i kaldene til execute/executemany, køres med
+# EXPLAIN mod en lokal MySQL med realistiske datamængder, og for SELECT'er måles
+# latens og faktisk læste rækker (Handler_read_*). Fejler, når en forespørgsel
+# laver fuld tabelscanning på en stor tabel, som ikke allerede står i baseline.
+#
+#   python query_plans.py --seed                  # fyld testdatabasen med testdata (se nedenfor)
+#   python query_plans.py --write-baseline        # accepter nuværende planer
+#   python query_plans.py                         # tjek mod query_plans_baseline.json
+#
+# Brug KUN mod en lokal testdatabase – --seed skriver i patient_light_sensor_data og
+# nægter at køre, medmindre QUERY_PLANS_SEED_DATABASE er sat til netop den database,
+# forbindelsen peger på:
+#
+#   QUERY_PLANS_SEED_DATABASE=ocutune_plans python query_plans.py --seed
+
+import argparse
+import ast
+import importlib
+import json
+import os
+import re
+import sys
+import time
+from datetime import datetime, timedelta
+
+from mysql_db import get_db_connection
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+BASELINE_PATH = os.path.join(ROOT, "query_plans_baseline.json")
+
+# Tabeller, hvor en fuld scanning er en regression (de vokser med tiden)
+LARGE_TABLES = {
+    "patient_light_sensor_data",
+    "patient_light_rollups",
+    "patient_battery_status",
+    "patient_sensor_log",
+    "patient_sensor_gaps",
+    "error_logs",
+    "error_log_counts",
+    "messages",
+    "patients",
+    "clinician_patients",
+}
+# Faktisk læste rækker må højst vokse med denne faktor ift. baseline
+ROWS_REGRESSION_FACTOR = 4.0
+
+SEED_PATIENT = "QP0001"
+SEED_CLINICIAN = 1
+
+
+def _extra_queries():
+    """
+    Forespørgsler, der ikke står direkte i et execute‐kald: customer_routes' loaders
+    sender deres SQL‐konstanter gennem _fetch_customer_rows. De importeres, så
+    tjekket altid ser den SQL, der faktisk køres.
+    """
+    from customer_routes import CUSTOMER_DAILY_SQL, CUSTOMER_WEEKLY_SQL, CUSTOMER_MONTHLY_SQL
+    return {
+        "customer_routes:_load_customer_daily": CUSTOMER_DAILY_SQL,
+        "customer_routes:_load_customer_weekly": CUSTOMER_WEEKLY_SQL,
+        "customer_routes:_load_customer_monthly": CUSTOMER_MONTHLY_SQL,
+    }
+
+
+def _extra_builders():
+    """SQL fra hjælpefunktioner, der bygger forespørgslen dynamisk."""
+    from light_pages import light_page_query
+    after = (datetime.utcnow() - timedelta(days=3), 1)
+    now = datetime.utcnow()
+    return {
+        "light_pages:light_page_query(first)": light_page_query(SEED_PATIENT, now - timedelta(days=7), now)[0],
+        "light_pages:light_page_query(after)": light_page_query(SEED_PATIENT, after=after)[0],
+        "light_pages:next_page_token": light_page_query(
+            SEED_PATIENT, after=after, limit=2, columns=("captured_at", "id"), offset=4999)[0],
+    }
+
+
+# ── Indsamling ────────────────────────────────────────────────────
+
+def _module_files():
+    for name in sorted(os.listdir(ROOT)):
+        if name.endswith(".py") and name != os.path.basename(__file__):
+            yield os.path.join(ROOT, name)
+
+
+def _resolve(node, local_strings, module_name):
+    """Returnerer SQL‐teksten for et execute‐argument eller None, hvis den er dynamisk."""
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return node.value
+    if isinstance(node, ast.Name):
+        if node.id in local_strings:
+            return local_strings[node.id]
+        return _module_constant(module_name, node.id)
+    if isinstance(node, ast.JoinedStr):
+        parts = []
+        for value in node.values:
+            if isinstance(value, ast.Constant):
+                parts.append(value.value)
+            elif isinstance(value, ast.FormattedValue) and isinstance(value.value, ast.Name):
+                resolved = _module_constant(module_name, value.value.id)
+                if resolved is None:
+                    return None
+                parts.append(resolved)
+            else:
+                return None
+        return "".join(parts)
+    return None
+
+
+def _module_constant(module_name, name):
+    """Beregnede modul‐konstanter (fx f‐strenge af andre konstanter) hentes ved import."""
+    try:
+        module = importlib.import_module(module_name)
+    except Exception:
+        return None
+    value = getattr(module, name, None)
+    if isinstance(value, (tuple, list)):
+        value = ", ".join(value)
+    return value if isinstance(value, str) else None
+
+
+def _is_explainable(sql):
+    """Læsninger, opdateringer, sletninger og INSERT … SELECT – ikke rene INSERT … VALUES."""
+    if re.match(r"\s*(SELECT|UPDATE|DELETE)\b", sql, re.I):
+        return True
+    return bool(re.match(r"\s*INSERT\b", sql, re.I) and re.search(r"\bSELECT\b", sql, re.I))
+
+
+def table_aliases(sql):
+    """{alias eller tabelnavn: tabelnavn} fra FROM/JOIN/UPDATE‐led."""
+    aliases = {}
+    keywords = {"ON", "WHERE", "JOIN", "LEFT", "RIGHT", "INNER", "GROUP", "ORDER", "LIMIT", "SET", "USING"}
+    for m in re.finditer(r"\b(?:FROM|JOIN|UPDATE|INTO)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?", sql, re.I):
+        table, alias = m.group(1), m.group(2)
+        aliases[table] = table
+        if alias and alias.upper() not in keywords:
+            aliases[alias] = table
+    return aliases
+
+
+def collect_statements():
+    """
+    Returnerer ({id: sql}, [id'er for dynamisk SQL]). id er "modul:funktion#n", hvor
+    n er forespørgslens nummer i funktionen – stabilt på tværs af linjeændringer.
+    """
+    statements = {}
+    dynamic = []
+    for path in _module_files():
+        module_name = os.path.splitext(os.path.basename(path))[0]
+        with open(path, encoding="utf-8") as f:
+            tree = ast.parse(f.read(), filename=path)
+
+        for func in [n for n in ast.walk(tree) if isinstance(n, (ast.FunctionDef, ast.AsyncFunctionDef))]:
+            local_strings = {}
+            for node in ast.walk(func):
+                if (isinstance(node, ast.Assign) and len(node.targets) == 1
+                        and isinstance(node.targets[0], ast.Name)
+                        and isinstance(node.value, ast.Constant) and isinstance(node.value.value, str)):
+                    local_strings[node.targets[0].id] = node.value.value
+
+            calls = [
+                n for n in ast.walk(func)
+                if isinstance(n, ast.Call) and isinstance(n.func, ast.Attribute)
+                and n.func.attr in ("execute", "executemany") and n.args
+            ]
+            for i, call in enumerate(sorted(calls, key=lambda c: (c.lineno, c.col_offset))):
+                key = f"{module_name}:{func.name}#{i}"
+                sql = _resolve(call.args[0], local_strings, module_name)
+                if sql is None:
+                    dynamic.append(key)
+                elif _is_explainable(sql):
+                    statements[key] = sql
+
+    for extra in (_extra_queries, _extra_builders):
+        try:
+            statements.update(extra())
+        except Exception as e:
+            print(f"[{__name__}] Kunne ikke hente forespørgsler fra {extra.__name__}: {e}")
+    return statements, dynamic
+
+
+# ── Parametre ─────────────────────────────────────────────────────
+
+_BEFORE_PLACEHOLDER = re.compile(r"([\w.]+)\s*(=|>=|<=|<|>|LIKE|IN\s*\()\s*$|\b(LIMIT|OFFSET)\s*$", re.I)
+
+
+def _guess_param(prefix, now):
+    """Et plausibelt parameter ud fra teksten lige før pladsholderen."""
+    m = _BEFORE_PLACEHOLDER.search(prefix)
+    if m is None:
+        return 1
+    if m.group(3):
+        return 100 if m.group(3).upper() == "LIMIT" else 0
+    column, op = m.group(1).split(".")[-1].lower(), m.group(2).upper()
+    if op == "LIKE":
+        return "%a%"
+    if column == "patient_id":
+        return SEED_PATIENT
+    if column == "clinician_id":
+        return SEED_CLINICIAN
+    if column == "bucket":
+        return "hour"
+    if column.endswith("_at") or column.endswith("_start") or column in ("captured_at", "since"):
+        return now - timedelta(days=1) if op in (">", ">=") else now
+    if column == "id" or column.endswith("_id"):
+        return 1
+    return "1"
+
+
+def bind_params(sql):
+    """Omskriver :navn‐pladsholdere (SQLAlchemy text) og gætter værdier til alle %s."""
+    sql = re.sub(r"(?<![:\w]):(\w+)", "%s", sql)
+    now = datetime.utcnow()
+    params = []
+    for m in re.finditer(r"%s", sql):
+        params.append(_guess_param(sql[:m.start()], now))
+    return sql, params
+
+
+# ── Kørsel ────────────────────────────────────────────────────────
+
+def _handler_reads(cursor):
+    cursor.execute("SHOW SESSION STATUS LIKE 'Handler_read%%'")
+    return sum(int(value) for _, value in cursor.fetchall())
+
+
+def analyze(cursor, key, sql):
+    sql, params = bind_params(sql)
+    result = {"id": key, "full_scans": [], "plan": [], "rows_examined": None, "latency_ms": None}
+    aliases = table_aliases(sql)
+    try:
+        cursor.execute("EXPLAIN " + sql, params)
+        columns = [c[0] for c in cursor.description]
+        for row in cursor.fetchall():
+            step = dict(zip(columns, row))
+            result["plan"].append({k: step.get(k) for k in ("table", "type", "key", "rows", "Extra")})
+            table = aliases.get(step.get("table"), step.get("table"))
+            if step.get("type") == "ALL" and table in LARGE_TABLES:
+                result["full_scans"].append(table)
+
+        if re.match(r"\s*SELECT\b", sql, re.I):
+            before = _handler_reads(cursor)
+            started = time.perf_counter()
+            cursor.execute(sql, params)
+            cursor.fetchall()
+            result["latency_ms"] = round((time.perf_counter() - started) * 1000.0, 2)
+            result["rows_examined"] = _handler_reads(cursor) - before
+    except Exception as e:
+        result["error"] = str(e)
+    return result
+
+
+def compare(results, baseline):
+    """
+    Returnerer en liste af regressioner ift. baseline (tom baseline = ingen fulde scanninger
+    tilladt). En forespørgsel, der ikke kan EXPLAIN'es, er altid en regression.
+    """
+    failures = []
+    for r in results:
+        if "error" in r:
+            failures.append(f"{r['id']}: fejler: {r['error']}")
+            continue
+        old = baseline.get(r["id"], {})
+        new_scans = sorted(set(r["full_scans"]) - set(old.get("full_scans", [])))
+        if new_scans:
+            failures.append(f"{r['id']}: fuld scanning af {', '.join(new_scans)}")
+        if r.get("rows_examined") and old.get("rows_examined"):
+            if r["rows_examined"] > old["rows_examined"] * ROWS_REGRESSION_FACTOR:
+                failures.append(
+                    f"{r['id']}: læser {r['rows_examined']} rækker (baseline {old['rows_examined']})"
+                )
+    return failures
+
+
+class SeedRefused(RuntimeError):
+    pass
+
+
+def _check_seed_target(cursor):
+    """Kaster SeedRefused, medmindre QUERY_PLANS_SEED_DATABASE navngiver den aktuelle database."""
+    allowed = os.environ.get("QUERY_PLANS_SEED_DATABASE")
+    cursor.execute("SELECT DATABASE()")
+    (current,) = cursor.fetchone()
+    if not allowed:
+        raise SeedRefused(
+            f"--seed kræver QUERY_PLANS_SEED_DATABASE (forbindelsen peger på {current!r})"
+        )
+    if allowed != current:
+        raise SeedRefused(
+            f"QUERY_PLANS_SEED_DATABASE={allowed!r}, men forbindelsen peger på {current!r}"
+        )
+
+
+def seed(patients=20, days=14, interval_s=60, batch_size=5000):
+    """
+    Fylder patient_light_sensor_data (og rollups) via den normale ingest‐sti.
+    Kun mod databasen navngivet i QUERY_PLANS_SEED_DATABASE – se _check_seed_target().
+    """
+    from light_ingest import insert_light_rows
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        _check_seed_target(cursor)
+    except Exception:
+        cursor.close()
+        conn.close()
+        raise
+    end = datetime.utcnow().replace(second=0, microsecond=0)
+    start = end - timedelta(days=days)
+    total = 0
+    try:
+        for p in range(patients):
+            patient_id = SEED_PATIENT if p == 0 else f"QP{p + 1:04d}"
+            rows = []
+            ts = start
+            while ts < end:
+                lux = 10.0 + (ts.hour * 97 + p * 13) % 2000
+                rows.append((patient_id, p + 1, lux, ts, lux * 0.8, 0.8, lux, "artificial",
+                             50.0, 0, None, None))
+                ts += timedelta(seconds=interval_s)
+                if len(rows) >= batch_size:
+                    total += insert_light_rows(cursor, rows)
+                    conn.commit()
+                    rows = []
+            if rows:
+                total += insert_light_rows(cursor, rows)
+                conn.commit()
+            print(f"[{__name__}] Seedet {patient_id} ({total} rækker i alt)")
+    finally:
+        cursor.close()
+        conn.close()
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Regressionstjek af SQL‐forespørgselsplaner")
+    parser.add_argument("--seed", action="store_true", help="fyld testdatabasen (QUERY_PLANS_SEED_DATABASE) med testdata først")
+    parser.add_argument("--seed-patients", type=int, default=20)
+    parser.add_argument("--seed-days", type=int, default=14)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--write-baseline", action="store_true", help="gem nuværende planer som baseline")
+    parser.add_argument("--report", help="skriv fuld rapport som JSON hertil")
+    args = parser.parse_args()
+
+    if args.seed:
+        try:
+            seed(patients=args.seed_patients, days=args.seed_days)
+        except SeedRefused as e:
+            print(f"[{__name__}] Seeding afvist: {e}")
+            return 2
+
+    statements, dynamic = collect_statements()
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        results = [analyze(cursor, key, sql) for key, sql in sorted(statements.items())]
+    finally:
+        conn.rollback()
+        cursor.close()
+        conn.close()
+
+    for r in results:
+        status = "FEJL" if "error" in r else ("SCAN" if r["full_scans"] else "ok")
+        print(f"{status:5} {r['id']:60} rows={r['rows_examined']!s:>9} ms={r['latency_ms']!s:>8}"
+              + (f"  {r['error']}" if "error" in r else ""))
+    if dynamic:
+        print(f"\n{len(dynamic)} forespørgsler med dynamisk SQL blev ikke analyseret:")
+        for key in dynamic:
+            print(f"  {key}")
+
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump({"results": results, "dynamic": dynamic}, f, indent=2, default=str)
+
+    errors = [r["id"] for r in results if "error" in r]
+    if args.write_baseline and errors:
+        print(f"\nBaseline ikke skrevet: {len(errors)} forespørgsler fejler")
+        return 1
+    if args.write_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({r["id"]: {"full_scans": r["full_scans"], "rows_examined": r["rows_examined"]}
+                       for r in results}, f, indent=2, sort_keys=True)
+        print(f"\nBaseline skrevet til {args.baseline}")
+        return 0
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    failures = compare(results, baseline)
+    if failures:
+        print("\nRegressioner:")
+        for failure in failures:
+            print(f"  {failure}")
+        return 1
+    print("\nIngen regressioner")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,202 @@
+# sensor_liveness.py
+
+# Seneste livstegn og huller pr. sensor (se sql/008_sensor_liveness.sql), holdt
+# ajour inkrementelt af ingest: hver indsættelse sammenholdes med sensorens
+# last_seen_at (ét opslag på primærnøglen), og huller længere end GAP_THRESHOLD
+# registreres med det samme. Der er ingen periodisk scanning af
+# patient_light_sensor_data. Alle funktioner kører på kalderens cursor og
+# committer ikke, så de indgår i kalderens transaktion.
+
+import os
+from datetime import timedelta
+
+GAP_THRESHOLD = timedelta(minutes=int(os.environ.get("SENSOR_GAP_MIN", 15)))
+OFFLINE_AFTER_MIN = int(os.environ.get("SENSOR_OFFLINE_AFTER_MIN", 60))
+
+_UPSERT_SQL = """
+    INSERT INTO patient_sensor_liveness (
+        patient_id, sensor_id, first_seen_at, last_seen_at, last_received_at
+    ) VALUES (%s, %s, %s, %s, NOW())
+    ON DUPLICATE KEY UPDATE
+        first_seen_at    = LEAST(first_seen_at, VALUES(first_seen_at)),
+        last_seen_at     = GREATEST(last_seen_at, VALUES(last_seen_at)),
+        last_received_at = NOW()
+"""
+
+# Opretter rækken for en sensor, der ikke er set før, med batchens ældste tidspunkt
+# som både first_seen_at og last_seen_at; findes den, røres den ikke. Så eksisterer
+# rækken altid, når den låses med SELECT … FOR UPDATE, og låsen bliver en rækkelås
+# i stedet for en gap‐lås, der lader to samtidige første batches begge se "ny sensor".
+_ENSURE_SQL = """
+    INSERT INTO patient_sensor_liveness (
+        patient_id, sensor_id, first_seen_at, last_seen_at, last_received_at
+    ) VALUES (%s, %s, %s, %s, NOW())
+    ON DUPLICATE KEY UPDATE patient_id = patient_id
+"""
+
+_INSERT_GAP_SQL = """
+    INSERT INTO patient_sensor_gaps (patient_id, sensor_id, gap_start, gap_end, duration_s)
+    VALUES (%s, %s, %s, %s, %s)
+"""
+
+
+def _gaps(key, points):
+    """Huller mellem på hinanden følgende (sorterede) tidspunkter."""
+    return [
+        key + (a, b, int((b - a).total_seconds()))
+        for a, b in zip(points, points[1:])
+        if b - a > GAP_THRESHOLD
+    ]
+
+
+def _samples_by_sensor(rows, columns):
+    pid, sid, ts = (columns.index(name) for name in ("patient_id", "sensor_id", "captured_at"))
+    by_sensor = {}
+    for row in rows:
+        # Datapunkter uden sensor_id kan ikke knyttes til en sensor og springes over
+        if row[sid] is None:
+            continue
+        by_sensor.setdefault((str(row[pid]), int(row[sid])), set()).add(row[ts])
+    return {key: sorted(stamps) for key, stamps in by_sensor.items()}
+
+
+def update_liveness(cursor, rows, columns, new_count):
+    """
+    Opdaterer livstegn for sensorerne i `rows` (række‐tupler i `columns`‐rækkefølge)
+    og registrerer nye huller. Datapunkter, der er ældre end sensorens last_seen_at
+    (offline‐backlog), udfylder i stedet registrerede huller, de falder i.
+    `new_count` er antal rækker, databasen faktisk indsatte: er alt dubletter (fx en
+    gentaget upload), røres intet – ellers ville last_received_at flyttes frem, og en
+    tavs sensor ville se levende ud. Dubletter i en blandet batch findes allerede i
+    patient_light_sensor_data og ændrer derfor hverken tidslinjen eller hullerne.
+    Returnerer de nye huller som (patient_id, sensor_id, gap_start, gap_end, duration_s).
+    """
+    if new_count == 0:
+        return []
+    by_sensor = _samples_by_sensor(rows, columns)
+    if not by_sensor:
+        return []
+
+    # Sorteret nøglerækkefølge, så samtidige indsættelser låser i samme orden
+    keys = sorted(by_sensor)
+    cursor.executemany(_ENSURE_SQL, [key + (by_sensor[key][0],) * 2 for key in keys])
+    placeholders = ", ".join(["(%s, %s)"] * len(keys))
+    cursor.execute(f"""
+        SELECT patient_id, sensor_id, last_seen_at
+        FROM patient_sensor_liveness
+        WHERE (patient_id, sensor_id) IN ({placeholders})
+        FOR UPDATE
+    """, [value for key in keys for value in key])
+    previous = {(patient_id, sensor_id): last for patient_id, sensor_id, last in cursor.fetchall()}
+
+    gaps = []
+    late = []
+    for key in keys:
+        # For en ny sensor er last batchens ældste tidspunkt, så alle huller i batchen findes
+        stamps = by_sensor[key]
+        last = previous[key]
+        older = [t for t in stamps if t < last]
+        if older:
+            late.append((key, older))
+        gaps.extend(_gaps(key, [last] + [t for t in stamps if t > last]))
+
+    cursor.executemany(_UPSERT_SQL, [key + (stamps[0], stamps[-1]) for key, stamps in by_sensor.items()])
+    for key, older in late:
+        gaps.extend(_fill_gaps(cursor, key, older))
+    if gaps:
+        cursor.executemany(_INSERT_GAP_SQL, gaps)
+        longest = max(gaps, key=lambda gap: gap[4])
+        print(f"[{__name__}] {len(gaps)} nye huller i sensordata; længste: "
+              f"patient_id={longest[0]}, sensor_id={longest[1]}, "
+              f"{longest[2].isoformat()} → {longest[3].isoformat()}")
+    return gaps
+
+
+def _fill_gaps(cursor, key, stamps):
+    """
+    Splitter registrerede huller, som sene datapunkter falder i. Returnerer de
+    resterende delhuller, der stadig er længere end GAP_THRESHOLD (kalderen indsætter dem).
+    """
+    cursor.execute("""
+        SELECT id, gap_start, gap_end
+        FROM patient_sensor_gaps
+        WHERE patient_id = %s
+          AND sensor_id  = %s
+          AND gap_start  < %s
+          AND gap_end    > %s
+        FOR UPDATE
+    """, key + (stamps[-1], stamps[0]))
+
+    remaining = []
+    filled = []
+    for gap_id, gap_start, gap_end in cursor.fetchall():
+        inside = [t for t in stamps if gap_start < t < gap_end]
+        if inside:
+            filled.append((gap_id,))
+            remaining.extend(_gaps(key, [gap_start] + inside + [gap_end]))
+    if filled:
+        cursor.executemany("DELETE FROM patient_sensor_gaps WHERE id = %s", filled)
+    return remaining
+
+
+def offline_sensors_for_clinician(cursor, clinician_id, silent_minutes=OFFLINE_AFTER_MIN):
+    """
+    Sensorer med en åben session i patient_sensor_log (for klinikerens patienter),
+    som ikke har sendt data i mindst `silent_minutes` minutter – eller slet ikke siden
+    sessionen startede. Tavshed regnes fra seneste modtagne datapunkt (servertid),
+    dog højst fra sessionens start. Forventer en dictionary‐cursor.
+    """
+    cursor.execute("""
+        SELECT a.patient_id,
+               a.sensor_id,
+               a.log_id,
+               a.started_at,
+               s.last_seen_at,
+               s.last_received_at,
+               TIMESTAMPDIFF(
+                   MINUTE,
+                   COALESCE(GREATEST(s.last_received_at, a.started_at), a.started_at),
+                   NOW()
+               ) AS silent_minutes
+        FROM clinician_patients AS cp
+        JOIN patient_sensor_active_sessions AS a
+          ON a.patient_id = cp.patient_id
+        LEFT JOIN patient_sensor_liveness AS s
+          ON  s.patient_id = a.patient_id
+          AND s.sensor_id  = a.sensor_id
+        WHERE cp.clinician_id = %s
+        HAVING silent_minutes >= %s
+        ORDER BY silent_minutes DESC
+    """, (clinician_id, silent_minutes))
+    return cursor.fetchall()
+
+
+def sensor_status(cursor, patient_id):
+    """Livstegn for alle patientens sensorer. Forventer en dictionary‐cursor."""
+    cursor.execute("""
+        SELECT s.sensor_id,
+               s.first_seen_at,
+               s.last_seen_at,
+               s.last_received_at,
+               a.log_id IS NOT NULL AS session_open
+        FROM patient_sensor_liveness AS s
+        LEFT JOIN patient_sensor_active_sessions AS a
+          ON  a.patient_id = s.patient_id
+          AND a.sensor_id  = s.sensor_id
+        WHERE s.patient_id = %s
+        ORDER BY s.last_seen_at DESC
+    """, (patient_id,))
+    return cursor.fetchall()
+
+
+def sensor_gaps(cursor, patient_id, start_dt, end_dt):
+    """Registrerede huller, der overlapper [start_dt, end_dt). Forventer en dictionary‐cursor."""
+    cursor.execute("""
+        SELECT sensor_id, gap_start, gap_end, duration_s
+        FROM patient_sensor_gaps
+        WHERE patient_id = %s
+          AND gap_start  < %s
+          AND gap_end    > %s
+        ORDER BY gap_start ASC
+    """, (patient_id, end_dt, start_dt))
+    return cursor.fetchall()
@@ -4,9 +4,33 @@ from flask import Blueprint, request, jsonify
 from mysql_db import get_db_connection
 import json
 from datetime import datetime
+from light_ingest import (
+    parse_light_sample, insert_light_rows, store_light_rows, derive_missing_metrics,
+    rows_committed,
+)
+from ingest_buffer import light_buffer
+from ndjson_upload import iter_ndjson_lines, upload_progress, UploadTooLarge, MalformedUpload
+from battery_cache import battery_cache
+from device_registry import device_registry
+from sensor_sessions import open_session, close_session
+from light_wire import (
+    CONTENT_TYPE as WIRE_CONTENT_TYPE, MAX_FRAME_BYTES, FrameTooLarge, WireFormatError, decode_light_frame,
+)
 
 sensor_bp = Blueprint("sensor_bp", __name__)
 
+
+def _warm_device_registry(state):
+    # Fejler opvarmningen (fx database nede ved opstart), varmes cachen ved første opslag
+    try:
+        count = device_registry.warm()
+        print(f"[{__name__}] device_registry varmet op med {count} sensorer")
+    except Exception as e:
+        print(f"[{__name__}] FEJL ved opvarmning af device_registry: {e}")
+
+
+sensor_bp.record_once(_warm_device_registry)
+
 @sensor_bp.route('/log', methods=['POST'])
 def log_sensor_event():
     try:
@@ -34,17 +58,26 @@ def battery_status():
     """
     POST /api/sensor/patient-battery-status
     Indsætter patient_id, sensor_id og battery_level i patient_battery_status.
+    Uændrede niveauer (inden for hysterese) gemmes ikke – kun ændringer og
+    periodiske heartbeats. Seneste niveau holdes altid i battery_cache.
     Logger til terminal, når opslaget lykkes.
     """
     data = request.get_json()
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
     try:
         patient_id = data["patient_id"]
         sensor_id  = data.get("sensor_id")       # Kan være None
         battery_lvl = data["battery_level"]
+        float(battery_lvl)
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+
+    if not battery_cache.report(patient_id, sensor_id, battery_lvl):
+        return jsonify({"success": True, "sensor_id": sensor_id, "persisted": False}), 200
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
 
+    try:
         # Eksekver INSERT
         cursor.execute(
             """
@@ -54,12 +87,13 @@ def battery_status():
             (patient_id, sensor_id, battery_lvl),
         )
         conn.commit()
+        battery_cache.mark_persisted(patient_id, sensor_id, battery_lvl)
 
         # --- Printe til terminalen:
         print(f"[{__name__}] Ny batteri‐status modtaget: "
               f"patient_id={patient_id}, sensor_id={sensor_id}, battery_level={battery_lvl}")
 
-        return jsonify({"success": True, "sensor_id": sensor_id}), 200
+        return jsonify({"success": True, "sensor_id": sensor_id, "persisted": True}), 200
 
     except Exception as e:
         print(f"[{__name__}] Fejl ved indsættelse i DB: {e}")
@@ -70,6 +104,22 @@ def battery_status():
         conn.close()
 
 
+@sensor_bp.route("/patient-battery-status/current", methods=["GET"])
+def current_battery_status():
+    """
+    GET /api/sensor/patient-battery-status/current?sensor_ids=1,2&patient_ids=P3,P4
+    Returnerer seneste kendte batteriniveau for de angivne sensorer/patienter fra
+    battery_cache (til klinikerens dashboard). Kun sensorer/patienter, processen ikke
+    har slået op før, hentes fra databasen.
+    """
+    sensor_ids = [s for s in request.args.get("sensor_ids", "").split(",") if s]
+    patient_ids = [p for p in request.args.get("patient_ids", "").split(",") if p]
+    if not sensor_ids and not patient_ids:
+        return jsonify({"error": "Angiv sensor_ids og/eller patient_ids"}), 400
+
+    return jsonify(battery_cache.lookup(sensor_ids, patient_ids)), 200
+
+
 @sensor_bp.route("/patient-light-data", methods=["POST"])
 def light_data():
     """
@@ -83,60 +133,24 @@ def light_data():
 
     try:
         # ────────────────────────────────────────────────────────────
-        # 1) Udpak alle felter fra JSON til lokale Python‐variabler:
-        patient_id    = data["patient_id"]
-        sensor_id     = data.get("sensor_id")
-        lux_level     = data.get("lux_level")
-        # Her læser vi "timestamp" i stedet for "captured_at":
-        raw_ts        = data.get("timestamp")
-        melanopic_edi = data.get("melanopic_edi")
-        der           = data.get("der")
-        illuminance   = data.get("illuminance")
-        light_type    = data.get("light_type")
-        exposure_score   = data.get("exposure_score")
-        action_required  = data.get("action_required", 0)
-
-        # Hvis klienten ikke har sendt "timestamp", kan vi stadig falde tilbage på server‐tid:
-        if raw_ts is None:
-            captured_at = datetime.now()
-        else:
-            # Bruger Python 3.7+'s fromisoformat til at parse ISO‐strengen:
-            captured_at = datetime.fromisoformat(raw_ts)
+        # 1) Udpak alle felter fra JSON til en række‐tuple.
+        #    Klienten sender "timestamp" i stedet for "captured_at";
+        #    mangler det, falder vi tilbage på server‐tid.
+        #    Sendes rå "channels", beregnes de afledte mål her på serveren.
+        row = derive_missing_metrics([parse_light_sample(data)])[0]
+        (patient_id, sensor_id, lux_level, captured_at, melanopic_edi,
+         der, illuminance, light_type, exposure_score, action_required) = row[:10]
 
         # ────────────────────────────────────────────────────────────
         # 2) Udfør INSERT i patient_light_sensor_data‐tabellen:
-        cursor.execute(
-            """
-            INSERT INTO patient_light_sensor_data (
-                patient_id,
-                sensor_id,
-                lux_level,
-                captured_at,
-                melanopic_edi,
-                der,
-                illuminance,
-                light_type,
-                exposure_score,
-                action_required
-            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            """,
-            (
-                patient_id,
-                sensor_id,
-                lux_level,
-                captured_at,                 # nu det faktiske tidspunkt fra Flutter
-                melanopic_edi,
-                der,
-                illuminance,
-                light_type,
-                exposure_score,
-                action_required
-            ),
-        )
+        #    Er datapunktet allerede gemt (klient‐retry), ignoreres det af den unikke nøgle.
+        is_new = insert_light_rows(cursor, [row]) > 0
 
         # ────────────────────────────────────────────────────────────
         # 3) Commit for at gemme i databasen:
         conn.commit()
+        if is_new:
+            rows_committed([row])
 
         # ────────────────────────────────────────────────────────────
         # 4) Print en bekræftende loglinje med præcis de værdier, der blev sendt:
@@ -148,7 +162,7 @@ def light_data():
             f"captured_at={captured_at.isoformat()}"
         )
 
-        return jsonify({"success": True}), 200
+        return jsonify({"success": True, "duplicate": not is_new}), 200
 
     except Exception as e:
         print(f"[{__name__}] Fejl ved indsættelse af lysdata i DB: {e}")
@@ -159,6 +173,279 @@ def light_data():
         conn.close()
 
 
+def _parse_sample_batch(data):
+    """
+    Fælles parsing af batch‐kroppe: enten en liste af datapunkter eller
+    {"patient_id": …, "sensor_id": …, "samples": [ … ]}.
+    Returnerer (rows, results) – eller None, hvis kroppen ikke er en batch.
+    """
+    if isinstance(data, list):
+        samples, defaults = data, {}
+    elif isinstance(data, dict) and isinstance(data.get("samples"), list):
+        samples, defaults = data["samples"], data
+    else:
+        return None
+
+    rows = []
+    results = []
+    for index, sample in enumerate(samples):
+        try:
+            rows.append(parse_light_sample(sample, defaults))
+            results.append({"index": index, "status": "accepted"})
+        except (KeyError, ValueError, TypeError) as e:
+            results.append({"index": index, "status": "rejected", "error": str(e)})
+    return rows, results
+
+
+def _parse_binary_batch():
+    """
+    Afkoder en binær frame (light_wire.CONTENT_TYPE). Hele framen er enten gyldig
+    eller afvist, så der er ingen afviste enkelt‐datapunkter at rapportere.
+    Returnerer (rows, results) – eller None, hvis kroppen ikke er binær.
+    """
+    if request.mimetype != WIRE_CONTENT_TYPE:
+        return None
+    if (request.content_length or 0) > MAX_FRAME_BYTES:
+        raise FrameTooLarge(f"Framen overstiger {MAX_FRAME_BYTES} bytes")
+    # Læs højst én byte over loftet, så en krop uden Content-Length også afvises
+    buf = request.stream.read(MAX_FRAME_BYTES + 1)
+    if len(buf) > MAX_FRAME_BYTES:
+        raise FrameTooLarge(f"Framen overstiger {MAX_FRAME_BYTES} bytes")
+    return decode_light_frame(buf), []
+
+
+def _rejected_count(results):
+    return sum(r["status"] == "rejected" for r in results)
+
+
+@sensor_bp.route("/patient-light-data/batch", methods=["POST"])
+def light_data_batch():
+    """
+    POST /api/sensor/patient-light-data/batch
+    Indsætter mange datapunkter i patient_light_sensor_data med én multi‐row INSERT og ét commit.
+    Kroppen er enten en liste af datapunkter eller et objekt med fælles felter:
+      {
+        "patient_id": "P3",          # standard for alle samples (valgfri)
+        "sensor_id": 7,              # standard for alle samples (valgfri)
+        "samples": [ { "timestamp": "...", "lux_level": ..., … }, … ]
+      }
+    Hvert datapunkt kan selv angive patient_id/sensor_id, så flere sensorers data kan sendes samlet.
+    Ugyldige datapunkter afvises enkeltvis – resten af batchen gemmes stadig.
+    Indsættelsen er idempotent: datapunkter, der allerede findes (samme patient, sensor og
+    tidsstempel), tælles som "duplicates". Et valgfrit "batch_id" gør, at en gentaget batch
+    genkendes i sin helhed.
+    Med Content-Type: application/x-ocutune-light modtages i stedet en binær frame (se light_wire.py).
+    """
+    # 1) Valider og konverter hvert datapunkt – fejl registreres pr. indeks
+    try:
+        parsed = _parse_binary_batch()
+    except FrameTooLarge as e:
+        return jsonify({"success": False, "error": str(e)}), 413
+    except WireFormatError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    data = request.get_json(silent=True) if parsed is None else None
+    if parsed is None:
+        parsed = _parse_sample_batch(data)
+    if parsed is None:
+        return jsonify({"success": False, "error": "Forventer en liste af samples"}), 400
+    rows, results = parsed
+
+    if not rows:
+        return jsonify({
+            "success": False,
+            "accepted": 0,
+            "rejected": _rejected_count(results),
+            "results": results,
+        }), 400
+
+    # 2) Én INSERT og ét commit for hele batchen
+    batch_id = data.get("batch_id") if isinstance(data, dict) else request.headers.get("X-Batch-Id")
+    conn = get_db_connection()
+    try:
+        stored = store_light_rows(conn, rows, batch_id)
+
+        print(f"[{__name__}] Lysdata‐batch modtaget: {stored['new']} nye, "
+              f"{stored['duplicates']} dubletter, {_rejected_count(results)} afvist")
+
+        return jsonify({
+            "success": True,
+            "accepted": len(rows),
+            "rejected": _rejected_count(results),
+            "new": stored["new"],
+            "duplicates": stored["duplicates"],
+            "batch_replayed": stored["batch_replayed"],
+            "results": results,
+        }), 200
+
+    except Exception as e:
+        print(f"[{__name__}] Fejl ved indsættelse af lysdata‐batch i DB: {e}")
+        return jsonify({"success": False, "error": str(e)}), 500
+
+    finally:
+        conn.close()
+
+
+@sensor_bp.route("/patient-light-data/queued", methods=["POST"])
+def light_data_queued():
+    """
+    POST /api/sensor/patient-light-data/queued
+    Som /patient-light-data/batch (eller ét enkelt datapunkt), men datapunkterne lægges i
+    write‐behind‐køen og skrives til databasen i gruppe‐commits af en baggrundstråd.
+    Svarer 202, når datapunkterne er lagt i køen, og 503, hvis køen er fuld.
+    Accepterer også binære frames (Content-Type: application/x-ocutune-light).
+    """
+    try:
+        parsed = _parse_binary_batch()
+    except FrameTooLarge as e:
+        return jsonify({"success": False, "error": str(e)}), 413
+    except WireFormatError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    if parsed is None:
+        data = request.get_json(silent=True)
+        parsed = _parse_sample_batch(data)
+    if parsed is None:
+        parsed = _parse_sample_batch([data])
+    rows, results = parsed
+
+    if not rows:
+        return jsonify({
+            "success": False,
+            "accepted": 0,
+            "rejected": _rejected_count(results),
+            "results": results,
+        }), 400
+
+    if not light_buffer.enqueue(rows):
+        return jsonify({"success": False, "error": "Ingest‐køen er fuld, prøv igen senere"}), 503
+
+    return jsonify({
+        "success": True,
+        "accepted": len(rows),
+        "rejected": _rejected_count(results),
+        "results": results,
+    }), 202
+
+
+@sensor_bp.route("/ingest-stats", methods=["GET"])
+def ingest_stats():
+    """
+    GET /api/sensor/ingest-stats
+    Returnerer kødybde og flush‐latens for write‐behind‐køen.
+    """
+    return jsonify(light_buffer.stats()), 200
+
+
+@sensor_bp.route("/patient-light-data/stream", methods=["POST"])
+def light_data_stream():
+    """
+    POST /api/sensor/patient-light-data/stream?upload_id=<id>&offset=<n>
+    Modtager et offline‐backlog som newline‐delimited JSON (ét datapunkt pr. linje),
+    evt. gzip‐komprimeret (Content-Encoding: gzip). Kroppen læses og indsættes i bidder
+    af `chunk_size` linjer med ét commit pr. bid, så hele kroppen aldrig ligger i hukommelsen.
+    `offset` springer de første n linjer over, så en afbrudt upload kan genoptages fra
+    "committed_offset" i forrige svar (eller GET …/stream/<upload_id>).
+    patient_id/sensor_id kan angives som query‐parametre og gælder så for alle linjer.
+    """
+    upload_id = request.args.get("upload_id")
+    try:
+        offset = int(request.args.get("offset", 0))
+        chunk_size = min(int(request.args.get("chunk_size", 1000)), 10000)
+    except ValueError:
+        return jsonify({"success": False, "error": "offset og chunk_size skal være heltal"}), 400
+    if upload_id is not None and len(upload_id) > 64:
+        return jsonify({"success": False, "error": "upload_id må højst være 64 tegn"}), 400
+
+    defaults = {
+        "patient_id": request.args.get("patient_id"),
+        "sensor_id":  request.args.get("sensor_id"),
+    }
+    gzipped = (request.headers.get("Content-Encoding", "").lower() == "gzip")
+
+    progress = {
+        "upload_id": upload_id,
+        "committed_offset": offset,
+        "accepted": 0,
+        "new": 0,
+        "duplicates": 0,
+        "rejected": 0,
+        "rejected_lines": [],
+        "complete": False,
+    }
+
+    def commit_chunk(rows, line_no, complete=False):
+        # Fremdriften gemmes i samme transaktion som rækkerne
+        new = insert_light_rows(cursor, rows)
+        committed = dict(
+            progress,
+            accepted=progress["accepted"] + len(rows),
+            new=progress["new"] + new,
+            duplicates=progress["duplicates"] + len(rows) - new,
+            committed_offset=line_no,
+            complete=complete,
+        )
+        if upload_id:
+            upload_progress.save(cursor, committed)
+        conn.commit()
+        progress.update(committed)
+        if new:
+            rows_committed(rows)
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        rows = []
+        line_no = 0
+        for line_no, line in enumerate(iter_ndjson_lines(request.stream, gzipped), start=1):
+            if line_no <= offset or not line.strip():
+                continue
+            try:
+                rows.append(parse_light_sample(json.loads(line), defaults))
+            except (KeyError, ValueError, TypeError) as e:
+                progress["rejected"] += 1
+                if len(progress["rejected_lines"]) < 100:
+                    progress["rejected_lines"].append({"line": line_no, "error": str(e)})
+            if len(rows) >= chunk_size:
+                commit_chunk(rows, line_no)
+                rows = []
+
+        commit_chunk(rows, max(line_no, offset), complete=True)
+
+        print(f"[{__name__}] NDJSON‐upload afsluttet: upload_id={upload_id}, "
+              f"accepted={progress['accepted']}, rejected={progress['rejected']}")
+        return jsonify({"success": True, **progress}), 200
+
+    except UploadTooLarge as e:
+        conn.rollback()
+        print(f"[{__name__}] NDJSON‐upload afvist ved offset {progress['committed_offset']}: {e}")
+        return jsonify({"success": False, "error": str(e), **progress}), 413
+
+    except MalformedUpload as e:
+        conn.rollback()
+        print(f"[{__name__}] NDJSON‐upload afvist ved offset {progress['committed_offset']}: {e}")
+        return jsonify({"success": False, "error": str(e), **progress}), 400
+
+    except Exception as e:
+        conn.rollback()
+        print(f"[{__name__}] NDJSON‐upload afbrudt ved offset {progress['committed_offset']}: {e}")
+        return jsonify({"success": False, "error": str(e), **progress}), 500
+
+    finally:
+        cursor.close()
+        conn.close()
+
+
+@sensor_bp.route("/patient-light-data/stream/<upload_id>", methods=["GET"])
+def light_data_stream_progress(upload_id):
+    """
+    GET /api/sensor/patient-light-data/stream/<upload_id>
+    Returnerer seneste committede offset for en (evt. afbrudt) NDJSON‐upload.
+    """
+    progress = upload_progress.get(upload_id)
+    if progress is None:
+        return jsonify({"error": "Ukendt upload_id"}), 404
+    return jsonify(progress), 200
+
+
 @sensor_bp.route('/register-sensor-use', methods=['POST'])
 def register_sensor_use():
     conn = None
@@ -174,40 +461,24 @@ def register_sensor_use():
         # Start transaction
         conn.start_transaction()
         
-        # 1) Find eller opret sensor
-        cursor.execute(
-            "SELECT id FROM patient_sensors WHERE patient_id = %s",
-            (patient_id,)
-        )
-        row = cursor.fetchone()
-        
-        if row:
-            sensor_id = row["id"]
-        else:
+        # 1) Find eller opret sensor (opslag via device_registry – ingen DB‐runde ved cache‐hit)
+        sensor_id = device_registry.sensor_for_patient(patient_id)
+        created = sensor_id is None
+
+        if created:
             cursor.execute("""
                 INSERT INTO patient_sensors (patient_id, device_serial, sensor_type)
                 VALUES (%s, %s, 'light')
             """, (patient_id, device_serial))
             sensor_id = cursor.lastrowid
         
-        # 2) Afslut eventuelle aktive sessioner
-        cursor.execute("""
-            UPDATE patient_sensor_log
-            SET ended_at = NOW(),
-                status = 'auto_closed'
-            WHERE patient_id = %s
-              AND sensor_id = %s
-              AND ended_at IS NULL
-        """, (patient_id, sensor_id))
-        
-        # 3) Opret ny session
-        cursor.execute("""
-            INSERT INTO patient_sensor_log (
-                sensor_id, patient_id, started_at, status
-            ) VALUES (%s, %s, NOW(), 'active')
-        """, (sensor_id, patient_id))
+        # 2) Afslut eventuel aktiv session og opret en ny
+        #    (via patient_sensor_active_sessions – ingen scanning af loggen)
+        open_session(cursor, patient_id, sensor_id)
         
         conn.commit()
+        if created:
+            device_registry.add(sensor_id, patient_id, device_serial)
         return jsonify({
             "success": True,
             "sensor_id": sensor_id
@@ -227,7 +498,7 @@ def register_sensor_use():
 def end_sensor_use():
     """
     POST /api/sensor/end-sensor-use
-    Lukker seneste åbne sensor‐log for en given sensor_id og patient_id, sætter ended_at og status.
+    Lukker den åbne sensor‐log for en given sensor_id og patient_id, sætter ended_at og status.
     """
     try:
         data = request.get_json()
@@ -238,22 +509,9 @@ def end_sensor_use():
         conn = get_db_connection()
         cursor = conn.cursor()
 
-        # Find seneste uafsluttede log
-        cursor.execute("""
-            SELECT id FROM patient_sensor_log
-            WHERE patient_id = %s AND sensor_id = %s AND ended_at IS NULL
-            ORDER BY started_at DESC LIMIT 1
-        """, (patient_id, sensor_id))
-        row = cursor.fetchone()
-
-        if row:
-            log_id = row[0]
-            cursor.execute("""
-                UPDATE patient_sensor_log
-                SET ended_at = NOW(), status = %s
-                WHERE id = %s
-            """, (status, log_id))
-            conn.commit()
+        # Luk den aktive session (opslag på primærnøglen i patient_sensor_active_sessions)
+        close_session(cursor, patient_id, sensor_id, status)
+        conn.commit()
 
         cursor.close()
         conn.close()
@@ -274,21 +532,29 @@ def get_sensor_id():
     try:
         serial = request.args.get("device_serial")
 
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute(
-            "SELECT id FROM patient_sensors WHERE device_serial = %s",
-            (serial,)
-        )
-        row = cursor.fetchone()
+        sensor_id = device_registry.sensor_for_serial(serial)
+        if sensor_id is not None:
+            return jsonify({"sensor_id": sensor_id}), 200
 
-        cursor.close()
-        conn.close()
+        return jsonify({"error": "Not found"}), 404
 
-        if row:
-            return jsonify({"sensor_id": row["id"]}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
-        return jsonify({"error": "Not found"}), 404
+
+@sensor_bp.route("/get-sensor-ids", methods=["GET"])
+def get_sensor_ids():
+    """
+    GET /api/sensor/get-sensor-ids?device_serials=<serial1>,<serial2>,…
+    Bulk‐opslag via device_registry. Returnerer {"<serial>": <sensor_id>} for de
+    serienumre, der findes; ukendte serienumre udelades.
+    """
+    try:
+        serials = [s for s in request.args.get("device_serials", "").split(",") if s]
+        if not serials:
+            return jsonify({"error": "Angiv device_serials"}), 400
+
+        return jsonify(device_registry.sensors_for_serials(serials)), 200
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
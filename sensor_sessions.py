@@ -0,0 +1,86 @@
+# sensor_sessions.py
+
+# Aktive sensor‐sessioner slås op i patient_sensor_active_sessions
+# (se sql/002_active_sensor_sessions.sql) i stedet for at scanne patient_sensor_log
+# efter ended_at IS NULL. Alle funktioner kører på kalderens cursor og committer ikke,
+# så de indgår i kalderens transaktion.
+
+
+def close_session(cursor, patient_id, sensor_id, status):
+    """
+    Lukker den aktive session for (patient_id, sensor_id), hvis der er én.
+    Returnerer True, hvis en session blev lukket.
+    """
+    cursor.execute("""
+        UPDATE patient_sensor_log AS l
+        JOIN patient_sensor_active_sessions AS a
+          ON a.log_id = l.id
+        SET l.ended_at = NOW(),
+            l.status   = %s
+        WHERE a.patient_id = %s
+          AND a.sensor_id  = %s
+    """, (status, patient_id, sensor_id))
+    closed = cursor.rowcount > 0
+
+    cursor.execute("""
+        DELETE FROM patient_sensor_active_sessions
+        WHERE patient_id = %s AND sensor_id = %s
+    """, (patient_id, sensor_id))
+    return closed
+
+
+# Peger den aktive række om på den nye log i ét statement. Findes rækken allerede,
+# gemmes dens tidligere log_id via LAST_INSERT_ID(expr), så kalderen kan lukke den
+# gamle log: rowcount er 1 ved en ny række og 2, når en eksisterende blev opdateret
+# (cursor.lastrowid er så den forrige log_id). Rækkelåsen fra upserten serialiserer
+# samtidige åbninger for samme sensor – ingen DELETE + INSERT, der kan kollidere.
+_ACTIVATE_SQL = """
+    INSERT INTO patient_sensor_active_sessions (patient_id, sensor_id, log_id, started_at)
+    VALUES (%s, %s, %s, NOW())
+    ON DUPLICATE KEY UPDATE
+        log_id     = VALUES(log_id) + 0 * LAST_INSERT_ID(log_id),
+        started_at = VALUES(started_at)
+"""
+
+
+def open_session(cursor, patient_id, sensor_id):
+    """
+    Opretter en ny session og lukker en evt. åben (status 'auto_closed').
+    Returnerer id på den nye række i patient_sensor_log.
+    """
+    cursor.execute("""
+        INSERT INTO patient_sensor_log (
+            sensor_id, patient_id, started_at, status
+        ) VALUES (%s, %s, NOW(), 'active')
+    """, (sensor_id, patient_id))
+    log_id = cursor.lastrowid
+
+    cursor.execute(_ACTIVATE_SQL, (patient_id, sensor_id, log_id))
+    if cursor.rowcount == 2:
+        cursor.execute("""
+            UPDATE patient_sensor_log
+            SET ended_at = NOW(),
+                status   = 'auto_closed'
+            WHERE id = %s
+              AND ended_at IS NULL
+        """, (cursor.lastrowid,))
+    return log_id
+
+
+def active_sessions_for_clinician(cursor, clinician_id):
+    """
+    Returnerer aktive sessioner for alle patienter tilknyttet klinikeren.
+    Forventer en dictionary‐cursor.
+    """
+    cursor.execute("""
+        SELECT a.patient_id,
+               a.sensor_id,
+               a.log_id,
+               a.started_at
+        FROM clinician_patients AS cp
+        JOIN patient_sensor_active_sessions AS a
+          ON a.patient_id = cp.patient_id
+        WHERE cp.clinician_id = %s
+        ORDER BY a.started_at DESC
+    """, (clinician_id,))
+    return cursor.fetchall()
@@ -0,0 +1,99 @@
+# singleflight_cache.py
+
+import os
+import threading
+import time
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleflightCache:
+    """
+    Delt cache for beregnede resultater, der er ens for alle brugere.
+      - Samtidige misses på samme nøgle samles: kun én kalder kører `loader`,
+        de øvrige venter på og deler dens resultat (eller fejl).
+      - Et resultat lever `ttl` sekunder. Bliver det efterspurgt inden for de
+        sidste `refresh_ahead` sekunder, genberegnes det i baggrunden, mens det
+        gamle resultat fortsat udleveres – så brugerne normalt aldrig venter.
+      - Fejl caches ikke.
+    Cachen er pr. proces; databasebelastningen skalerer derfor med antal
+    processer og nøgler, ikke med antal brugere.
+    """
+
+    def __init__(self, ttl=60.0, refresh_ahead=10.0, name="cache"):
+        self.ttl = ttl
+        self.refresh_ahead = min(refresh_ahead, ttl)
+        self.name = name
+        self._entries = {}      # nøgle → (udløb, værdi)
+        self._flights = {}      # nøgle → _Flight
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "coalesced": 0, "refreshes": 0, "errors": 0}
+
+    def get(self, key, loader):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._stats["hits"] += 1
+                if entry[0] - now < self.refresh_ahead and key not in self._flights:
+                    flight = self._flights[key] = _Flight()
+                    self._stats["refreshes"] += 1
+                    threading.Thread(
+                        target=self._load, args=(key, loader, flight),
+                        name=f"{self.name}-refresh", daemon=True,
+                    ).start()
+                return entry[1]
+
+            self._stats["misses"] += 1
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                self._stats["coalesced"] += 1
+
+        if leader:
+            self._load(key, loader, flight)
+        else:
+            flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.value
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, entries=len(self._entries), ttl=self.ttl)
+
+    def _load(self, key, loader, flight):
+        try:
+            flight.value = loader()
+            with self._lock:
+                self._entries[key] = (time.monotonic() + self.ttl, flight.value)
+        except Exception as e:
+            flight.error = e
+            with self._lock:
+                self._stats["errors"] += 1
+            print(f"[{__name__}] {self.name}: fejl ved beregning af {key!r}: {e}")
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+
+customer_light_cache = SingleflightCache(
+    ttl=float(os.environ.get("CUSTOMER_LIGHT_CACHE_TTL_S", 60.0)),
+    refresh_ahead=float(os.environ.get("CUSTOMER_LIGHT_CACHE_REFRESH_S", 10.0)),
+    name="customer-light",
+)
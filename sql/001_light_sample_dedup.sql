@@ -0,0 +1,25 @@
+-- sql/001_light_sample_dedup.sql
+-- Gør indsættelse i patient_light_sensor_data idempotent på (patient_id, sensor_id, captured_at).
+-- sensor_id kan være NULL, og NULL tæller ikke som ens i et UNIQUE‐indeks, så nøglen
+-- bygges på en genereret kolonne, hvor NULL erstattes af 0.
+
+-- 1) Fjern eksisterende dubletter (behold den ældste række)
+DELETE d
+FROM patient_light_sensor_data AS d
+JOIN patient_light_sensor_data AS k
+  ON  k.patient_id = d.patient_id
+  AND k.sensor_id <=> d.sensor_id
+  AND k.captured_at = d.captured_at
+  AND k.id < d.id;
+
+-- 2) Unik naturlig nøgle
+ALTER TABLE patient_light_sensor_data
+  ADD COLUMN sensor_key INT AS (IFNULL(sensor_id, 0)) STORED,
+  ADD UNIQUE KEY uq_light_sample (patient_id, sensor_key, captured_at);
+
+-- 3) Klient‐batch‐id'er, så en gentaget batch kan genkendes uden at kigge på hvert datapunkt
+CREATE TABLE IF NOT EXISTS light_ingest_batches (
+  batch_id     VARCHAR(64) NOT NULL PRIMARY KEY,
+  sample_count INT         NOT NULL,
+  received_at  DATETIME    NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
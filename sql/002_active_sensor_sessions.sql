@@ -0,0 +1,28 @@
+-- sql/002_active_sensor_sessions.sql
+-- Én række pr. (patient_id, sensor_id) med en åben session i patient_sensor_log.
+-- Holdes i sync transaktionelt af sensor_sessions.py, så åbning/lukning af en session
+-- og "hvem har en aktiv sensor" er opslag på primærnøglen i stedet for scanning af loggen.
+
+CREATE TABLE IF NOT EXISTS patient_sensor_active_sessions (
+  patient_id VARCHAR(64) NOT NULL,
+  sensor_id  INT         NOT NULL,
+  log_id     INT         NOT NULL,
+  started_at DATETIME    NOT NULL,
+  PRIMARY KEY (patient_id, sensor_id),
+  UNIQUE KEY uq_active_log (log_id)
+);
+
+-- Backfill: seneste åbne log pr. (patient_id, sensor_id)
+INSERT IGNORE INTO patient_sensor_active_sessions (patient_id, sensor_id, log_id, started_at)
+SELECT l.patient_id, l.sensor_id, l.id, l.started_at
+FROM patient_sensor_log AS l
+JOIN (
+  SELECT patient_id, sensor_id, MAX(started_at) AS started_at
+  FROM patient_sensor_log
+  WHERE ended_at IS NULL
+  GROUP BY patient_id, sensor_id
+) AS latest
+  ON  latest.patient_id = l.patient_id
+  AND latest.sensor_id  = l.sensor_id
+  AND latest.started_at = l.started_at
+WHERE l.ended_at IS NULL;
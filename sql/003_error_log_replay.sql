@@ -0,0 +1,7 @@
+-- sql/003_error_log_replay.sql
+-- Markerer error_logs‐rækker, der er genafspillet af error_log_replay.py.
+
+ALTER TABLE error_logs
+  ADD COLUMN replayed_at   DATETIME    NULL,
+  ADD COLUMN replay_status VARCHAR(32) NULL,
+  ADD KEY idx_error_logs_pending (replayed_at, id);
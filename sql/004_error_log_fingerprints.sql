@@ -0,0 +1,25 @@
+-- sql/004_error_log_fingerprints.sql
+-- Aggregerede fejllogs: én række pr. fingerprint (endpoint + normaliseret fejlbesked)
+-- og tællere pr. minut, så en fejlstorm ikke giver én INSERT pr. hændelse.
+
+CREATE TABLE IF NOT EXISTS error_log_fingerprints (
+  fingerprint   CHAR(16)     NOT NULL PRIMARY KEY,
+  endpoint      VARCHAR(255) NOT NULL,
+  message       TEXT         NOT NULL,
+  total_count   BIGINT       NOT NULL DEFAULT 0,
+  first_seen    DATETIME     NOT NULL,
+  last_seen     DATETIME     NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS error_log_counts (
+  fingerprint  CHAR(16) NOT NULL,
+  window_start DATETIME NOT NULL,
+  count        INT      NOT NULL,
+  PRIMARY KEY (fingerprint, window_start),
+  KEY idx_error_log_counts_window (window_start)
+);
+
+-- De gemte eksempel‐payloads ligger fortsat i error_logs (så de kan genafspilles)
+ALTER TABLE error_logs
+  ADD COLUMN fingerprint CHAR(16) NULL,
+  ADD KEY idx_error_logs_fingerprint (fingerprint);
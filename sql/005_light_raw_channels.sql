@@ -0,0 +1,8 @@
+-- sql/005_light_raw_channels.sql
+-- Rå sensorkanaler gemmes sammen med datapunktet, så de afledte mål kan beregnes
+-- på serveren (light_metrics.py) og genberegnes, når koefficienterne ændres.
+-- metrics_version er NULL for rækker, hvor klienten selv har beregnet målene.
+
+ALTER TABLE patient_light_sensor_data
+  ADD COLUMN raw_channels    JSON     NULL,
+  ADD COLUMN metrics_version SMALLINT NULL;
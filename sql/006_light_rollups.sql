@@ -0,0 +1,55 @@
+-- sql/006_light_rollups.sql
+-- Time‐ og dagsopsummeringer pr. patient. Holdes ajour af light_rollups.py ved
+-- hver indsættelse; weekly/monthly læser dagsrækkerne herfra.
+-- Middelværdier beregnes ved læsning som <metric>_sum / <metric>_count.
+
+CREATE TABLE IF NOT EXISTS patient_light_rollups (
+  patient_id            VARCHAR(64)          NOT NULL,
+  bucket                ENUM('hour', 'day')  NOT NULL,
+  bucket_start          DATETIME             NOT NULL,
+  total_measurements    INT                  NOT NULL,
+  count_high_light      INT                  NOT NULL,
+  count_low_light       INT                  NOT NULL,
+  action_required_count INT                  NOT NULL,
+  edi_count             INT                  NOT NULL,
+  edi_sum               DOUBLE               NOT NULL,
+  edi_min               DOUBLE               NULL,
+  edi_max               DOUBLE               NULL,
+  lux_count             INT                  NOT NULL,
+  lux_sum               DOUBLE               NOT NULL,
+  lux_min               DOUBLE               NULL,
+  lux_max               DOUBLE               NULL,
+  score_count           INT                  NOT NULL,
+  score_sum             DOUBLE               NOT NULL,
+  score_min             DOUBLE               NULL,
+  score_max             DOUBLE               NULL,
+  PRIMARY KEY (patient_id, bucket, bucket_start)
+);
+
+-- Rå data slås op på (patient_id, captured_at) ved genberegning af en time
+ALTER TABLE patient_light_sensor_data
+  ADD KEY idx_light_patient_captured (patient_id, captured_at);
+
+-- Backfill: timer fra rå data …
+INSERT INTO patient_light_rollups
+SELECT patient_id, 'hour', DATE_FORMAT(captured_at, '%Y-%m-%d %H:00:00'),
+       COUNT(*),
+       SUM(CASE WHEN illuminance >= 1000 THEN 1 ELSE 0 END),
+       SUM(CASE WHEN illuminance <  1000 THEN 1 ELSE 0 END),
+       SUM(CASE WHEN action_required THEN 1 ELSE 0 END),
+       COUNT(melanopic_edi),  COALESCE(SUM(melanopic_edi), 0),  MIN(melanopic_edi),  MAX(melanopic_edi),
+       COUNT(illuminance),    COALESCE(SUM(illuminance), 0),    MIN(illuminance),    MAX(illuminance),
+       COUNT(exposure_score), COALESCE(SUM(exposure_score), 0), MIN(exposure_score), MAX(exposure_score)
+FROM patient_light_sensor_data
+GROUP BY patient_id, DATE_FORMAT(captured_at, '%Y-%m-%d %H:00:00');
+
+-- … og dage fra timerne
+INSERT INTO patient_light_rollups
+SELECT patient_id, 'day', DATE(bucket_start),
+       SUM(total_measurements), SUM(count_high_light), SUM(count_low_light), SUM(action_required_count),
+       SUM(edi_count),   SUM(edi_sum),   MIN(edi_min),   MAX(edi_max),
+       SUM(lux_count),   SUM(lux_sum),   MIN(lux_min),   MAX(lux_max),
+       SUM(score_count), SUM(score_sum), MIN(score_min), MAX(score_max)
+FROM patient_light_rollups
+WHERE bucket = 'hour'
+GROUP BY patient_id, DATE(bucket_start);
@@ -0,0 +1,9 @@
+-- sql/007_light_rollup_updated_at.sql
+-- Tidsstempel for seneste ændring af en rollup‐række. Rollups opdateres i samme
+-- transaktion som de rå data, så MAX(updated_at) over en patients timer er en
+-- billig validator (ETag / Last-Modified) for lysdata‐endpoints – uden at røre
+-- patient_light_sensor_data. Se light_validators.py.
+
+ALTER TABLE patient_light_rollups
+  ADD COLUMN updated_at TIMESTAMP NOT NULL
+      DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP;
@@ -0,0 +1,35 @@
+-- sql/008_sensor_liveness.sql
+-- Seneste livstegn og registrerede huller pr. sensor. Holdes ajour af
+-- sensor_liveness.py i samme transaktion som indsættelsen af lysdata, så
+-- "hvilke sensorer er tavse" er opslag på primærnøglen i stedet for en scanning
+-- af patient_light_sensor_data.
+
+CREATE TABLE IF NOT EXISTS patient_sensor_liveness (
+  patient_id       VARCHAR(64) NOT NULL,
+  sensor_id        INT         NOT NULL,
+  first_seen_at    DATETIME    NOT NULL,   -- ældste captured_at
+  last_seen_at     DATETIME    NOT NULL,   -- nyeste captured_at
+  last_received_at DATETIME    NOT NULL,   -- servertid for seneste modtagne datapunkt
+  PRIMARY KEY (patient_id, sensor_id)
+);
+
+-- Perioder uden datapunkter, der er længere end SENSOR_GAP_MIN minutter
+CREATE TABLE IF NOT EXISTS patient_sensor_gaps (
+  id          INT         NOT NULL AUTO_INCREMENT,
+  patient_id  VARCHAR(64) NOT NULL,
+  sensor_id   INT         NOT NULL,
+  gap_start   DATETIME    NOT NULL,   -- sidste datapunkt før hullet
+  gap_end     DATETIME    NOT NULL,   -- første datapunkt efter hullet
+  duration_s  INT         NOT NULL,
+  detected_at TIMESTAMP   NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (id),
+  KEY idx_gaps_sensor_start (patient_id, sensor_id, gap_start)
+);
+
+-- Backfill af livstegn fra eksisterende data (historiske huller genberegnes ikke)
+INSERT IGNORE INTO patient_sensor_liveness
+  (patient_id, sensor_id, first_seen_at, last_seen_at, last_received_at)
+SELECT patient_id, sensor_id, MIN(captured_at), MAX(captured_at), MAX(captured_at)
+FROM patient_light_sensor_data
+WHERE sensor_id IS NOT NULL
+GROUP BY patient_id, sensor_id;
@@ -0,0 +1,29 @@
+-- sql/009_light_export_jobs.sql
+-- Asynkrone eksportjob for lysdata (se light_export.py). Tabellen er både kø og
+-- statusside: jobbet oprettes som 'queued', en worker gør det til 'running' med en
+-- betinget UPDATE, og fremdriften skrives løbende, så enhver proces kan svare på
+-- polling. updated_at fungerer som heartbeat for kørende job.
+
+CREATE TABLE IF NOT EXISTS light_export_jobs (
+  job_id       CHAR(32)     NOT NULL,
+  requested_by VARCHAR(64)  NOT NULL,
+  scope        ENUM('patient', 'cohort')                               NOT NULL,
+  subject_id   VARCHAR(64)  NOT NULL,   -- patient_id eller clinician_id
+  from_dt      DATETIME     NULL,
+  to_dt        DATETIME     NULL,
+  format       ENUM('csv', 'parquet')                                  NOT NULL,
+  gzip         TINYINT(1)   NOT NULL DEFAULT 0,
+  status       ENUM('queued', 'running', 'done', 'failed', 'expired')  NOT NULL DEFAULT 'queued',
+  rows_total   BIGINT       NULL,       -- skøn fra patient_light_rollups
+  rows_written BIGINT       NOT NULL DEFAULT 0,
+  file_name    VARCHAR(255) NULL,
+  size_bytes   BIGINT       NULL,
+  error        VARCHAR(500) NULL,
+  created_at   TIMESTAMP    NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  started_at   DATETIME     NULL,
+  finished_at  DATETIME     NULL,
+  updated_at   TIMESTAMP    NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  PRIMARY KEY (job_id),
+  KEY idx_export_status (status, updated_at),
+  KEY idx_export_requester (requested_by, created_at)
+);
@@ -0,0 +1,18 @@
+-- sql/010_light_upload_progress.sql
+-- Fremdrift for genoptagelige NDJSON‐uploads (se ndjson_upload.py). Skrives i samme
+-- transaktion som hver indsat bid, så committed_offset aldrig peger forbi data, der
+-- ikke nåede databasen, og kan læses af enhver proces bag load balanceren.
+
+CREATE TABLE IF NOT EXISTS light_upload_progress (
+  upload_id        VARCHAR(64) NOT NULL,
+  committed_offset BIGINT      NOT NULL DEFAULT 0,
+  accepted         BIGINT      NOT NULL DEFAULT 0,
+  new_rows         BIGINT      NOT NULL DEFAULT 0,
+  duplicates       BIGINT      NOT NULL DEFAULT 0,
+  rejected         BIGINT      NOT NULL DEFAULT 0,
+  rejected_lines   TEXT        NOT NULL,   -- JSON, højst 100 {"line", "error"}
+  complete         TINYINT(1)  NOT NULL DEFAULT 0,
+  updated_at       TIMESTAMP   NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  PRIMARY KEY (upload_id),
+  KEY idx_upload_progress_updated (complete, updated_at)
+);
@@ -0,0 +1,15 @@
+-- sql/011_close_duplicate_sensor_sessions.sql
+-- Backfill'en i 002 registrerede kun den nyeste åbne log pr. (patient_id, sensor_id)
+-- i patient_sensor_active_sessions; ældre åbne logs for samme sensor (og logs med
+-- samme started_at som den valgte) blev stående med ended_at IS NULL. De lukkes her
+-- som 'auto_closed' på det tidspunkt, hvor den aktive session startede – ligesom
+-- open_session() ville have gjort.
+
+UPDATE patient_sensor_log AS l
+JOIN patient_sensor_active_sessions AS a
+  ON  a.patient_id = l.patient_id
+  AND a.sensor_id  = l.sensor_id
+SET l.ended_at = a.started_at,
+    l.status   = 'auto_closed'
+WHERE l.ended_at IS NULL
+  AND l.id <> a.log_id;
@@ -0,0 +1,8 @@
+-- sql/012_battery_status_latest.sql
+-- battery_cache.py indlæser seneste niveau pr. sensor/patient ved et cache‐miss
+-- (ORDER BY id DESC LIMIT 1). Indeksene gør det til et opslag i stedet for en
+-- scanning af hele patient_battery_status; id ligger implicit sidst i nøglen.
+
+ALTER TABLE patient_battery_status
+  ADD KEY idx_battery_patient_sensor (patient_id, sensor_id),
+  ADD KEY idx_battery_sensor (sensor_id);
@@ -0,0 +1,6 @@
+-- sql/013_error_log_replay_error.sql
+-- Fejlbeskeden for error_logs‐rækker, som error_log_replay.py ikke kunne indsætte
+-- (replay_status = 'failed'), så de kan undersøges uden at stoppe resten af genafspilningen.
+
+ALTER TABLE error_logs
+  ADD COLUMN replay_error TEXT NULL;